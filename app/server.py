@@ -1,72 +1,396 @@
 # server.py - 优化的艺术作品截图系统 (琉璃光影主题)
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError
+from dataclasses import dataclass
+from enum import Enum
 import uvicorn
 import asyncio
+import functools
+import logging
 import uuid
 import time
 import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import multiprocessing
 import os
-from typing import Optional
+import queue
+import re
+import shutil
+import socket
+import struct
+import sys
+import threading
+import weakref
+import zipfile
+from collections import deque
+from typing import Optional, List, Tuple
 import qrcode
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image, ImageFilter, features
 
 # 环境变量配置
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", 8000))
-# 动态使用主机和端口生成SERVER_URL，确保在不同环境中都能正常工作
-# 在生产环境中，您可能需要手动设置SERVER_URL为一个可公开访问的地址
-SERVER_URL = os.getenv("SERVER_URL", f"http://{HOST}:{PORT}") 
-if HOST == "0.0.0.0":
-    # 如果HOST是0.0.0.0，二维码URL最好使用一个具体的IP地址，如localhost或局域网IP
-    # 这里我们默认为localhost，您也可以手动替换为您的局域网IP地址
-    try:
-        import socket
-        # 尝试获取本机局域网IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-        SERVER_URL = f"http://{local_ip}:{PORT}"
-    except Exception:
-        SERVER_URL = f"http://localhost:{PORT}" # 获取失败则回退
+# 二维码中的服务器地址：设置 SERVER_URL 时直接使用（生产环境建议设置为可公开访问的地址）；
+# 否则在首次需要时从本机网络接口中选取局域网地址，SERVER_INTERFACE 可指定接口名（如 eth0、wlan0）
+SERVER_URL_OVERRIDE = os.getenv("SERVER_URL")
+SERVER_INTERFACE = os.getenv("SERVER_INTERFACE")
+SIOCGIFADDR = 0x8915  # Linux: 读取接口的IPv4地址
 
 app = FastAPI()
 
-# 内存存储（生产环境建议使用Redis）
-screenshot_requests = {}
-screenshots = {}
+# 日志输出到 uvicorn 的错误日志（默认即控制台）
+logger = logging.getLogger("uvicorn.error")
+
+def list_interface_addresses() -> List[Tuple[str, str]]:
+    """
+    枚举本机网络接口的IPv4地址，返回 [(接口名, 地址)]
+
+    只读取本机的接口配置，不需要外部路由，断网的展厅中同样可用。Linux 上按接口逐个读取；
+    其他平台（或读取失败时）使用主机名解析到的地址，接口名为空。
+    """
+    addresses = []
+    try:
+        import fcntl
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for _, name in socket.if_nameindex():
+                try:
+                    packed = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, struct.pack("256s", name.encode()[:15]))
+                except OSError:
+                    continue  # 接口未启用或没有IPv4地址
+                addresses.append((name, socket.inet_ntoa(packed[20:24])))
+    except (ImportError, OSError):
+        pass
+    if not addresses:
+        try:
+            infos = socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)
+        except OSError:
+            infos = []
+        addresses = [("", address) for address in dict.fromkeys(info[4][0] for info in infos)]
+    return addresses
+
+def pick_lan_address(addresses: List[Tuple[str, str]], interface: Optional[str] = None) -> Optional[str]:
+    """选取手机可以访问的地址：指定接口的地址，否则优先私有网段，排除回环和链路本地地址"""
+    if interface:
+        return next((address for name, address in addresses if name == interface), None)
+    candidates = [address for _, address in addresses
+                  if not ipaddress.ip_address(address).is_loopback and not ipaddress.ip_address(address).is_link_local]
+    return next((address for address in candidates if ipaddress.ip_address(address).is_private),
+                candidates[0] if candidates else None)
+
+def resolve_server_url() -> str:
+    """按 SERVER_URL、HOST、本机接口的顺序确定二维码中的服务器地址，找不到局域网地址时回退到localhost"""
+    if SERVER_URL_OVERRIDE:
+        return SERVER_URL_OVERRIDE.rstrip("/")
+    if HOST not in ("0.0.0.0", "::", ""):
+        return f"http://{HOST}:{PORT}"
+    address = pick_lan_address(list_interface_addresses(), SERVER_INTERFACE)
+    if address is None:
+        if SERVER_INTERFACE:
+            logger.warning(f"网络接口 {SERVER_INTERFACE} 没有IPv4地址，二维码使用localhost")
+        return f"http://localhost:{PORT}"
+    return f"http://{address}:{PORT}"
+
+# 解析结果缓存，网络变化后通过 /api/server-url/refresh 重新解析
+_server_url: Optional[str] = None
+
+def get_server_url() -> str:
+    global _server_url
+    if _server_url is None:
+        _server_url = resolve_server_url()
+        logger.info(f"手机扫码将访问: {_server_url}/mobile")
+    return _server_url
+
+# 解码、编码、压缩、摘要等CPU密集操作在线程池中执行，PIL/zlib/hashlib 处理大数据时会释放GIL，
+# 事件循环在此期间仍能响应其他连接
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", min(4, os.cpu_count() or 1)))
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+
+# 事件循环卡顿监控：每隔 LOOP_LAG_INTERVAL 秒检查一次，延迟超过阈值时记录日志
+LOOP_LAG_INTERVAL = 0.1
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.1))
+event_loop_lag = {"max": 0.0, "stalls": 0}
+
+# 在线诊断：设置 DEBUG_TOKEN 后启用 /debug/profile 和 /debug/tasks，请求需带
+# "Authorization: Bearer <DEBUG_TOKEN>"（或 ?token=）。未设置时这些接口返回404，也不记录任务创建时间
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+PROFILE_MAX_SECONDS = 60
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# 请求保留时长（秒）
+REQUEST_TTL = 3600
+# 过期请求的清理周期（秒）
+CLEANUP_INTERVAL = 300
+
+# 时间源：请求、截图、上传和房间活动的时间戳都通过 clock() 获取。CLOCK_SPEED 大于1时
+# 时间按倍数加速流逝、清理周期相应缩短，浸泡测试可以在几分钟内重放数小时的流量；正常运行时为1
+CLOCK_SPEED = float(os.getenv("CLOCK_SPEED", 1))
+CLOCK_ORIGIN = time.time()
+
+def clock() -> float:
+    """当前时间（秒），按 CLOCK_SPEED 加速"""
+    return CLOCK_ORIGIN + (time.time() - CLOCK_ORIGIN) * CLOCK_SPEED
+
+# 有手机端活动时建议电脑端使用的轮询间隔（秒）
+ACTIVE_POLL_INTERVAL = float(os.getenv("ACTIVE_POLL_INTERVAL", 0.5))
+# 最近一次手机端活动后多长时间内视为有观众在场（秒）
+VIEWER_ACTIVE_WINDOW = 60
+# 电脑端的轮询、上传（包括分块上传的每一块）和实时推流兼作心跳，超过该时长（秒）没有心跳视为离线，
+# 手机端的截图请求被立即拒绝。check-requests 返回 heartbeat_interval = DEVICE_TIMEOUT / 3，电脑端空闲时的
+# 轮询间隔不超过它；默认值同时大于电脑端默认的最大轮询间隔（10秒），不读取该提示的旧版电脑端也不会被误判离线
+DEVICE_TIMEOUT = float(os.getenv("DEVICE_TIMEOUT", 30))
+# 截图耗时估计使用最近多少次截图
+CAPTURE_LATENCY_SAMPLES = 20
+
+# 房间：一台服务器同时服务多个展项，每个展项的二维码、请求队列、基准帧和实时画面相互独立。
+# 不带 room 参数的访问属于默认房间，与单展项部署的行为一致
+DEFAULT_ROOM = "default"
+ROOM_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+# 房间只在电脑端首次轮询或推流时创建，手机端访问未知房间返回404；限制总数避免任意房间名耗尽内存
+MAX_ROOMS = int(os.getenv("MAX_ROOMS", 256))
+
+class RequestStatus(str, Enum):
+    PENDING = "pending"
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+
+@dataclass(slots=True)
+class RequestRecord:
+    """截图请求记录，使用 __slots__ 避免每条记录携带一个字典"""
+    user_id: str
+    timestamp: float
+    status: RequestStatus = RequestStatus.PENDING
+    viewport_width: Optional[int] = None
+    device_pixel_ratio: Optional[float] = None
+    full_resolution_of: Optional[bytes] = None  # 原图来源请求的16字节键
+    room: str = DEFAULT_ROOM
+
+    def to_dict(self, key: bytes) -> dict:
+        """转换为发给电脑端的请求信息"""
+        return {
+            "request_id": format_request_id(key),
+            "user_id": self.user_id,
+            "timestamp": self.timestamp,
+            "status": self.status.value,
+            "viewport_width": self.viewport_width,
+            "device_pixel_ratio": self.device_pixel_ratio,
+            "full_resolution_of": format_request_id(self.full_resolution_of) if self.full_resolution_of else None,
+            "room": self.room
+        }
+
+@dataclass(slots=True)
+class ScreenshotRecord:
+    """截图结果：引用一个图片内容块，或是尚未编码的增量重建画面"""
+    timestamp: float
+    digest: Optional[str] = None  # 图片内容块的SHA-256
+    image: Optional[Image.Image] = None
+
+@dataclass(slots=True)
+class ImageBlob:
+    """按内容寻址的图片：内存中的PNG字节或分块上传的文件，多个请求共享同一份"""
+    size: int
+    refcount: int = 1
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+    width: int = 0  # 首次需要时从图片头读取
+    height: int = 0
+    variants: Optional[dict] = None  # 已生成的缩小变体: 名称 -> 图片字节
+    preview: Optional[str] = None  # 内联预览的 data URI
+
+def parse_request_id(request_id: str) -> Optional[bytes]:
+    """把字符串形式的请求ID转换为16字节键，格式无效时返回None"""
+    try:
+        return uuid.UUID(request_id).bytes
+    except ValueError:
+        return None
+
+def format_request_id(key: bytes) -> str:
+    """把16字节键转换回字符串形式的请求ID"""
+    return str(uuid.UUID(bytes=key))
+
+# 内存存储（生产环境建议使用Redis），键为请求ID的16字节形式
+screenshot_requests: dict = {}  # 键 -> RequestRecord
+screenshots: dict = {}  # 键 -> ScreenshotRecord
+image_blobs: dict = {}  # SHA-256 -> ImageBlob
+# 去重计数：保存的截图总数、其中内容已存在的次数
+dedup_counters = {"stored": 0, "duplicates": 0}
+
+# 按内容寻址的图片地址内容不会变化，允许浏览器长期缓存
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# 响应式图片变体: 名称 -> 最大宽度（None表示保持原尺寸），手机页面通过 srcset 按需选择，
+# 全屏查看时仍使用原图
+IMAGE_VARIANTS = {"thumb": 320, "mobile": 750, "full": None}
+VARIANT_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+VARIANT_EXTENSION = {"WEBP": "webp", "JPEG": "jpg"}[VARIANT_FORMAT]
+VARIANT_MEDIA_TYPE = {"WEBP": "image/webp", "JPEG": "image/jpeg"}[VARIANT_FORMAT]
+VARIANT_QUALITY = 80
+# 生成变体的进程数，0表示不使用进程池、直接在事件循环中生成（仅适合调试）
+VARIANT_WORKERS = int(os.getenv("VARIANT_WORKERS", min(4, os.cpu_count() or 1)))
+_variant_pool: Optional[ProcessPoolExecutor] = None
+# 正在生成的变体: (摘要, 名称) -> Future，同一变体的并发请求共用一次生成
+variant_tasks: dict = {}
+# 内联预览：极小的模糊JPEG，随截图结果直接返回，手机页面先显示它，缩小变体下载完成后再替换
+PREVIEW_WIDTH = 32
+PREVIEW_QUALITY = 50
+PREVIEW_BLUR = 1.0
+# 正在生成的预览: 摘要 -> Future，同一画面的多个手机共用一次生成
+preview_tasks: dict = {}
+
+# 实时观看：有手机订阅时电脑端按目标帧率推送JPEG帧，服务器只保留最新一帧并通过 WebSocket 扇出给所有订阅者
+LIVE_FPS = float(os.getenv("LIVE_FPS", 5))
+# 电脑端推送画面的最大宽度
+LIVE_MAX_WIDTH = int(os.getenv("LIVE_MAX_WIDTH", 1280))
+LIVE_MAX_FRAME_SIZE = 8 * 1024 * 1024
+# 画质档位: 名称 -> 最大宽度（None表示保持推送的尺寸），从高到低排列，低档位按需由最高档生成
+LIVE_TIERS = {"high": None, "medium": 720, "low": 360}
+LIVE_QUALITY = 70
+# 自动档位：连续多少帧发送过慢或被跳过时降一档，连续多少帧顺畅时升一档
+LIVE_DOWNGRADE_STRIKES = 3
+LIVE_UPGRADE_FRAMES = 50
+# 等待手机确认一帧的最长时间（秒），超时视为连接已失效
+LIVE_ACK_TIMEOUT = 30
+
+# 延时摄影：开启后服务器每隔 interval 秒安排一次截图请求，电脑端按普通请求上传，
+# 结果缩小编码后写入磁盘上的环形缓冲区（只保留最近 TIMELAPSE_CAPACITY 帧），内存中只有帧索引
+TIMELAPSE_DIR = os.getenv("TIMELAPSE_DIR", os.path.join("static", "timelapse"))
+TIMELAPSE_CAPACITY = int(os.getenv("TIMELAPSE_CAPACITY", 1000))
+# 开机即开始录制的间隔（秒），0表示需要通过 /api/timelapse/start 开启
+TIMELAPSE_INTERVAL = float(os.getenv("TIMELAPSE_INTERVAL", 0))
+# /api/timelapse/start 和 /api/timelapse/stop 需带 "Authorization: Bearer <TIMELAPSE_TOKEN>"（或 ?token=），
+# 未设置时这两个接口返回404，只能通过 TIMELAPSE_INTERVAL 开机录制
+TIMELAPSE_TOKEN = os.getenv("TIMELAPSE_TOKEN")
+TIMELAPSE_MAX_WIDTH = int(os.getenv("TIMELAPSE_MAX_WIDTH", 1280))
+TIMELAPSE_QUALITY = 75
+# 延时摄影请求多久未完成即放弃本帧（秒）
+TIMELAPSE_REQUEST_TIMEOUT = 30
+TIMELAPSE_TICK = 0.5
+# 延时摄影请求发往哪个房间的电脑端
+TIMELAPSE_ROOM = os.getenv("TIMELAPSE_ROOM", DEFAULT_ROOM)
+
+@dataclass(slots=True)
+class TimelapseFrame:
+    """环形缓冲区中一帧的索引"""
+    seq: int
+    timestamp: float
+    size: int
+    width: int
+    height: int
+
+# 录制状态；pending 为等待电脑端完成的延时摄影请求键
+timelapse = {"active": False, "interval": 0.0, "next_due": 0.0, "pending": None, "next_seq": 1}
+timelapse_frames: deque = deque()  # TimelapseFrame，按序号递增
+timelapse_counters = {"recorded": 0, "missed": 0, "evicted": 0}
+# 正在进行的导出数；导出期间被淘汰的帧文件暂不删除，导出结束后统一清理
+timelapse_exports = {"active": 0, "trash": []}
+
+# 分块上传：大截图按块写入磁盘临时文件，完成后直接以文件形式提供
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 256 * 1024 * 1024))
+# 进行中的分块上传: upload_id -> {key, path, offset, total_size, sha256, frame_id, timestamp}
+chunked_uploads = {}
+
+# 状态日志：设置后把请求的状态变化追加写入该目录，重启后回放恢复，不设置时状态只保存在内存中。
+# 日志中包含请求ID和截图，必须放在持久化且不对外提供静态访问的目录（例如 data/journal），不能放在 static/ 下
+JOURNAL_DIR = os.getenv("JOURNAL_DIR")
+# 同一时间窗口（秒）内的状态变化合并写入，只做一次 fsync
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", 0.05))
+# 日志超过该条数时压缩为快照
+JOURNAL_COMPACT_ENTRIES = int(os.getenv("JOURNAL_COMPACT_ENTRIES", 50000))
 
 class ScreenshotRequest(BaseModel):
     user_id: str
+    # 手机端显示截图的宽度（CSS像素）和设备像素比，电脑端据此缩小画面后再编码
+    viewport_width: Optional[int] = Field(None, gt=0, le=10000)
+    device_pixel_ratio: Optional[float] = Field(None, gt=0, le=10)
+    # 请求某次已完成截图的全分辨率原图（例如用户打开全屏查看时）
+    full_resolution_of: Optional[str] = None
+    room: str = DEFAULT_ROOM  # 手机扫码进入的房间
 
 class ScreenshotUpload(BaseModel):
     request_id: str
     image_data: str  # base64编码的图片
+    frame_id: Optional[str] = None  # 提供时该帧将作为后续增量上传的基准帧
+
+class TileData(BaseModel):
+    x: int
+    y: int
+    image_data: str  # base64编码的PNG图块
+
+class ScreenshotDeltaUpload(BaseModel):
+    request_id: str
+    base_frame_id: str  # 客户端认为服务器持有的基准帧ID
+    frame_id: str  # 应用增量后新画面的ID
+    width: int
+    height: int
+    tiles: List[TileData]  # 相对基准帧发生变化的图块
+
+class ChunkedUploadInit(BaseModel):
+    request_id: str
+    total_size: int = Field(..., gt=0)  # 完整PNG的字节数
+    sha256: Optional[str] = None  # 提供时在完成上传时校验
+    frame_id: Optional[str] = None  # 提供时该帧将作为后续增量上传的基准帧
+
+class TimelapseStart(BaseModel):
+    interval: float = Field(..., gt=0)  # 拍摄间隔（秒）
+    clear: bool = False  # 开始新作品时清空已录制的帧
 
 # 创建静态文件目录
 os.makedirs("static", exist_ok=True)
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(TIMELAPSE_DIR, exist_ok=True)
 
 # 挂载静态文件
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-@app.get("/")
-async def root():
-    """首页 - 生成二维码 (全新琉璃光影主题)"""
-    # 二维码指向的URL（手机扫码后访问的页面）
-    qr_url = f"{SERVER_URL}/mobile"
-    
-    # 生成二维码
+async def run_cpu(func, *args):
+    """在CPU线程池中执行阻塞操作，避免卡住事件循环"""
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, functools.partial(func, *args))
+
+async def parse_body(request: Request, model):
+    """在CPU线程池中解析并校验较大的JSON请求体，校验失败时与 FastAPI 一样返回422"""
+    body = await request.body()
+    try:
+        return await run_cpu(model.model_validate_json, body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+# 首页二维码缓存: 二维码地址 -> base64 PNG
+qr_cache: dict = {}
+
+def make_qr_base64(url: str) -> str:
+    """生成二维码PNG并返回base64字符串"""
     qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(qr_url)
+    qr.add_data(url)
     qr.make(fit=True)
     
     qr_img = qr.make_image(fill_color="black", back_color="white")
     buffer = BytesIO()
     qr_img.save(buffer, format='PNG')
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
+    return base64.b64encode(buffer.getvalue()).decode()
+
+@app.get("/")
+async def root(room: str = DEFAULT_ROOM):
+    """首页 - 生成二维码 (全新琉璃光影主题)，每个展项打开 /?room=<房间名> 显示自己的二维码"""
+    # 展项屏幕可能先于电脑端启动，首页只校验房间名，不创建房间
+    if not ROOM_NAME_PATTERN.fullmatch(room):
+        raise HTTPException(status_code=400, detail="Invalid room name")
+    # 二维码指向的URL（手机扫码后访问的页面）
+    server_url = get_server_url()
+    qr_url = f"{server_url}/mobile" if room == DEFAULT_ROOM else f"{server_url}/mobile?room={room}"
+    
+    # 二维码只随地址变化，生成后缓存
+    qr_base64 = qr_cache.get(qr_url)
+    if qr_base64 is None:
+        qr_base64 = qr_cache[qr_url] = await run_cpu(make_qr_base64, qr_url)
     
     html_content = f"""
     <!DOCTYPE html>
@@ -166,7 +490,7 @@ async def root():
             <div class="qr-code">
                 <img src="data:image/png;base64,{qr_base64}" alt="二维码" />
             </div>
-            <p class="footer-text">实时记录，即刻分享</p>
+            <p class="footer-text">{"实时记录，即刻分享" if room == DEFAULT_ROOM else f"展项 {room} · 实时记录，即刻分享"}</p>
         </div>
     </body>
     </html>
@@ -174,8 +498,9 @@ async def root():
     return HTMLResponse(content=html_content)
 
 @app.get("/mobile")
-async def mobile_page():
-    """手机端页面 - 琉璃光影主题"""
+async def mobile_page(room: str = DEFAULT_ROOM):
+    """手机端页面 - 琉璃光影主题，页面脚本从地址中读取 room 参数"""
+    get_room(room).last_seen = clock()
     html_content = """
     <!DOCTYPE html>
     <html lang="zh-CN">
@@ -293,6 +618,23 @@ async def mobile_page():
                 box-shadow: none;
             }
             
+            /* 实时观看按钮 */
+            .live-btn {
+                background: rgba(255, 255, 255, 0.6);
+                border: 1px solid var(--accent-color-end);
+                border-radius: 50px;
+                padding: 10px 25px;
+                font-size: 0.95em;
+                color: var(--accent-color-end);
+                cursor: pointer;
+                transition: all 0.3s ease;
+                width: 220px;
+            }
+            .live-btn.active {
+                background: var(--accent-color-end);
+                color: white;
+            }
+            
             /* 加载动画: 三点脉冲 */
             .loading {
                 display: none;
@@ -363,6 +705,11 @@ async def mobile_page():
                 transform: scale(1);
             }
             
+            /* 内联预览只有几十像素宽，放大后再模糊一些，避免出现色块 */
+            .screenshot.preview {
+                filter: blur(8px);
+            }
+            
             /* 全屏查看 */
             .fullscreen-overlay {
                 position: fixed;
@@ -416,6 +763,10 @@ async def mobile_page():
                     📸 捕捉此刻
                 </button>
                 
+                <button id="liveBtn" class="live-btn" onclick="toggleLive()">
+                    🎬 实时观看
+                </button>
+                
                 <div id="loading" class="loading">
                     <div class="pulsing-dots"><div></div><div></div><div></div></div>
                     <div class="loading-text">正在连接艺术空间...</div>
@@ -437,6 +788,15 @@ async def mobile_page():
         <script>
             let currentRequestId = null;
             let pollInterval = null;
+            // 当前显示的截图（按手机屏幕缩小过）、其原图地址及已加载的全分辨率原图
+            let shownRequestId = null;
+            let shownOriginalUrl = null;
+            const fullResolutionImages = {};
+            // 实时观看中（截图区域显示 MJPEG 画面）
+            let liveMode = false;
+            // 扫码进入的房间，所有请求都带上，只与本展项的电脑端通信
+            const room = new URLSearchParams(location.search).get('room') || 'default';
+            const roomQuery = 'room=' + encodeURIComponent(room);
 
             // 页面加载完成后自动请求一次
             window.addEventListener('load', () => {
@@ -444,6 +804,7 @@ async def mobile_page():
             });
             
             async function requestScreenshot(isAuto = false) {
+                if (liveMode) stopLive();
                 const captureBtn = document.getElementById('captureBtn');
                 const loading = document.getElementById('loading');
                 const loadingText = document.querySelector('.loading-text');
@@ -464,15 +825,29 @@ async def mobile_page():
                     const response = await fetch('/api/request-screenshot', {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ user_id: 'art_viewer_' + Date.now() })
+                        body: JSON.stringify({
+                            user_id: 'art_viewer_' + Date.now(),
+                            // 截图显示区域最宽500px，电脑端据此缩小画面，减少编码和传输量
+                            viewport_width: Math.min(window.innerWidth, 500),
+                            device_pixel_ratio: window.devicePixelRatio || 1,
+                            room: room
+                        })
                     });
                     
+                    if (response.status === 503) {
+                        // 电脑端离线，服务器直接拒绝，无需等待
+                        resetUI();
+                        updateStatus('💤 创作设备暂未连接，请稍后再试。', 'error');
+                        return;
+                    }
                     if (!response.ok) throw new Error('网络请求失败');
                     
                     const data = await response.json();
                     currentRequestId = data.request_id;
                     
-                    updateStatus('⚡ 正在等待创作设备响应...', 'warning');
+                    updateStatus(data.estimated_seconds
+                        ? `⚡ 正在等待创作设备响应（预计约 ${Math.ceil(data.estimated_seconds)} 秒）...`
+                        : '⚡ 正在等待创作设备响应...', 'warning');
                     
                     if (pollInterval) clearInterval(pollInterval);
                     pollInterval = setInterval(checkScreenshot, 1500); // 轮询频率1.5秒
@@ -497,7 +872,7 @@ async def mobile_page():
                 if (!currentRequestId) return;
                 
                 try {
-                    const response = await fetch(`/api/get-screenshot/${currentRequestId}`);
+                    const response = await fetch(`/api/get-screenshot/${currentRequestId}?${roomQuery}`);
                     if (!response.ok) return; // 忽略失败的轮询
                     
                     const data = await response.json();
@@ -508,7 +883,36 @@ async def mobile_page():
                         const screenshot = document.getElementById('screenshot');
                         const screenshotContainer = document.getElementById('screenshotContainer');
                         
-                        screenshot.src = 'data:image/png;base64,' + data.image_data;
+                        // 页面按 srcset 选择合适的缩小变体，全屏查看时使用原图
+                        const showImage = (target) => {
+                            if (data.srcset) {
+                                target.sizes = '(max-width: 540px) 100vw, 500px';
+                                target.srcset = data.srcset;
+                                target.src = data.variants.mobile;
+                            } else {
+                                target.removeAttribute('srcset');
+                                target.src = data.image_url;
+                            }
+                        };
+                        if (data.preview) {
+                            // 先显示内联的模糊预览，缩小变体在后台下载完成（已进入浏览器缓存）后再替换
+                            const requestId = currentRequestId;
+                            screenshot.removeAttribute('srcset');
+                            screenshot.src = data.preview;
+                            screenshot.classList.add('preview');
+                            const loader = new Image();
+                            loader.onload = loader.onerror = () => {
+                                if (shownRequestId !== requestId || liveMode) return;
+                                showImage(screenshot);
+                                screenshot.classList.remove('preview');
+                            };
+                            showImage(loader);
+                        } else {
+                            showImage(screenshot);
+                            screenshot.classList.remove('preview');
+                        }
+                        shownRequestId = currentRequestId;
+                        shownOriginalUrl = data.image_url;
                         screenshotContainer.style.display = 'block';
                         screenshot.classList.add('show');
                         
@@ -525,6 +929,12 @@ async def mobile_page():
                             updateStatus('🎭 可再次点击按钮，捕捉新的创作。', 'info');
                         }, 5000);
 
+                    } else if (data.device_online === false) {
+                        // 等待期间电脑端离线，停止轮询
+                        clearInterval(pollInterval);
+                        currentRequestId = null;
+                        resetUI();
+                        updateStatus('💤 创作设备已断开连接，请稍后再试。', 'error');
                     } else if (data.status === 'processing') {
                         updateStatus('🎨 创作设备正在处理，即将完成...', 'warning');
                     }
@@ -533,6 +943,77 @@ async def mobile_page():
                 }
             }
             
+            // 实时观看：通过 WebSocket 接收JPEG帧显示在截图区域，每显示完一帧回复确认后才会收到下一帧，
+            // 画质档位由服务器按网速自动调整
+            let liveSocket = null;
+            let liveFrameUrl = null;
+
+            function toggleLive() {
+                if (liveMode) {
+                    stopLive();
+                    updateStatus('🎭 已停止实时观看。', 'info');
+                    return;
+                }
+                liveMode = true;
+                const screenshot = document.getElementById('screenshot');
+                const maxWidth = Math.round(Math.min(window.innerWidth, 500) * (window.devicePixelRatio || 1));
+                const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+                const socket = new WebSocket(`${protocol}://${location.host}/api/live/ws?max_width=${maxWidth}&${roomQuery}`);
+                socket.binaryType = 'blob';
+                socket.onmessage = (event) => {
+                    if (typeof event.data === 'string') return; // 帧信息
+                    const previousUrl = liveFrameUrl;
+                    liveFrameUrl = URL.createObjectURL(event.data);
+                    const acknowledge = () => {
+                        if (previousUrl) URL.revokeObjectURL(previousUrl);
+                        if (socket.readyState === WebSocket.OPEN) socket.send('ack');
+                    };
+                    screenshot.onload = () => {
+                        if (!screenshot.classList.contains('show')) {
+                            document.getElementById('screenshotContainer').style.display = 'block';
+                            screenshot.classList.add('show');
+                            updateStatus('🔴 实时观看中，画面随创作同步更新', 'success');
+                        }
+                        acknowledge();
+                    };
+                    screenshot.onerror = acknowledge;
+                    screenshot.src = liveFrameUrl;
+                };
+                socket.onclose = () => {
+                    if (liveMode && liveSocket === socket) {
+                        stopLive();
+                        updateStatus('⚠️ 实时画面已断开，可重新开启。', 'warning');
+                    }
+                };
+                liveSocket = socket;
+
+                screenshot.removeAttribute('srcset');
+                screenshot.classList.remove('show', 'preview');
+                shownRequestId = null;
+                shownOriginalUrl = null;
+                const liveBtn = document.getElementById('liveBtn');
+                liveBtn.classList.add('active');
+                liveBtn.textContent = '⏹ 停止实时观看';
+                updateStatus('🎬 正在等待实时画面...', 'info');
+            }
+            
+            function stopLive() {
+                liveMode = false;
+                if (liveSocket) liveSocket.close();
+                liveSocket = null;
+                const screenshot = document.getElementById('screenshot');
+                screenshot.onload = null;
+                screenshot.onerror = null;
+                screenshot.removeAttribute('src');
+                screenshot.classList.remove('show', 'preview');
+                document.getElementById('screenshotContainer').style.display = 'none';
+                if (liveFrameUrl) URL.revokeObjectURL(liveFrameUrl);
+                liveFrameUrl = null;
+                const liveBtn = document.getElementById('liveBtn');
+                liveBtn.classList.remove('active');
+                liveBtn.textContent = '🎬 实时观看';
+            }
+            
             function updateStatus(message, type) {
                 const statusDiv = document.getElementById('status');
                 statusDiv.innerHTML = `<div class="status-box ${type}">${message}</div>`;
@@ -552,10 +1033,44 @@ async def mobile_page():
                 const fullscreenOverlay = document.getElementById('fullscreenOverlay');
                 const fullscreenImage = document.getElementById('fullscreenImage');
                 
-                if (screenshot.src) {
-                    fullscreenImage.src = screenshot.src;
+                if (screenshot.src && !liveMode) {
+                    // 先显示已有的缩小图，再按需加载全分辨率原图
+                    fullscreenImage.src = fullResolutionImages[shownRequestId] || shownOriginalUrl || screenshot.currentSrc;
                     fullscreenOverlay.style.display = 'flex';
                     document.body.style.overflow = 'hidden';
+                    if (shownRequestId && !fullResolutionImages[shownRequestId]) {
+                        loadFullResolution(shownRequestId);
+                    }
+                }
+            }
+            
+            async function loadFullResolution(sourceRequestId) {
+                try {
+                    const response = await fetch('/api/request-screenshot', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ user_id: 'art_viewer_' + Date.now(), full_resolution_of: sourceRequestId, room: room })
+                    });
+                    if (!response.ok) return;
+                    const requestId = (await response.json()).request_id;
+                    
+                    const deadline = Date.now() + 30000;
+                    while (Date.now() < deadline) {
+                        await new Promise(resolve => setTimeout(resolve, 1500));
+                        const result = await fetch(`/api/get-screenshot/${requestId}?${roomQuery}`);
+                        if (!result.ok) continue;
+                        const data = await result.json();
+                        if (data.status === 'completed') {
+                            fullResolutionImages[sourceRequestId] = data.image_url;
+                            if (shownRequestId === sourceRequestId) {
+                                document.getElementById('fullscreenImage').src = fullResolutionImages[sourceRequestId];
+                            }
+                            return;
+                        }
+                        if (data.device_online === false) return;
+                    }
+                } catch (error) {
+                    console.error('加载原图失败:', error);
                 }
             }
             
@@ -568,6 +1083,7 @@ async def mobile_page():
             // 页面隐藏或卸载时清理定时器
             document.addEventListener('visibilitychange', () => {
                 if (document.hidden && pollInterval) clearInterval(pollInterval);
+                if (document.hidden && liveMode) stopLive();
             });
             window.addEventListener('beforeunload', () => {
                 if (pollInterval) clearInterval(pollInterval);
@@ -580,7 +1096,7 @@ async def mobile_page():
     return HTMLResponse(content=html_content)
 
 # =======================================================
-# 以下为后端API和服务逻辑，与原始代码完全一致，未做任何修改
+# 以下为后端API和服务逻辑
 # =======================================================
 
 # ==================== 新增修改 ====================
@@ -597,91 +1113,1604 @@ async def mobile_page():
 
 @app.post("/api/request-screenshot")
 async def request_screenshot_api(request: ScreenshotRequest): # Renamed to avoid conflict
-    """接收截图请求"""
-    request_id = str(uuid.uuid4())
-    screenshot_requests[request_id] = {
-        "user_id": request.user_id,
-        "timestamp": time.time(),
-        "status": "pending"
-    }
-    return {"request_id": request_id, "status": "created"}
+    """接收截图请求，放入所在房间的待处理队列；电脑端离线时立即返回503，手机端无需空等"""
+    room = get_room(request.room)
+    room.last_seen = clock()
+    if not room.device_online():
+        raise HTTPException(status_code=503, detail="Capture device offline")
+    key = uuid.uuid4().bytes
+    record = screenshot_requests[key] = RequestRecord(
+        user_id=request.user_id,
+        timestamp=clock(),
+        viewport_width=request.viewport_width,
+        device_pixel_ratio=request.device_pixel_ratio,
+        full_resolution_of=parse_request_id(request.full_resolution_of) if request.full_resolution_of else None,
+        room=room.name
+    )
+    room.pending.append(key)
+    if journal is not None:
+        journal.append(("created", key, record))
+    return {"request_id": format_request_id(key), "status": "created", "estimated_seconds": room.capture_latency()}
 
 @app.get("/api/check-requests")
-async def check_requests():
-    """电脑端轮询检查是否有新的截图请求"""
-    pending_requests = [
-        {"request_id": req_id, **req_data} 
-        for req_id, req_data in screenshot_requests.items() 
-        if req_data["status"] == "pending"
-    ]
+async def check_requests(room: str = DEFAULT_ROOM):
+    """电脑端轮询检查本房间是否有新的截图请求，开销只与该房间的待处理请求数有关（轮询兼作心跳）"""
+    room = get_room(room, create=True)
+    room.device_seen = clock()
+    pending_requests = []
+    while room.pending:
+        key = room.pending.popleft()
+        record = screenshot_requests.get(key)
+        # 已过期清理的请求跳过
+        if record is not None and record.status is RequestStatus.PENDING:
+            # 标记为处理中
+            record.status = RequestStatus.PROCESSING
+            pending_requests.append(record.to_dict(key))
+            if journal is not None:
+                journal.append(("claimed", key))
+    
+    # 有观众在场时提示电脑端保持快速轮询，无人时由电脑端自行逐步放慢，但间隔不超过心跳要求
+    hints = {"heartbeat_interval": DEVICE_TIMEOUT / 3 / CLOCK_SPEED}
+    if room.live.viewers or clock() - room.last_seen < VIEWER_ACTIVE_WINDOW:
+        hints["next_poll_after"] = ACTIVE_POLL_INTERVAL
+    elif timelapse["active"] and room.name == TIMELAPSE_ROOM:
+        # 无人观看时电脑端会逐步放慢轮询，提示其按时领取下一帧延时摄影请求
+        hints["next_poll_after"] = max(ACTIVE_POLL_INTERVAL, (timelapse["next_due"] - clock()) / CLOCK_SPEED)
+    # 有手机订阅实时画面时通知电脑端开始推送
+    if room.live.viewers:
+        hints["live_fps"] = LIVE_FPS
+        hints["live_max_width"] = LIVE_MAX_WIDTH
     
     if pending_requests:
-        # 标记为处理中
-        for req in pending_requests:
-            screenshot_requests[req["request_id"]]["status"] = "processing"
-        
-        return {"has_requests": True, "requests": pending_requests}
+        return {"has_requests": True, "requests": pending_requests, **hints}
     
-    return {"has_requests": False, "requests": []}
+    return {"has_requests": False, "requests": [], **hints}
 
-@app.post("/api/upload-screenshot")
-async def upload_screenshot(upload: ScreenshotUpload):
-    """接收电脑端上传的截图"""
-    if upload.request_id not in screenshot_requests:
+def decode_image(data: bytes) -> Image.Image:
+    """把图片字节解码为已加载的PIL图像"""
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image
+
+def encode_png(image: Image.Image) -> bytes:
+    """把PIL图像编码为PNG字节"""
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def find_request(request_id: str, room: Optional[str] = None) -> Tuple[bytes, RequestRecord]:
+    """按字符串形式的请求ID查找请求记录，不存在或不属于指定房间时返回404"""
+    key = parse_request_id(request_id)
+    record = screenshot_requests.get(key) if key else None
+    if record is None or (room is not None and record.room != room):
         raise HTTPException(status_code=404, detail="Request not found")
+    return key, record
+
+def mark_device_seen(key: bytes):
+    """电脑端的上传同样是心跳：大截图上传较慢、期间不轮询时，所在房间不会被判定为离线"""
+    record = screenshot_requests.get(key)
+    if record is not None:
+        rooms[record.room].device_seen = clock()
+
+def offset_response(status_code: int, detail: str, upload: dict) -> JSONResponse:
+    """返回带服务器已确认偏移量的错误响应，客户端据此续传"""
+    return JSONResponse(status_code=status_code, content={"detail": detail, "offset": upload["offset"]})
+
+def discard_upload(upload_id: str):
+    """放弃一个分块上传并删除临时文件"""
+    upload = chunked_uploads.pop(upload_id, None)
+    if upload and os.path.exists(upload["path"]):
+        os.remove(upload["path"])
+
+def retain_blob(data: bytes, digest: Optional[str] = None, size: Tuple[int, int] = (0, 0)) -> str:
+    """保存PNG字节，内容相同的图片只保留一份，返回内容摘要（可传入已在线程池中算好的摘要和尺寸）"""
+    digest = digest or hashlib.sha256(data).hexdigest()
+    dedup_counters["stored"] += 1
+    blob = image_blobs.get(digest)
+    if blob:
+        blob.refcount += 1
+        dedup_counters["duplicates"] += 1
+    else:
+        image_blobs[digest] = ImageBlob(size=len(data), data=data, width=size[0], height=size[1])
+    return digest
+
+def retain_blob_file(path: str, digest: str, size: Tuple[int, int] = (0, 0)) -> str:
+    """把上传完成的文件按内容摘要保存，内容已存在时删除该文件并复用已有的一份"""
+    dedup_counters["stored"] += 1
+    blob = image_blobs.get(digest)
+    if blob:
+        blob.refcount += 1
+        dedup_counters["duplicates"] += 1
+        os.remove(path)
+    else:
+        blob_path = os.path.join(UPLOAD_DIR, f"{digest}.png")
+        os.replace(path, blob_path)
+        image_blobs[digest] = ImageBlob(size=os.path.getsize(blob_path), path=blob_path,
+                                        width=size[0], height=size[1])
+    return digest
+
+def release_blob(digest: str):
+    """释放一次引用，最后一个引用释放时删除图片"""
+    blob = image_blobs.get(digest)
+    if blob is None:
+        return
+    blob.refcount -= 1
+    if blob.refcount <= 0:
+        del image_blobs[digest]
+        if blob.path and os.path.exists(blob.path):
+            os.remove(blob.path)
+        if journal is not None:
+            journal.append(("released", digest))
+
+def discard_screenshot(key: bytes):
+    """删除截图结果并释放其引用的图片"""
+    screenshot = screenshots.pop(key, None)
+    if screenshot and screenshot.digest:
+        release_blob(screenshot.digest)
+
+def store_screenshot(key: bytes, record: RequestRecord, screenshot: ScreenshotRecord):
+    """保存截图结果并把请求标记为已完成（先保存新结果再释放旧引用，内容相同时不会误删），同时记录截图耗时"""
+    previous = screenshots.get(key)
+    screenshots[key] = screenshot
+    # 先记录新结果再释放旧图片，日志中不会出现引用已删除图片的已完成请求
+    journal_completed(key, screenshot)
+    # 手机端轮询到结果前开始生成预览（延时摄影的帧不需要）；增量重建的画面在首次获取编码后开始
+    if screenshot.digest and key != timelapse["pending"]:
+        start_preview(screenshot.digest)
+    if previous and previous.digest:
+        release_blob(previous.digest)
+    if record.status is not RequestStatus.COMPLETED:
+        room = rooms[record.room]
+        room.device_seen = clock()
+        room.capture_latencies.append((clock() - record.timestamp) / CLOCK_SPEED)
+    record.status = RequestStatus.COMPLETED
+
+def encode_png_with_digest(image: Image.Image) -> Tuple[bytes, str]:
+    data = encode_png(image)
+    return data, hashlib.sha256(data).hexdigest()
+
+def verify_image(source) -> Tuple[int, int]:
+    """校验图片字节或文件能被完整解析且尺寸有效，返回尺寸；不是有效图片时抛出 ValueError"""
+    try:
+        with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as image:
+            size = image.size
+            image.verify()
+    except Exception as e:
+        raise ValueError(f"Invalid image: {e}") from e
+    if size[0] <= 0 or size[1] <= 0:
+        raise ValueError("Invalid image size")
+    return size
+
+def decode_base64_with_digest(image_data: str) -> Tuple[bytes, str, Tuple[int, int]]:
+    data = base64.b64decode(image_data)
+    return data, hashlib.sha256(data).hexdigest(), verify_image(data)
+
+def inspect_upload_file(path: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+    """计算分块上传文件的摘要并校验图片，不是有效图片时尺寸为None"""
+    try:
+        size = verify_image(path)
+    except ValueError:
+        size = None
+    return file_sha256(path), size
+
+def decode_tiles(tiles: List[TileData]) -> list:
+    return [(tile.x, tile.y, decode_image(base64.b64decode(tile.image_data))) for tile in tiles]
+
+def apply_tiles(base_image: Image.Image, tiles: list) -> Image.Image:
+    """把图块贴到基准帧上，返回重建画面的副本"""
+    for x, y, tile_image in tiles:
+        base_image.paste(tile_image, (x, y))
+    return base_image.copy()
+
+def load_image_file(path: str) -> Image.Image:
+    with Image.open(path) as image:
+        image.load()
+        return image.copy()
+
+async def screenshot_digest(key: bytes, screenshot: ScreenshotRecord) -> Optional[str]:
+    """
+    返回截图的内容摘要，增量重建的画面在首次获取时于线程池中编码并保存
+
+    编码期间截图被替换或清理时返回None。
+    """
+    if screenshot.digest is None:
+        data, digest = await run_cpu(encode_png_with_digest, screenshot.image)
+        if screenshots.get(key) is not screenshot:
+            return None
+        if screenshot.digest is None:
+            screenshot.digest = retain_blob(data, digest)
+            screenshot.image = None
+            journal_completed(key, screenshot)
+            start_preview(screenshot.digest)
+    return screenshot.digest
+
+def blob_response(blob: ImageBlob, headers: Optional[dict] = None) -> Response:
+    """内存中的PNG字节直接作为响应体发送，分块上传的图片以文件形式发送"""
+    if blob.path:
+        return FileResponse(blob.path, media_type="image/png", headers=headers)
+    return Response(content=blob.data, media_type="image/png", headers=headers)
+
+def immutable_headers(etag: str) -> dict:
+    """按内容寻址资源的响应头：长期缓存"""
+    return {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": f'"{etag}"'}
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    """浏览器缓存的版本与当前一致时返回True"""
+    return request.headers.get("if-none-match") == headers["ETag"]
+
+def blob_dimensions(blob: ImageBlob) -> Tuple[int, int]:
+    """返回图片尺寸，只解析图片头"""
+    if not blob.width:
+        with Image.open(blob.path or BytesIO(blob.data)) as image:
+            blob.width, blob.height = image.size
+    return blob.width, blob.height
+
+def render_variant(source, max_width: Optional[int], image_format: str, quality: int) -> bytes:
+    """生成缩小的有损图片变体（在工作进程中运行），source 为PNG字节或文件路径"""
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as image:
+        keep_alpha = image_format == "WEBP" and image.mode in ("RGBA", "LA")
+        image = image.convert("RGBA" if keep_alpha else "RGB")
+        if max_width and image.width > max_width:
+            height = max(1, round(image.height * max_width / image.width))
+            image = image.resize((max_width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        buffer = BytesIO()
+        image.save(buffer, format=image_format, quality=quality)
+        return buffer.getvalue()
+
+def render_preview(source) -> bytes:
+    """生成内联预览（在工作进程中运行），source 为PNG字节或文件路径"""
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as image:
+        image = image.convert("RGB")
+        height = max(1, round(image.height * PREVIEW_WIDTH / image.width))
+        image = image.resize((PREVIEW_WIDTH, height), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        buffer = BytesIO()
+        image.filter(ImageFilter.GaussianBlur(PREVIEW_BLUR)).save(buffer, format="JPEG", quality=PREVIEW_QUALITY)
+        return buffer.getvalue()
+
+def get_variant_pool() -> ProcessPoolExecutor:
+    global _variant_pool
+    if _variant_pool is None:
+        # 不能直接 fork：子进程会继承当时打开的所有连接，服务器关闭空闲连接后套接字仍被子进程持有，
+        # 不会发出FIN，复用该连接的客户端只能等到超时。forkserver 启动的工作进程不继承这些描述符
+        context = multiprocessing.get_context("forkserver")
+        if __name__ != "__main__":
+            # forkserver 预先导入本模块，工作进程从它派生，无需各自重新导入
+            context.set_forkserver_preload([__name__])
+        _variant_pool = ProcessPoolExecutor(max_workers=VARIANT_WORKERS, mp_context=context)
+    return _variant_pool
+
+def _finish_variant(digest: str, name: str, future: asyncio.Future):
+    """变体生成完成后缓存结果（图片在生成期间被释放时直接丢弃）"""
+    variant_tasks.pop((digest, name), None)
+    blob = image_blobs.get(digest)
+    if blob and not future.cancelled() and future.exception() is None:
+        if blob.variants is None:
+            blob.variants = {}
+        blob.variants[name] = future.result()
+
+async def get_variant(digest: str, name: str) -> bytes:
+    """返回图片变体，首次请求时在进程池中生成并缓存"""
+    blob = image_blobs.get(digest)
+    if blob is None or name not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if blob.variants and name in blob.variants:
+        return blob.variants[name]
+    
+    args = (blob.path or blob.data, IMAGE_VARIANTS[name], VARIANT_FORMAT, VARIANT_QUALITY)
+    if VARIANT_WORKERS <= 0:
+        data = render_variant(*args)
+        if blob.variants is None:
+            blob.variants = {}
+        blob.variants[name] = data
+        return data
     
-    # 保存截图
-    screenshots[upload.request_id] = {
-        "image_data": upload.image_data,
-        "timestamp": time.time()
+    future = variant_tasks.get((digest, name))
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(get_variant_pool(), render_variant, *args)
+        future.add_done_callback(functools.partial(_finish_variant, digest, name))
+        variant_tasks[(digest, name)] = future
+    # 某个请求断开时不取消其他请求共用的生成任务
+    return await asyncio.shield(future)
+
+def _finish_preview(digest: str, future: asyncio.Future):
+    """预览生成完成后缓存结果（图片在生成期间被释放时直接丢弃）"""
+    preview_tasks.pop(digest, None)
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        logger.warning(f"预览生成失败: {future.exception()}")
+        return
+    blob = image_blobs.get(digest)
+    if blob is not None:
+        blob.preview = "data:image/jpeg;base64," + base64.b64encode(future.result()).decode()
+
+def start_preview(digest: str) -> Optional[str]:
+    """
+    返回已生成的内联预览 data URI；尚未生成时在进程池中开始生成（不等待）并返回None
+
+    截图保存时即开始生成，轮询不等待预览：生成完成前的响应不带预览，手机页面直接加载变体。
+    """
+    blob = image_blobs.get(digest)
+    if blob is None or blob.preview is not None:
+        return blob.preview if blob else None
+    if VARIANT_WORKERS <= 0:
+        try:
+            data = render_preview(blob.path or blob.data)
+        except Exception as e:
+            logger.warning(f"预览生成失败: {e}")
+            return None
+        blob.preview = "data:image/jpeg;base64," + base64.b64encode(data).decode()
+        return blob.preview
+    if digest not in preview_tasks:
+        future = asyncio.get_running_loop().run_in_executor(get_variant_pool(), render_preview,
+                                                            blob.path or blob.data)
+        future.add_done_callback(functools.partial(_finish_preview, digest))
+        preview_tasks[digest] = future
+    return None
+
+def variant_urls(digest: str) -> dict:
+    """返回手机页面使用的各变体地址和 srcset；无法读取图片尺寸时不提供变体，页面直接使用原图"""
+    try:
+        width, height = blob_dimensions(image_blobs[digest])
+    except Exception as e:
+        logger.warning(f"读取图片尺寸失败 - {digest}: {e}")
+        return {}
+    urls = {name: f"/api/image/{digest}/{name}.{VARIANT_EXTENSION}" for name in IMAGE_VARIANTS}
+    # 不放大：比原图宽的变体不放入 srcset
+    candidates = [(urls[name], max_width) for name, max_width in IMAGE_VARIANTS.items()
+                  if max_width and max_width < width]
+    candidates.append((urls["full"], width))
+    return {
+        "variants": urls,
+        "srcset": ", ".join(f"{url} {w}w" for url, w in candidates),
+        "width": width,
+        "height": height
     }
+
+def file_sha256(path: str) -> str:
+    """分段读取计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+@app.post("/api/upload-screenshot")
+async def upload_screenshot(request: Request):
+    """接收电脑端上传的截图"""
+    upload = await parse_body(request, ScreenshotUpload)
+    key, record = find_request(upload.request_id)
+    mark_device_seen(key)
+    
+    # 只保存解码后的原始字节，比base64字符串小四分之一，发送时无需再转换
+    try:
+        data, digest, size = await run_cpu(decode_base64_with_digest, upload.image_data)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid image data")
+    store_screenshot(key, record, ScreenshotRecord(timestamp=clock(), digest=retain_blob(data, digest, size)))
     
-    # 更新请求状态
-    screenshot_requests[upload.request_id]["status"] = "completed"
+    # 完整帧同时作为所在房间的关键帧，供后续增量上传使用
+    if upload.frame_id:
+        room = rooms[record.room]
+        base_frame = room.base_frame
+        async with room.base_frame_lock:
+            try:
+                base_frame["image"] = await run_cpu(decode_image, data)
+                base_frame["frame_id"] = upload.frame_id
+            except Exception:
+                base_frame["image"] = None
+                base_frame["frame_id"] = None
+            return {"status": "uploaded", "frame_id": base_frame["frame_id"]}
     
     return {"status": "uploaded"}
 
-@app.get("/api/get-screenshot/{request_id}")
-async def get_screenshot(request_id: str):
-    """获取截图结果"""
-    if request_id not in screenshot_requests:
+@app.post("/api/upload-screenshot-delta")
+async def upload_screenshot_delta(request: Request):
+    """接收相对基准帧的变化图块，在服务器端重建完整截图"""
+    upload = await parse_body(request, ScreenshotDeltaUpload)
+    key, record = find_request(upload.request_id)
+    mark_device_seen(key)
+    
+    # 先解码全部图块，避免中途失败时基准帧只更新了一半
+    try:
+        tiles = await run_cpu(decode_tiles, upload.tiles)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid tile data")
+    
+    room = rooms[record.room]
+    base_frame = room.base_frame
+    async with room.base_frame_lock:
+        base_image = base_frame["image"]
+        if (base_image is None
+                or base_frame["frame_id"] != upload.base_frame_id
+                or base_image.size != (upload.width, upload.height)):
+            # 基准帧不一致（例如服务器重启），客户端需回退为完整上传
+            raise HTTPException(status_code=409, detail="Base frame mismatch")
+        
+        # 保存重建画面的副本，PNG编码推迟到首次获取时进行，缩短上传响应时间
+        image = await run_cpu(apply_tiles, base_image, tiles)
+        base_frame["frame_id"] = upload.frame_id
+    
+    store_screenshot(key, record, ScreenshotRecord(timestamp=clock(), image=image))
+    
+    return {"status": "uploaded", "frame_id": upload.frame_id}
+
+@app.post("/api/upload-init")
+async def upload_init(init: ChunkedUploadInit):
+    """开始（或续传）一个分块上传，返回服务器已确认的偏移量"""
+    key, _ = find_request(init.request_id)
+    mark_device_seen(key)
+    if init.total_size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="Upload too large")
+    
+    # 同一请求、同一内容的未完成上传直接续传
+    for upload_id, upload in chunked_uploads.items():
+        if upload["key"] == key and upload["total_size"] == init.total_size and upload["sha256"] == init.sha256:
+            upload["frame_id"] = init.frame_id
+            return {"upload_id": upload_id, "offset": upload["offset"], "chunk_size": UPLOAD_CHUNK_SIZE}
+    
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(UPLOAD_DIR, f"{upload_id}.part")
+    open(path, "wb").close()
+    chunked_uploads[upload_id] = {
+        "key": key,
+        "path": path,
+        "offset": 0,
+        "total_size": init.total_size,
+        "sha256": init.sha256,
+        "frame_id": init.frame_id,
+        "writing": False,
+        "timestamp": clock()
+    }
+    return {"upload_id": upload_id, "offset": 0, "chunk_size": UPLOAD_CHUNK_SIZE}
+@app.get("/api/upload-chunk/{upload_id}")
+async def upload_status(upload_id: str):
+    """查询分块上传的已确认偏移量"""
+    upload = chunked_uploads.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"offset": upload["offset"], "total_size": upload["total_size"]}
+
+@app.put("/api/upload-chunk/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """按偏移量写入一个数据块，请求体为原始字节，边接收边写入临时文件"""
+    upload = chunked_uploads.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    mark_device_seen(upload["key"])
+    if upload["writing"] or offset != upload["offset"]:
+        return offset_response(409, "Offset mismatch", upload)
+    
+    upload["writing"] = True
+    written = 0
+    try:
+        with open(upload["path"], "r+b") as f:
+            f.seek(offset)
+            # 丢弃上次中断时可能残留的未确认数据
+            f.truncate()
+            async for piece in request.stream():
+                if offset + written + len(piece) > upload["total_size"]:
+                    return offset_response(413, "Chunk exceeds declared size", upload)
+                f.write(piece)
+                written += len(piece)
+    finally:
+        # 连接中途断开时，已写入的部分同样确认，客户端从这里续传
+        upload["offset"] = offset + written
+        upload["timestamp"] = clock()
+        upload["writing"] = False
+        mark_device_seen(upload["key"])
+    
+    return {"offset": upload["offset"]}
+
+@app.post("/api/upload-finalize/{upload_id}")
+async def upload_finalize(upload_id: str):
+    """完成分块上传：校验长度和摘要，把临时文件作为截图结果"""
+    upload = chunked_uploads.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    mark_device_seen(upload["key"])
+    if upload["writing"] or upload["offset"] != upload["total_size"]:
+        return offset_response(409, "Upload incomplete", upload)
+    key = upload["key"]
+    record = screenshot_requests.get(key)
+    if record is None:
+        discard_upload(upload_id)
         raise HTTPException(status_code=404, detail="Request not found")
+    # 先标记为写入中，计算摘要期间拒绝对该上传的其他操作
+    upload["writing"] = True
+    try:
+        digest, size = await run_cpu(inspect_upload_file, upload["path"])
+    finally:
+        upload["writing"] = False
+    if upload_id not in chunked_uploads or key not in screenshot_requests:
+        discard_upload(upload_id)
+        raise HTTPException(status_code=404, detail="Request not found")
+    if upload["sha256"] and digest != upload["sha256"]:
+        discard_upload(upload_id)
+        raise HTTPException(status_code=400, detail="Checksum mismatch")
+    if size is None:
+        discard_upload(upload_id)
+        raise HTTPException(status_code=400, detail="Invalid image data")
+    
+    chunked_uploads.pop(upload_id)
+    retain_blob_file(upload["path"], digest, size)
+    store_screenshot(key, record, ScreenshotRecord(timestamp=clock(), digest=digest))
     
-    request_data = screenshot_requests[request_id]
+    if upload["frame_id"]:
+        room = rooms[record.room]
+        base_frame = room.base_frame
+        async with room.base_frame_lock:
+            try:
+                base_frame["image"] = await run_cpu(load_image_file, image_blobs[digest].path)
+                base_frame["frame_id"] = upload["frame_id"]
+            except Exception:
+                base_frame["image"] = None
+                base_frame["frame_id"] = None
+            return {"status": "uploaded", "frame_id": base_frame["frame_id"]}
+    
+    return {"status": "uploaded"}
+
+@app.get("/api/image/{name}")
+async def get_image(name: str, request: Request):
+    """按内容摘要返回图片，地址内容不变，可长期缓存"""
+    digest = name.removesuffix(".png")
+    blob = image_blobs.get(digest)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    headers = immutable_headers(digest)
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    return blob_response(blob, headers)
+
+@app.get("/api/image/{digest}/{name}")
+async def get_image_variant(digest: str, name: str, request: Request):
+    """返回缩小的图片变体，例如 /api/image/<摘要>/mobile.webp"""
+    variant, _, extension = name.partition(".")
+    if extension != VARIANT_EXTENSION or variant not in IMAGE_VARIANTS or digest not in image_blobs:
+        raise HTTPException(status_code=404, detail="Image not found")
+    headers = immutable_headers(f"{digest}-{variant}")
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    return Response(content=await get_variant(digest, variant), media_type=VARIANT_MEDIA_TYPE, headers=headers)
+
+@app.get("/api/screenshot-image/{request_id}")
+async def get_screenshot_image(request_id: str, room: str = DEFAULT_ROOM):
+    """按请求ID返回截图图片"""
+    key, _ = find_request(request_id, room)
+    screenshot = screenshots.get(key)
+    digest = await screenshot_digest(key, screenshot) if screenshot else None
+    if digest is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    return blob_response(image_blobs[digest])
+
+@app.get("/api/get-screenshot/{request_id}")
+async def get_screenshot(request_id: str, room: str = DEFAULT_ROOM):
+    """获取截图结果，只能查询本房间的请求"""
+    key, request_data = find_request(request_id, room)
     
-    if request_data["status"] == "completed" and request_id in screenshots:
+    screenshot = screenshots.get(key)
+    digest = await screenshot_digest(key, screenshot) if screenshot else None
+    if request_data.status is RequestStatus.COMPLETED and digest:
+        # 只返回按内容寻址的图片地址，相同画面的地址相同，浏览器可直接使用缓存
+        # 内联的模糊预览不需要额外请求，网络慢时手机端先显示它；还没生成好时不等待
         return {
             "status": "completed",
-            "image_data": screenshots[request_id]["image_data"]
+            "image_url": f"/api/image/{digest}.png",
+            "preview": start_preview(digest),
+            **variant_urls(digest)
+        }
+    # 等待期间电脑端离线时告知手机端，不必继续轮询
+    room = rooms[request_data.room]
+    status = "processing" if request_data.status is RequestStatus.PROCESSING else "pending"
+    return {"status": status, "device_online": room.device_online(), "estimated_seconds": room.capture_latency()}
+
+@app.get("/api/dedup-stats")
+async def get_dedup_stats():
+    """截图去重统计"""
+    stored_bytes = sum(blob.size for blob in image_blobs.values())
+    referenced_bytes = sum(blob.size * blob.refcount for blob in image_blobs.values())
+    return {
+        "blobs": len(image_blobs),
+        "references": sum(blob.refcount for blob in image_blobs.values()),
+        "stored_bytes": stored_bytes,
+        "referenced_bytes": referenced_bytes,
+        "bytes_saved": referenced_bytes - stored_bytes,
+        "dedup_ratio": referenced_bytes / stored_bytes if stored_bytes else 1.0,
+        **dedup_counters
+    }
+
+def render_live_tier(data: bytes, max_width: int) -> bytes:
+    """把最高档的实时帧缩小到指定宽度，重新编码为JPEG"""
+    image = decode_image(data)
+    if image.width <= max_width:
+        return data
+    height = max(1, round(image.height * max_width / image.width))
+    buffer = BytesIO()
+    image.resize((max_width, height), Image.Resampling.BILINEAR, reducing_gap=2.0).save(
+        buffer, format="JPEG", quality=LIVE_QUALITY)
+    return buffer.getvalue()
+
+class LiveChannel:
+    """
+    实时画面的扇出通道
+
+    只保留最新一帧，每帧只上传一次、由所有订阅者共享。订阅者各自等待下一帧，
+    发送较慢的订阅者恢复后直接取最新帧，中间的帧被丢弃而不会排队；
+    低档位画面在该帧首次被需要时生成一次，同档位的订阅者共用。
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self.timestamp = 0.0
+        self.frames: dict = {}  # 档位 -> JPEG字节或正在生成的 Future
+        self.viewers = 0
+        self.tier_viewers = {name: 0 for name in LIVE_TIERS}
+        self.counters = {"published": 0, "sent": 0, "dropped": 0, "downgrades": 0, "upgrades": 0}
+        self._new_frame = asyncio.Event()
+
+    def publish(self, data: bytes):
+        """发布新的一帧并唤醒所有等待的订阅者"""
+        self.seq += 1
+        self.timestamp = time.time()  # 墙上时间，手机端据此计算帧延迟
+        self.frames = {next(iter(LIVE_TIERS)): data}
+        self.counters["published"] += 1
+        event, self._new_frame = self._new_frame, asyncio.Event()
+        event.set()
+
+    async def wait_for_frame(self, after_seq: int):
+        """等待序号大于 after_seq 的帧"""
+        if self.seq <= after_seq:
+            await self._new_frame.wait()
+
+    async def get_frame(self, tier: str) -> bytes:
+        """返回最新一帧指定档位的JPEG，同一帧同一档位只生成一次"""
+        frames = self.frames
+        source = frames[next(iter(LIVE_TIERS))]
+        frame = frames.get(tier)
+        if frame is None:
+            frame = frames[tier] = asyncio.ensure_future(run_cpu(render_live_tier, source, LIVE_TIERS[tier]))
+        if isinstance(frame, bytes):
+            return frame
+        try:
+            # 订阅者断开时不取消其他订阅者共用的生成任务
+            data = await asyncio.shield(frame)
+        except Exception:
+            # 无法解码的帧原样转发，由浏览器处理
+            data = source
+        frames[tier] = data
+        return data
+
+    def switch_tier(self, old: str, new: str):
+        self.tier_viewers[old] -= 1
+        self.tier_viewers[new] += 1
+
+class Room:
+    """
+    一个展项的独立状态
+
+    待处理请求按房间排队，电脑端轮询时只查看本房间的队列；
+    增量上传的基准帧和实时画面同样按房间区分，多个电脑端互不干扰。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pending: deque = deque()  # 待处理请求的键，按创建顺序
+        # 最近一次手机端活动（打开页面或发起请求）的时间
+        self.last_seen = 0.0
+        # 增量上传的基准帧：服务器最近一次确认的完整画面
+        self.base_frame = {"frame_id": None, "image": None}
+        # 基准帧的检查和更新之间会等待线程池，用锁保证增量上传按顺序应用
+        self.base_frame_lock = asyncio.Lock()
+        self.live = LiveChannel()
+        # 最近一次电脑端心跳（轮询、上传或推流）的时间
+        self.device_seen = 0.0
+        # 最近几次截图从请求到完成的耗时（秒）
+        self.capture_latencies: deque = deque(maxlen=CAPTURE_LATENCY_SAMPLES)
+
+    def device_online(self) -> bool:
+        """最近 DEVICE_TIMEOUT 秒内有电脑端心跳；服务器刚启动、电脑端尚未重连时同样视为在线"""
+        now = clock()
+        return now - self.device_seen < DEVICE_TIMEOUT or now - CLOCK_ORIGIN < DEVICE_TIMEOUT
+
+    def capture_latency(self) -> Optional[float]:
+        """最近几次截图耗时的中位数（秒），没有记录时为None"""
+        if not self.capture_latencies:
+            return None
+        return sorted(self.capture_latencies)[len(self.capture_latencies) // 2]
+
+    def device_status(self) -> dict:
+        return {
+            "online": self.device_online(),
+            "last_seen": self.device_seen or None,
+            "estimated_seconds": self.capture_latency()
         }
-    elif request_data["status"] == "processing":
-        return {"status": "processing"}
+
+rooms: dict = {}  # 房间名 -> Room
+
+def get_room(name: str, create: bool = False) -> Room:
+    """
+    按名称取得房间
+
+    只有电脑端轮询、推流和启动恢复时传入 create=True 才会创建房间，手机端等无需认证的访问
+    遇到未知房间返回404，否则任意房间名都会永久占用房间配额；默认房间始终可用。
+    名称无效返回400，房间数已达上限返回503。
+    """
+    room = rooms.get(name)
+    if room is None:
+        if not ROOM_NAME_PATTERN.fullmatch(name):
+            raise HTTPException(status_code=400, detail="Invalid room name")
+        if not create and name != DEFAULT_ROOM:
+            raise HTTPException(status_code=404, detail="Room not found")
+        if len(rooms) >= MAX_ROOMS:
+            raise HTTPException(status_code=503, detail="Too many rooms")
+        room = rooms[name] = Room(name)
+    return room
+
+def live_tier_ceiling(max_width: Optional[int]) -> int:
+    """不超过手机显示所需像素宽度的档位中最清晰的一档，返回其在 LIVE_TIERS 中的序号"""
+    tiers = list(LIVE_TIERS)
+    if max_width:
+        for index in range(len(tiers) - 1, -1, -1):
+            width = LIVE_TIERS[tiers[index]]
+            if width is None or width >= max_width:
+                return index
+    return 0
+
+@app.post("/api/live/frame")
+async def upload_live_frame(request: Request, room: str = DEFAULT_ROOM):
+    """电脑端推送一帧实时画面（请求体为JPEG原始字节），返回本房间当前观看人数，无人观看时电脑端停止推送"""
+    room = get_room(room, create=True)
+    room.device_seen = clock()
+    live_channel = room.live
+    data = await request.body()
+    if len(data) > LIVE_MAX_FRAME_SIZE:
+        raise HTTPException(status_code=413, detail="Frame too large")
+    try:
+        # 只解析文件头，确认是JPEG
+        is_jpeg = Image.open(BytesIO(data)).format == "JPEG"
+    except Exception:
+        is_jpeg = False
+    if not is_jpeg:
+        raise HTTPException(status_code=400, detail="Frame must be a JPEG image")
+
+    live_channel.publish(data)
+    return {"viewers": live_channel.viewers, "fps": LIVE_FPS}
+
+@app.websocket("/api/live/ws")
+async def live_socket(websocket: WebSocket, tier: str = "auto", max_width: Optional[int] = None,
+                      room: str = DEFAULT_ROOM):
+    """
+    实时画面订阅
+
+    每帧先发送一条文本消息（序号、发布时间、档位），再发送JPEG二进制消息；
+    手机显示完一帧后回复 ack 才会收到下一帧，同一时间最多只有一帧在途，
+    跟不上的手机直接跳到最新帧，不会在连接缓冲区中积压。
+    tier 为 auto 时按每帧的往返耗时自动升降档，max_width 为手机显示所需的像素宽度（档位上限）。
+    """
+    tiers = list(LIVE_TIERS)
+    try:
+        room = get_room(room)
+    except HTTPException:
+        room = None
+    if room is None or (tier != "auto" and tier not in tiers):
+        await websocket.close(code=1008)
+        return
+    live_channel = room.live
+    await websocket.accept()
+    index = ceiling = live_tier_ceiling(max_width) if tier == "auto" else tiers.index(tier)
+    frame_interval = 1 / LIVE_FPS
+    loop = asyncio.get_running_loop()
+    strikes = smooth = 0
+    # 刚因过慢降档的手机需要顺畅更久才会再次升档，避免在两档之间反复切换
+    upgrade_after = LIVE_UPGRADE_FRAMES
+    last_seq = 0
+
+    live_channel.viewers += 1
+    live_channel.tier_viewers[tiers[index]] += 1
+    room.last_seen = clock()
+    # 始终保持一个接收任务：等待新帧期间也能立即发现手机断开
+    receiver = asyncio.ensure_future(websocket.receive())
+    try:
+        while True:
+            waiter = asyncio.ensure_future(live_channel.wait_for_frame(last_seq))
+            await asyncio.wait((waiter, receiver), return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                # 没有在途帧时只可能收到断开消息
+                waiter.cancel()
+                break
+            seq, timestamp = live_channel.seq, live_channel.timestamp
+            skipped = seq - last_seq - 1 if last_seq else 0
+            last_seq = seq
+            data = await live_channel.get_frame(tiers[index])
+
+            # 从发送到收到确认的耗时包含传输和手机端解码，反映该手机实际能承受的帧率
+            started = loop.time()
+            await websocket.send_json({"seq": seq, "timestamp": timestamp, "tier": tiers[index]})
+            await websocket.send_bytes(data)
+            message = await asyncio.wait_for(receiver, LIVE_ACK_TIMEOUT)
+            if message["type"] == "websocket.disconnect":
+                break
+            receiver = asyncio.ensure_future(websocket.receive())
+            elapsed = loop.time() - started
+            live_channel.counters["sent"] += 1
+            live_channel.counters["dropped"] += skipped
+            if tier != "auto":
+                continue
+
+            if skipped or elapsed > frame_interval:
+                strikes += 1
+                smooth = 0
+                if strikes >= LIVE_DOWNGRADE_STRIKES and index < len(tiers) - 1:
+                    live_channel.switch_tier(tiers[index], tiers[index + 1])
+                    live_channel.counters["downgrades"] += 1
+                    index += 1
+                    strikes = 0
+                    upgrade_after = min(upgrade_after * 2, LIVE_UPGRADE_FRAMES * 8)
+            else:
+                smooth += 1
+                strikes = 0
+                if smooth >= upgrade_after and index > ceiling:
+                    live_channel.switch_tier(tiers[index], tiers[index - 1])
+                    live_channel.counters["upgrades"] += 1
+                    index -= 1
+                    smooth = 0
+    except (WebSocketDisconnect, asyncio.TimeoutError):
+        pass
+    except Exception as e:
+        # 发送时连接已关闭（手机断开或服务器关闭），不同的 WebSocket 实现抛出的异常类型不同
+        logger.debug(f"实时画面连接已关闭: {e!r}")
+    finally:
+        receiver.cancel()
+        live_channel.viewers -= 1
+        live_channel.tier_viewers[tiers[index]] -= 1
+
+@app.get("/api/server-url")
+async def get_server_url_info():
+    """当前二维码中的服务器地址和本机各网络接口的地址"""
+    return {"server_url": get_server_url(), "override": SERVER_URL_OVERRIDE, "interface": SERVER_INTERFACE,
+            "addresses": [{"interface": name, "address": address} for name, address in list_interface_addresses()]}
+
+@app.post("/api/server-url/refresh")
+async def refresh_server_url():
+    """网络变化（换了Wi-Fi、重新获取了地址）后重新解析服务器地址，地址改变时清空二维码缓存"""
+    global _server_url
+    previous = _server_url
+    _server_url = resolve_server_url()
+    changed = _server_url != previous
+    if changed:
+        qr_cache.clear()
+        logger.info(f"服务器地址变为 {_server_url}，手机扫码将访问: {_server_url}/mobile")
+    return {"server_url": _server_url, "previous": previous, "changed": changed}
+
+@app.get("/api/rooms")
+async def list_rooms():
+    """各房间的排队请求数、实时观看人数、最近一次手机端活动时间和电脑端状态"""
+    return {
+        name: {"pending": len(room.pending), "live_viewers": room.live.viewers, "last_seen": room.last_seen,
+               "device": room.device_status()}
+        for name, room in rooms.items()
+    }
+
+@app.get("/api/device-status")
+async def get_device_status(room: str = DEFAULT_ROOM):
+    """本房间电脑端是否在线、最近一次心跳时间和预计截图耗时（秒）"""
+    return get_room(room).device_status()
+
+@app.get("/api/live/stats")
+async def get_live_stats(room: str = DEFAULT_ROOM):
+    """本房间的实时观看统计"""
+    live_channel = get_room(room).live
+    return {
+        "viewers": live_channel.viewers,
+        "tiers": live_channel.tier_viewers,
+        "fps": LIVE_FPS,
+        **live_channel.counters
+    }
+
+def timelapse_path(frame: TimelapseFrame) -> str:
+    """帧文件路径：序号和毫秒时间戳都编码在文件名中，重启后可直接恢复索引"""
+    return os.path.join(TIMELAPSE_DIR, f"{frame.seq:010d}-{round(frame.timestamp * 1000)}.{VARIANT_EXTENSION}")
+
+def remove_timelapse_file(path: str):
+    """删除帧文件；有导出正在读取时推迟到导出结束后删除"""
+    if timelapse_exports["active"]:
+        timelapse_exports["trash"].append(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def evict_timelapse_frames():
+    """超出容量时淘汰最早的帧"""
+    while len(timelapse_frames) > TIMELAPSE_CAPACITY:
+        remove_timelapse_file(timelapse_path(timelapse_frames.popleft()))
+        timelapse_counters["evicted"] += 1
+
+def load_timelapse_index():
+    """启动时从磁盘恢复环形缓冲区索引（只读取图片头）"""
+    frames = []
+    for name in os.listdir(TIMELAPSE_DIR):
+        stem, extension = os.path.splitext(name)
+        parts = stem.split("-")
+        if extension != f".{VARIANT_EXTENSION}" or len(parts) != 2 or not all(part.isdigit() for part in parts):
+            continue
+        path = os.path.join(TIMELAPSE_DIR, name)
+        try:
+            with Image.open(path) as image:
+                width, height = image.size
+        except Exception:
+            continue
+        frames.append(TimelapseFrame(int(parts[0]), int(parts[1]) / 1000, os.path.getsize(path), width, height))
+    frames.sort(key=lambda frame: frame.seq)
+    timelapse_frames.clear()
+    timelapse_frames.extend(frames)
+    if frames:
+        timelapse["next_seq"] = frames[-1].seq + 1
+    evict_timelapse_frames()
+
+def encode_timelapse_frame(source, path: str) -> Tuple[int, int, int]:
+    """
+    把截图缩小编码后写入帧文件（在线程池中运行），返回 (字节数, 宽, 高)
+
+    source 为增量重建的图像、PNG字节或分块上传的文件路径
+    """
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        image = load_image_file(source) if isinstance(source, str) else decode_image(source)
+    image = image.convert("RGB")
+    if image.width > TIMELAPSE_MAX_WIDTH:
+        height = max(1, round(image.height * TIMELAPSE_MAX_WIDTH / image.width))
+        image = image.resize((TIMELAPSE_MAX_WIDTH, height), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    temp_path = path + ".tmp"
+    image.save(temp_path, format=VARIANT_FORMAT, quality=TIMELAPSE_QUALITY)
+    os.replace(temp_path, path)
+    return os.path.getsize(path), image.width, image.height
+
+async def append_timelapse_frame(source, timestamp: float):
+    """把一帧编码写入环形缓冲区，超出容量时淘汰最早的帧"""
+    frame = TimelapseFrame(timelapse["next_seq"], timestamp, 0, 0, 0)
+    timelapse["next_seq"] += 1
+    frame.size, frame.width, frame.height = await run_cpu(encode_timelapse_frame, source, timelapse_path(frame))
+    timelapse_frames.append(frame)
+    timelapse_counters["recorded"] += 1
+    evict_timelapse_frames()
+
+async def collect_timelapse_frame():
+    """检查延时摄影请求：完成时把结果写入环形缓冲区，超时则放弃本帧；之后删除该请求及其截图"""
+    key = timelapse["pending"]
+    record = screenshot_requests.get(key)
+    screenshot = screenshots.get(key)
+    if record is not None and record.status is RequestStatus.COMPLETED and screenshot is not None:
+        if screenshot.image is not None:
+            source = screenshot.image
+        else:
+            blob = image_blobs[screenshot.digest]
+            source = blob.path or blob.data
+        try:
+            await append_timelapse_frame(source, screenshot.timestamp)
+        except Exception as e:
+            logger.warning(f"延时摄影帧写入失败: {e}")
+            timelapse_counters["missed"] += 1
+    elif record is not None and clock() - record.timestamp <= TIMELAPSE_REQUEST_TIMEOUT:
+        return
+    else:
+        timelapse_counters["missed"] += 1
+    timelapse["pending"] = None
+    screenshot_requests.pop(key, None)
+    discard_screenshot(key)
+
+async def run_timelapse():
+    """延时摄影调度：按间隔安排截图请求（同一时间最多一个），并收集完成的结果"""
+    while True:
+        await asyncio.sleep(TIMELAPSE_TICK)
+        if timelapse["pending"] is not None:
+            await collect_timelapse_frame()
+        now = clock()
+        if timelapse["active"] and timelapse["pending"] is None and now >= timelapse["next_due"]:
+            # 电脑端按普通请求处理，先缩小到 TIMELAPSE_MAX_WIDTH 再上传
+            key = uuid.uuid4().bytes
+            screenshot_requests[key] = RequestRecord(
+                user_id="timelapse",
+                timestamp=now,
+                viewport_width=TIMELAPSE_MAX_WIDTH,
+                device_pixel_ratio=1.0,
+                room=TIMELAPSE_ROOM
+            )
+            rooms[TIMELAPSE_ROOM].pending.append(key)
+            timelapse["pending"] = key
+            # 按固定节拍安排下一帧，落后超过一个间隔时从当前时间重新计时
+            timelapse["next_due"] += timelapse["interval"]
+            if timelapse["next_due"] < now:
+                timelapse["next_due"] = now + timelapse["interval"]
+
+def timelapse_status() -> dict:
+    return {
+        "active": timelapse["active"],
+        "interval": timelapse["interval"],
+        "frames": len(timelapse_frames),
+        "capacity": TIMELAPSE_CAPACITY,
+        "bytes": sum(frame.size for frame in timelapse_frames),
+        "first_timestamp": timelapse_frames[0].timestamp if timelapse_frames else None,
+        "last_timestamp": timelapse_frames[-1].timestamp if timelapse_frames else None,
+        **timelapse_counters
+    }
+
+@app.post("/api/timelapse/start")
+async def start_timelapse(options: TimelapseStart, request: Request):
+    """开始（或调整间隔后继续）延时摄影，clear 为真时先清空已录制的帧"""
+    check_token(request, TIMELAPSE_TOKEN)
+    if options.clear:
+        while timelapse_frames:
+            remove_timelapse_file(timelapse_path(timelapse_frames.popleft()))
+    timelapse.update(active=True, interval=options.interval, next_due=clock())
+    return timelapse_status()
+
+@app.post("/api/timelapse/stop")
+async def stop_timelapse(request: Request):
+    """停止延时摄影，已录制的帧保留"""
+    check_token(request, TIMELAPSE_TOKEN)
+    timelapse["active"] = False
+    return timelapse_status()
+
+@app.get("/api/timelapse")
+async def get_timelapse():
+    """延时摄影状态"""
+    return timelapse_status()
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+class ZipStreamBuffer:
+    """供 zipfile 写入的只追加缓冲区，没有 tell/seek，zipfile 会按流式格式（数据描述符）写入"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data) -> int:
+        self.data += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data, self.data = bytes(self.data), bytearray()
+        return data
+
+async def pinned_export(chunks):
+    """导出期间推迟删除被淘汰的帧文件"""
+    timelapse_exports["active"] += 1
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        timelapse_exports["active"] -= 1
+        if not timelapse_exports["active"]:
+            for path in timelapse_exports["trash"]:
+                if os.path.exists(path):
+                    os.remove(path)
+            timelapse_exports["trash"].clear()
+
+async def timelapse_zip_chunks(frames: list):
+    """逐帧生成ZIP压缩包（帧已是压缩图片，直接存储），最后附带帧时间清单"""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for frame in frames:
+            path = timelapse_path(frame)
+            info = zipfile.ZipInfo(os.path.basename(path), date_time=time.localtime(frame.timestamp)[:6])
+            archive.writestr(info, await run_cpu(read_file, path))
+            yield buffer.take()
+        manifest = [{"seq": frame.seq, "timestamp": frame.timestamp, "file": os.path.basename(timelapse_path(frame))}
+                    for frame in frames]
+        archive.writestr("timelapse.json", json.dumps(manifest))
+    yield buffer.take()
+
+async def timelapse_webp_chunks(frames: list, fps: float):
+    """
+    逐帧生成动画WebP
+
+    帧文件本身就是有损WebP（RIFF头 + VP8数据块），直接把数据块包装为 ANMF 帧，
+    不需要重新解码编码；文件总长度可由帧文件大小预先算出，因此可以边读边发送。
+    """
+    def uint24(value: int) -> bytes:
+        return value.to_bytes(3, "little")
+
+    canvas_width = max(frame.width for frame in frames)
+    canvas_height = max(frame.height for frame in frames)
+    duration = max(1, round(1000 / fps))
+    # "WEBP" + VP8X + ANIM + 每帧 ANMF（块头8字节 + 帧头16字节 + 去掉12字节RIFF头的帧文件）
+    riff_size = 4 + (8 + 10) + (8 + 6) + sum(8 + 16 + frame.size - 12 for frame in frames)
+    yield (b"RIFF" + struct.pack("<I", riff_size) + b"WEBP"
+           + b"VP8X" + struct.pack("<I", 10) + bytes([0x02, 0, 0, 0]) + uint24(canvas_width - 1) + uint24(canvas_height - 1)
+           + b"ANIM" + struct.pack("<I", 6) + struct.pack("<IH", 0xFFFFFFFF, 0))
+    for frame in frames:
+        payload = (await run_cpu(read_file, timelapse_path(frame)))[12:]
+        # 标志位 0x02：不与上一帧混合
+        yield (b"ANMF" + struct.pack("<I", 16 + len(payload)) + uint24(0) + uint24(0)
+               + uint24(frame.width - 1) + uint24(frame.height - 1) + uint24(duration) + bytes([0x02]) + payload)
+
+@app.get("/api/timelapse/export")
+async def export_timelapse(export_format: str = Query("webp", alias="format"), start: Optional[float] = None,
+                           end: Optional[float] = None, fps: float = Query(10, gt=0, le=100)):
+    """
+    导出延时摄影：format=webp 为动画WebP，format=zip 为帧图片压缩包
+
+    start/end 为可选的时间范围（Unix时间戳），输出边读帧文件边发送，内存占用与录制长度无关
+    """
+    frames = [
+        frame for frame in timelapse_frames
+        if (start is None or frame.timestamp >= start) and (end is None or frame.timestamp <= end)
+    ]
+    if not frames:
+        raise HTTPException(status_code=404, detail="No time-lapse frames in range")
+    if export_format == "zip":
+        chunks, media_type = timelapse_zip_chunks(frames), "application/zip"
+    elif export_format == "webp":
+        if VARIANT_FORMAT != "WEBP":
+            raise HTTPException(status_code=400, detail="Animated export requires WebP support")
+        chunks, media_type = timelapse_webp_chunks(frames, fps), "image/webp"
     else:
-        return {"status": "pending"}
+        raise HTTPException(status_code=400, detail="Unknown format")
+    return StreamingResponse(
+        pinned_export(chunks),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="timelapse.{export_format}"'}
+    )
+
+# 任务创建时间，只在启用在线诊断时由任务工厂记录，任务结束后自动移除
+task_started: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+debug_profile_state = {"active": False}
+
+def track_task_start(loop, coro, **kwargs):
+    """事件循环的任务工厂：记录每个任务的创建时间"""
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    task_started[task] = time.monotonic()
+    return task
+
+def check_token(request: Request, token: Optional[str]):
+    """校验 Authorization: Bearer 或 ?token= 中的令牌；未配置令牌时接口视为不存在"""
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("authorization", "")
+    supplied = authorization[len("Bearer "):] if authorization.startswith("Bearer ") else request.query_params.get("token", "")
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+def check_debug_token(request: Request):
+    check_token(request, DEBUG_TOKEN)
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_stacks(thread_ids: Optional[set], seconds: float, interval: float) -> Tuple[dict, int]:
+    """
+    每隔 interval 秒采样一次线程调用栈，持续 seconds 秒
+
+    thread_ids 为None时采样除自身外的全部线程。返回 (折叠栈 -> 出现次数, 采样轮数)，
+    折叠栈以线程名开头、自外向内用分号连接。
+    """
+    counts = {}
+    rounds = 0
+    own = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own or (thread_ids is not None and thread_id not in thread_ids):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        rounds += 1
+        time.sleep(interval)
+    return counts, rounds
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = Query(5, gt=0, le=PROFILE_MAX_SECONDS),
+                        threads: str = Query("loop", pattern="^(loop|all)$")):
+    """
+    对服务器做采样分析，返回折叠栈文本（每行“调用栈 次数”，可直接交给 flamegraph.pl 或 speedscope）
+
+    threads=loop 只采样事件循环线程（空闲时停在 select 上），threads=all 包含线程池等全部线程。
+    采样在独立线程中进行，不阻塞事件循环；同一时间只允许一个分析。
+    """
+    check_debug_token(request)
+    if debug_profile_state["active"]:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    debug_profile_state["active"] = True
+    try:
+        thread_ids = {threading.get_ident()} if threads == "loop" else None
+        counts, rounds = await asyncio.to_thread(sample_stacks, thread_ids, seconds, PROFILE_SAMPLE_INTERVAL)
+    finally:
+        debug_profile_state["active"] = False
+    lines = [f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda item: -item[1])]
+    return Response("\n".join(lines) + "\n", media_type="text/plain", headers={
+        "Content-Disposition": 'attachment; filename="profile.folded"',
+        "X-Profile-Samples": str(rounds)
+    })
+
+@app.get("/debug/tasks")
+async def debug_tasks(request: Request):
+    """正在运行的 asyncio 任务：名称、协程、已运行时长（启动前创建的任务没有记录）和当前等待位置"""
+    check_debug_token(request)
+    now = time.monotonic()
+    tasks = []
+    for task in asyncio.all_tasks():
+        started = task_started.get(task)
+        stack = task.get_stack()
+        coro = task.get_coro()
+        tasks.append({
+            "name": task.get_name(),
+            "coroutine": getattr(coro, "__qualname__", repr(coro)),
+            "age": round(now - started, 3) if started is not None else None,
+            "waiting_at": f"{os.path.basename(stack[-1].f_code.co_filename)}:{stack[-1].f_lineno}" if stack else None
+        })
+    tasks.sort(key=lambda item: (item["age"] is None, -(item["age"] or 0)))
+    return {"count": len(tasks), "tasks": tasks}
+
+def fsync_directory(path: str):
+    """把目录项（新建、改名）落盘"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Journal:
+    """
+    请求状态变化的追加日志：created、claimed、completed、expired 各记一行
+
+    事件循环只把事件放入队列，不做任何磁盘操作；写入线程每 JOURNAL_FLUSH_INTERVAL 秒把
+    积累的事件合并写入并 fsync 一次，已完成截图的图片先写入 blobs/ 目录再记录。写入线程维护
+    一份与日志一致的状态副本，日志超过 JOURNAL_COMPACT_ENTRIES 条时直接用它写出快照并清空日志，
+    同样不需要事件循环参与。启动时先读取快照再回放日志。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.snapshot_path = os.path.join(directory, "snapshot.jsonl")
+        self.log_path = os.path.join(directory, "journal.jsonl")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        # 键的十六进制 -> [user_id, timestamp, viewport_width, device_pixel_ratio, full_resolution_of,
+        #                  room, claimed, digest, screenshot_timestamp]
+        self.state: dict = {}
+        self.entries = 0  # 日志（快照之后）的条数
+        self.queue = queue.SimpleQueue()
+        self.counters = {"written": 0, "batches": 0, "compactions": 0, "replayed": 0,
+                         "replay_seconds": 0.0, "compact_seconds": 0.0}
+        self._log = None
+        self._thread: Optional[threading.Thread] = None
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, f"{digest}.png")
+
+    def apply(self, event: list) -> bool:
+        """把一条事件应用到状态副本；键不在副本中（例如延时摄影的内部请求）时忽略并返回False"""
+        kind, key = event[0], event[1]
+        if kind == "c":
+            self.state[key] = [*event[2:], False, None, None]
+            return True
+        record = self.state.get(key)
+        if record is None:
+            return False
+        if kind == "p":
+            record[6] = True
+        elif kind == "d":
+            record[7], record[8] = event[2], event[3]
+        else:
+            del self.state[key]
+        return True
+
+    def load(self) -> dict:
+        """读取快照并回放日志，返回恢复的状态；写入中途崩溃留下的不完整行被忽略"""
+        start = time.perf_counter()
+        for path in (self.snapshot_path, self.log_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.apply(event)
+                    self.counters["replayed"] += 1
+                    if path == self.log_path:
+                        self.entries += 1
+        self.counters["replay_seconds"] = time.perf_counter() - start
+        return self.state
+
+    def start(self):
+        self._log = open(self.log_path, "ab")
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+
+    def append(self, event: tuple):
+        """在事件循环中调用，只放入队列"""
+        self.queue.put(event)
+
+    def close(self):
+        """写完队列中剩余的事件后停止写入线程"""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {"enabled": True, "records": len(self.state), "entries": self.entries, "queued": self.queue.qsize(),
+                **self.counters}
+
+    def _run(self):
+        # 启动时回放过的日志先压缩为快照，下次启动只需读取快照
+        if self.entries:
+            self._compact()
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            # 等待一个时间窗口，把这段时间的事件合并为一次写入
+            time.sleep(JOURNAL_FLUSH_INTERVAL)
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [event for event in batch if event is not None]
+            try:
+                self._write(batch)
+                if self.entries >= JOURNAL_COMPACT_ENTRIES:
+                    self._compact()
+            except Exception as e:
+                logger.warning(f"状态日志写入失败: {e}")
+        self._log.close()
+
+    def _write(self, batch: list):
+        lines = []
+        stored_blobs = False
+        for event in batch:
+            kind = event[0]
+            if kind == "released":
+                try:
+                    os.remove(self.blob_path(event[1]))
+                except FileNotFoundError:
+                    pass
+                continue
+            key = event[1].hex()
+            if kind == "created":
+                record = event[2]
+                line = ["c", key, record.user_id, record.timestamp, record.viewport_width,
+                        record.device_pixel_ratio, record.full_resolution_of.hex() if record.full_resolution_of else None,
+                        record.room]
+            elif kind == "claimed":
+                line = ["p", key]
+            elif kind == "completed":
+                _, _, digest, timestamp, source = event
+                if key not in self.state:
+                    continue
+                try:
+                    stored_blobs |= self._store_blob(digest, source)
+                except OSError as e:
+                    # 图片在写入前已被释放（请求过期或结果被替换），不记录本次完成
+                    logger.warning(f"状态日志图片写入失败: {e}")
+                    continue
+                line = ["d", key, digest, timestamp]
+            else:
+                line = ["x", key]
+            if self.apply(line):
+                lines.append(json.dumps(line, separators=(",", ":")))
+        if stored_blobs:
+            fsync_directory(self.blob_dir)
+        if lines:
+            self._log.write(("\n".join(lines) + "\n").encode())
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self.entries += len(lines)
+            self.counters["written"] += len(lines)
+            self.counters["batches"] += 1
+
+    def _store_blob(self, digest: str, source) -> bool:
+        """把图片（内存中的PNG字节或分块上传的文件）写入 blobs/，已存在时跳过，返回是否新写入"""
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            return False
+        temp_path = path + ".tmp"
+        if isinstance(source, str):
+            shutil.copyfile(source, temp_path)
+            with open(temp_path, "rb+") as f:
+                os.fsync(f.fileno())
+        else:
+            with open(temp_path, "wb") as f:
+                f.write(source)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return True
+
+    def _compact(self):
+        """把状态副本写成快照并清空日志，同时删除不再被引用的图片文件"""
+        start = time.perf_counter()
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for key, record in self.state.items():
+                f.write(json.dumps(["c", key, *record[:6]], separators=(",", ":")) + "\n")
+                if record[6]:
+                    f.write(json.dumps(["p", key], separators=(",", ":")) + "\n")
+                if record[7]:
+                    f.write(json.dumps(["d", key, record[7], record[8]], separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        fsync_directory(self.directory)
+        # 快照落盘后才清空日志；两步之间崩溃时重新回放旧日志，结果与快照相同
+        self._log.close()
+        self._log = open(self.log_path, "wb")
+        os.fsync(self._log.fileno())
+        self.entries = 0
+        # 图片文件只由本线程写入，此时可以安全地清理竞争或崩溃留下的无引用文件
+        referenced = {record[7] for record in self.state.values() if record[7]}
+        for name in os.listdir(self.blob_dir):
+            if name.endswith(".tmp") or name.removesuffix(".png") not in referenced:
+                os.remove(os.path.join(self.blob_dir, name))
+        self.counters["compactions"] += 1
+        self.counters["compact_seconds"] = time.perf_counter() - start
+
+journal: Optional[Journal] = None
+
+def journal_completed(key: bytes, screenshot: ScreenshotRecord):
+    """记录截图完成；增量重建的画面在首次获取、编码为PNG后才记录"""
+    if journal is not None and screenshot.digest:
+        blob = image_blobs[screenshot.digest]
+        journal.append(("completed", key, screenshot.digest, screenshot.timestamp, blob.path or blob.data))
+
+def restore_blob_file(digest: str) -> Optional[str]:
+    """
+    为日志中的图片在 UPLOAD_DIR 建立一份内存存储使用的文件，返回路径；日志中没有该图片时返回None
+
+    日志的 blobs/ 只由写入线程管理，压缩时会删除日志不再引用的文件；图片还被不记录日志的引用
+    （例如延时摄影）保留时，内存存储不能直接引用那里的文件。优先使用硬链接，不在同一文件系统时复制。
+    """
+    source = journal.blob_path(digest)
+    path = os.path.join(UPLOAD_DIR, f"{digest}.png")
+    temp_path = path + ".restore"
+    try:
+        os.link(source, temp_path)
+    except FileNotFoundError:
+        return None
+    except OSError:
+        try:
+            shutil.copyfile(source, temp_path)
+        except FileNotFoundError:
+            return None
+    os.replace(temp_path, path)
+    return path
+
+def restore_journal(state: dict) -> int:
+    """
+    把日志恢复的状态载入内存存储，返回恢复的请求数
+
+    已完成的请求引用从 blobs/ 链接出的图片文件；其余请求（包括已被领取、电脑端可能也已重启的）
+    重新排队等待电脑端处理，图片文件缺失的已完成请求同样重新排队。
+    """
+    for key_hex, (user_id, timestamp, viewport_width, device_pixel_ratio, full_resolution_of,
+                  room_name, _, digest, screenshot_timestamp) in state.items():
+        try:
+            room = get_room(room_name, create=True)
+        except HTTPException:
+            continue
+        key = bytes.fromhex(key_hex)
+        record = screenshot_requests[key] = RequestRecord(
+            user_id=user_id,
+            timestamp=timestamp,
+            viewport_width=viewport_width,
+            device_pixel_ratio=device_pixel_ratio,
+            full_resolution_of=bytes.fromhex(full_resolution_of) if full_resolution_of else None,
+            room=room_name
+        )
+        blob = image_blobs.get(digest) if digest else None
+        if blob is not None:
+            blob.refcount += 1
+        elif digest and (path := restore_blob_file(digest)):
+            blob = image_blobs[digest] = ImageBlob(size=os.path.getsize(path), path=path)
+        if blob is not None:
+            screenshots[key] = ScreenshotRecord(timestamp=screenshot_timestamp, digest=digest)
+            record.status = RequestStatus.COMPLETED
+        else:
+            room.pending.append(key)
+    return len(screenshot_requests)
+
+@app.get("/api/journal")
+async def get_journal_stats():
+    """状态日志统计：恢复的记录数、回放和压缩耗时、批量写入次数"""
+    return journal.stats() if journal is not None else {"enabled": False}
 
 # 清理过期请求（可选的后台任务）
 async def cleanup_expired_requests():
     """清理超过1小时的请求"""
     while True:
-        await asyncio.sleep(300)  # 每5分钟检查一次
-        current_time = time.time()
-        expired_requests = [
-            req_id for req_id, req_data in list(screenshot_requests.items())
-            if current_time - req_data.get("timestamp", 0) > 3600  # 1小时
-        ]
+        await asyncio.sleep(CLEANUP_INTERVAL / CLOCK_SPEED)
+        current_time = clock()
+        # 请求按创建时间顺序插入且不会重新插入，遇到第一个未过期的请求即可停止，
+        # 开销只与过期请求数有关
+        expired_requests = []
+        for key, record in screenshot_requests.items():
+            if current_time - record.timestamp <= REQUEST_TTL:
+                break
+            expired_requests.append(key)
         
-        for req_id in expired_requests:
-            screenshot_requests.pop(req_id, None)
-            screenshots.pop(req_id, None)
+        for key in expired_requests:
+            screenshot_requests.pop(key, None)
+            discard_screenshot(key)
+            if journal is not None:
+                journal.append(("expired", key))
+        # 长时间没有电脑端轮询的房间，队列头部会残留已过期的请求
+        for room in rooms.values():
+            while room.pending and room.pending[0] not in screenshot_requests:
+                room.pending.popleft()
+        
+        stale_uploads = [
+            upload_id for upload_id, upload in list(chunked_uploads.items())
+            if current_time - upload["timestamp"] > REQUEST_TTL
+        ]
+        for upload_id in stale_uploads:
+            discard_upload(upload_id)
+
+async def monitor_event_loop_lag():
+    """定时休眠并测量实际唤醒延迟，超过阈值时说明有操作阻塞了事件循环"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = loop.time() - start - LOOP_LAG_INTERVAL
+        event_loop_lag["max"] = max(event_loop_lag["max"], lag)
+        if lag > LOOP_LAG_THRESHOLD:
+            event_loop_lag["stalls"] += 1
+            logger.warning(f"事件循环卡顿 {lag * 1000:.0f} ms")
 
 @app.on_event("startup")
 async def startup_event():
-    # 启动清理任务
+    # 先从状态日志恢复重启前的请求和截图，再开始处理请求
+    if JOURNAL_DIR:
+        global journal
+        journal = Journal(JOURNAL_DIR)
+        restored = restore_journal(journal.load())
+        journal.start()
+        logger.info(f"状态日志: 恢复 {restored} 个请求，回放 {journal.counters['replayed']} 条，"
+                    f"耗时 {journal.counters['replay_seconds'] * 1000:.0f} ms")
+    # 启用在线诊断时记录之后创建的任务（包括各个连接的请求处理任务）的创建时间
+    if DEBUG_TOKEN:
+        asyncio.get_running_loop().set_task_factory(track_task_start)
+    # 启动清理任务和事件循环卡顿监控
     asyncio.create_task(cleanup_expired_requests())
+    asyncio.create_task(monitor_event_loop_lag())
+    # 恢复延时摄影帧索引并启动调度
+    get_room(TIMELAPSE_ROOM, create=True)
+    load_timelapse_index()
+    if TIMELAPSE_INTERVAL > 0:
+        timelapse.update(active=True, interval=TIMELAPSE_INTERVAL, next_due=clock())
+    asyncio.create_task(run_timelapse())
+    # 提前启动变体生成进程，第一个请求变体的手机无需等待
+    if VARIANT_WORKERS > 0:
+        for _ in range(VARIANT_WORKERS):
+            get_variant_pool().submit(os.getpid)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if journal is not None:
+        journal.close()
+    if _variant_pool is not None:
+        _variant_pool.shutdown(cancel_futures=True)
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == "__main__":
     print("艺术作品截图系统启动中...")
     print(f"请用PC浏览器访问: http://localhost:{PORT} 或 http://{HOST}:{PORT}")
-    print(f"手机扫码将访问: {SERVER_URL}/mobile")
+    print(f"手机扫码将访问: {get_server_url()}/mobile")
     # uvicorn.run("server:app", host=HOST, port=PORT, reload=True) # for file name server.py
     uvicorn.run(app, host=HOST, port=PORT)
\ No newline at end of file
@@ -0,0 +1,86 @@
+# _common.py - 各基准脚本共用的辅助函数
+#
+#   - free_port: 取一个空闲的本地端口
+#   - percentile: 取分位数
+#   - launch_server / wait_ready / start_server: 在子进程中启动 uvicorn 并等待端口可用，
+#     app_dir 可以指向另一份代码（例如旧版本的检出目录）做对比
+#   - serve_in_thread: 在当前进程的线程中运行 uvicorn，便于脚本直接修改服务器模块的状态
+#
+# 基准脚本以 python benchmarks/bench_xxx.py 运行时 benchmarks/ 在 sys.path 中，直接 from _common import 即可。
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional
+
+import requests
+import uvicorn
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, p):
+    """没有样本时返回 nan，格式化输出时不会出错"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else float("nan")
+
+
+def launch_server(port: int, workdir: str, app_dir: str, env: Optional[dict] = None) -> subprocess.Popen:
+    """
+    在临时工作目录中启动 uvicorn 子进程，不等待就绪
+
+    env 中的项覆盖当前环境变量，值为 None 的项从环境中删除。
+    """
+    merged = {**os.environ, "SERVER_URL": f"http://127.0.0.1:{port}"}
+    for name, value in (env or {}).items():
+        if value is None:
+            merged.pop(name, None)
+        else:
+            merged[name] = str(value)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.server:app", "--app-dir", app_dir,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=merged,
+    )
+
+
+def wait_ready(base_url: str, timeout: float = 20, interval: float = 0.2):
+    """等待服务器开始响应；探测的接口不存在于旧版本代码中时返回404，同样说明已就绪"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            requests.get(f"{base_url}/api/dedup-stats", timeout=1)
+            return
+        except requests.RequestException:
+            if time.time() > deadline:
+                raise RuntimeError("服务器启动失败")
+            time.sleep(interval)
+
+
+def start_server(port: int, workdir: str, app_dir: str, env: Optional[dict] = None) -> subprocess.Popen:
+    """在临时工作目录中启动 uvicorn，等待端口可用"""
+    process = launch_server(port, workdir, app_dir, env)
+    try:
+        wait_ready(f"http://127.0.0.1:{port}")
+    except RuntimeError:
+        process.kill()
+        raise
+    return process
+
+
+def serve_in_thread(app, port: int, log_level: str = "warning") -> uvicorn.Server:
+    """在后台线程中运行 uvicorn，等待启动完成"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level=log_level))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 20
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("服务器启动失败")
+        time.sleep(0.05)
+    return server
@@ -0,0 +1,174 @@
+# bench_async_client.py - 同步客户端与异步客户端的吞吐量/延迟对比
+#
+# 在子进程中启动本地 uvicorn 服务器（app.server），用合成画面分别驱动
+# ScreenshotClient 和 AsyncScreenshotClient：
+#   1. 空闲轮询: 连续调用 check-requests，统计单次轮询延迟
+#   2. 请求爆发: 一次性创建 N 个截图请求，统计全部处理完的耗时与每个请求的完成延迟
+# 异步客户端分别在关闭和开启增量上传（默认配置）时测试。--rtt-ms 大于0时客户端经过本进程内的
+# 延迟代理连接服务器（每个方向各延迟一半，不限带宽），模拟客户端与云端服务器之间的往返延迟。
+#
+# 用法: python benchmarks/bench_async_client.py [--burst 16] [--rounds 3] [--polls 200] [--rtt-ms 0]
+import argparse
+import asyncio
+import logging
+import os
+import queue
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+
+from _common import free_port, percentile, start_server
+from screenshot_client import ScreenshotClient, SyntheticBackend
+from screenshot_client_async import AsyncScreenshotClient
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class LatencyProxy:
+    """TCP代理：每个方向的数据延迟 rtt/2 后转发，不限制带宽，也不把多次发送串行化"""
+
+    def __init__(self, target_port: int, rtt: float):
+        self.target_port = target_port
+        self.delay = rtt / 2
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(64)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for source, destination in ((client, upstream), (upstream, client)):
+                pending = queue.SimpleQueue()
+                threading.Thread(target=self._read, args=(source, pending), daemon=True).start()
+                threading.Thread(target=self._send, args=(destination, pending), daemon=True).start()
+
+    def _read(self, source: socket.socket, pending: queue.SimpleQueue):
+        try:
+            while data := source.recv(65536):
+                pending.put((time.perf_counter() + self.delay, data))
+        except OSError:
+            pass
+        pending.put((time.perf_counter() + self.delay, b""))
+
+    def _send(self, destination: socket.socket, pending: queue.SimpleQueue):
+        try:
+            while True:
+                due, data = pending.get()
+                time.sleep(max(0.0, due - time.perf_counter()))
+                if not data:
+                    break
+                destination.sendall(data)
+        except OSError:
+            pass
+        try:
+            destination.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def create_burst(base_url: str, count: int):
+    """模拟多部手机同时扫码，返回 {请求ID: 创建时间}"""
+    created = {}
+    with requests.Session() as session:
+        for index in range(count):
+            response = session.post(f"{base_url}/api/request-screenshot", json={
+                "user_id": f"bench_{index}", "viewport_width": 390, "device_pixel_ratio": 3
+            })
+            created[response.json()["request_id"]] = time.perf_counter()
+    return created
+
+
+def bench_sync(base_url: str, args):
+    client = ScreenshotClient(base_url, delta_upload=False,
+                              capture_backend=SyntheticBackend(args.width, args.height, grain=0.1))
+    poll_times = []
+    for _ in range(args.polls):
+        start = time.perf_counter()
+        client.fetch_requests()
+        poll_times.append(time.perf_counter() - start)
+
+    drain_times, latencies = [], []
+    for _ in range(args.rounds):
+        created = create_burst(base_url, args.burst)
+        start = time.perf_counter()
+        for request in client.fetch_requests()[0]:
+            client.process_screenshot_request(request)
+            latencies.append(time.perf_counter() - created[request["request_id"]])
+        drain_times.append(time.perf_counter() - start)
+    client.session.close()
+    return poll_times, drain_times, latencies
+
+
+async def bench_async(base_url: str, args, delta_upload: bool):
+    client = AsyncScreenshotClient(base_url, delta_upload=delta_upload,
+                                   capture_backend=SyntheticBackend(args.width, args.height, grain=0.1))
+    poll_times = []
+    for _ in range(args.polls):
+        start = time.perf_counter()
+        await client.fetch_requests()
+        poll_times.append(time.perf_counter() - start)
+
+    drain_times, latencies = [], []
+    for _ in range(args.rounds):
+        created = await asyncio.to_thread(create_burst, base_url, args.burst)
+        start = time.perf_counter()
+
+        async def handle(request):
+            await client.process_screenshot_request(request)
+            latencies.append(time.perf_counter() - created[request["request_id"]])
+
+        await asyncio.gather(*(handle(request) for request in (await client.fetch_requests())[0]))
+        drain_times.append(time.perf_counter() - start)
+    await client.aclose()
+    return poll_times, drain_times, latencies
+
+
+def report(name: str, poll_times, drain_times, latencies, burst: int):
+    total = sum(drain_times)
+    print(f"{name:>10}: 轮询 p50 {percentile(poll_times, 0.5) * 1000:6.2f} ms, p99 {percentile(poll_times, 0.99) * 1000:6.2f} ms | "
+          f"爆发处理 {total / len(drain_times):6.2f} s/轮, 吞吐 {burst * len(drain_times) / total:5.1f} 张/秒, "
+          f"完成延迟 p50 {percentile(latencies, 0.5):5.2f} s, p95 {percentile(latencies, 0.95):5.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步/异步客户端对比")
+    parser.add_argument("--burst", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--polls", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--rtt-ms", type=float, default=0, help="客户端与服务器之间附加的往返延迟（毫秒）")
+    args = parser.parse_args()
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(port, workdir, ROOT)
+        try:
+            if args.rtt_ms > 0:
+                base_url = f"http://127.0.0.1:{LatencyProxy(port, args.rtt_ms / 1000).port}"
+            print(f"CPU核心数: {os.cpu_count()}, 每轮 {args.burst} 个请求, {args.rounds} 轮, 画面 {args.width}x{args.height}, "
+                  f"附加往返延迟 {args.rtt_ms:g} ms")
+            report("sync", *bench_sync(base_url, args), args.burst)
+            report("async", *asyncio.run(bench_async(base_url, args, False)), args.burst)
+            report("async+增量", *asyncio.run(bench_async(base_url, args, True)), args.burst)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
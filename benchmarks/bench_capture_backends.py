@@ -0,0 +1,61 @@
+# bench_capture_backends.py - 各截图后端的截图延迟基准测试
+#
+# 依次创建 imagegrab / mss / synthetic 后端，分别测量全屏和区域截图的延迟。
+# 当前环境不可用的后端（例如没有显示器或未安装 mss）会被跳过并注明原因，
+# 因此在无头环境下至少能得到 synthetic 后端的结果。
+#
+# 用法: python benchmarks/bench_capture_backends.py [--count 30] [--region 0,0,960,540]
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from screenshot_client import CAPTURE_BACKENDS
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def measure(backend, bbox, count: int):
+    """返回 (每次截图耗时列表, 画面尺寸)"""
+    image = backend.grab(bbox)  # 预热，首次截图通常包含初始化开销
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        image = backend.grab(bbox)
+        timings.append(time.perf_counter() - start)
+    return timings, image.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图后端延迟基准测试")
+    parser.add_argument("--count", type=int, default=30)
+    parser.add_argument("--region", default="0,0,960,540", help="区域截图范围 x,y,width,height")
+    args = parser.parse_args()
+
+    x, y, width, height = (int(v) for v in args.region.split(","))
+    cases = {"全屏": None, "区域": (x, y, x + width, y + height)}
+
+    for name, backend_class in CAPTURE_BACKENDS.items():
+        try:
+            backend = backend_class()
+            backend.grab((0, 0, 16, 16))
+        except Exception as e:
+            print(f"{name:>9}: 不可用 ({type(e).__name__}: {e})")
+            continue
+        try:
+            for case, bbox in cases.items():
+                timings, size = measure(backend, bbox, args.count)
+                timings.sort()
+                print(f"{name:>9} {case} {size[0]}x{size[1]}: "
+                      f"p50 {timings[len(timings) // 2] * 1000:7.2f} ms, "
+                      f"p95 {timings[int(len(timings) * 0.95)] * 1000:7.2f} ms, "
+                      f"max {timings[-1] * 1000:7.2f} ms")
+        finally:
+            backend.close()
+
+
+if __name__ == "__main__":
+    main()
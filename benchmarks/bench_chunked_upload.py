@@ -0,0 +1,162 @@
+# bench_chunked_upload.py - 大截图分块续传与整体上传的对比
+#
+# 在后台线程中启动本地 uvicorn 服务器（app.server），外面包一层“断线”注入：
+# 上传接口收到的字节数每累计约 --mtbf-mb MB（指数分布）就模拟一次连接中断，
+# 服务器只收到中断前的部分数据。对一张多显示器尺寸的合成截图比较：
+#   - 整体上传：一次 JSON POST，失败后从头重传（与分块上传相同的退避）
+#   - 分块上传：init -> 按偏移量 PUT 数据块 -> finalize，中断后从已确认偏移量续传
+# 报告实际发送的字节数、尝试次数和完成耗时，并确认分块上传的结果通过
+# 图片地址取回后与原始 PNG 逐字节一致。
+#
+# 用法: python benchmarks/bench_chunked_upload.py [--width 7680] [--height 2160] [--mtbf-mb 8]
+import argparse
+import base64
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+
+from _common import free_port, serve_in_thread
+from screenshot_client import (CHUNK_RETRY_LIMIT, SPOOL_RETRY_BASE, SPOOL_RETRY_MAX, ScreenshotClient,
+                               SyntheticBackend, encode_png_bytes)
+
+logging.getLogger().setLevel(logging.WARNING)
+
+UPLOAD_PREFIXES = ("/api/upload-screenshot", "/api/upload-chunk")
+
+
+class LinkDropInjector:
+    """ASGI 包装层：按累计接收字节数随机模拟连接中断"""
+
+    def __init__(self, app, mtbf_bytes: float, seed: int):
+        self.app = app
+        self.mtbf_bytes = mtbf_bytes
+        self.rng = random.Random(seed)
+        self.received = 0
+        self.drops = 0
+        self.until_drop = self.rng.expovariate(1 / mtbf_bytes)
+
+    def reset(self):
+        self.received = 0
+        self.drops = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(UPLOAD_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        dropped = False
+
+        async def lossy_receive():
+            nonlocal dropped
+            if dropped:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            body = message.get("body", b"")
+            if len(body) >= self.until_drop:
+                # 只交付中断前的部分数据，随后的读取得到断开事件
+                body = body[:int(self.until_drop)]
+                dropped = True
+                self.drops += 1
+                self.until_drop = self.rng.expovariate(1 / self.mtbf_bytes)
+                message = {**message, "body": body, "more_body": True}
+            else:
+                self.until_drop -= len(body)
+            self.received += len(body)
+            return message
+
+        started = False
+
+        async def tracked_send(message):
+            nonlocal started
+            if dropped:
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, lossy_receive, tracked_send)
+        except Exception:
+            if not dropped:
+                raise
+        if dropped and not started:
+            await send({"type": "http.response.start", "status": 503, "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b"connection dropped"})
+
+
+def create_request(base_url: str) -> str:
+    return requests.post(f"{base_url}/api/request-screenshot", json={"user_id": "bench"}).json()["request_id"]
+
+
+def upload_whole(client: ScreenshotClient, request_id: str, png: bytes, max_attempts: int) -> int:
+    """整体上传，失败后从头重传，返回尝试次数（失败返回-1）"""
+    image_data = base64.b64encode(png).decode('utf-8')
+    for attempt in range(1, max_attempts + 1):
+        if client.upload_screenshot(request_id, image_data):
+            return attempt
+        time.sleep(min(SPOOL_RETRY_MAX, SPOOL_RETRY_BASE * 2 ** min(attempt, CHUNK_RETRY_LIMIT)))
+    return -1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分块续传与整体上传对比")
+    parser.add_argument("--width", type=int, default=7680)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--mtbf-mb", type=float, default=8, help="平均每接收多少MB发生一次连接中断")
+    parser.add_argument("--max-attempts", type=int, default=30, help="整体上传的最大尝试次数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    png = encode_png_bytes(SyntheticBackend(args.width, args.height, seed=args.seed, grain=0.1).grab())
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # app.server 导入时会在当前目录创建 static/ 和 uploads/
+        os.chdir(workdir)
+        # 本测试只模拟上传、不轮询 check-requests，整体上传的多次重试期间不能被判定为离线
+        os.environ.setdefault("DEVICE_TIMEOUT", "3600")
+        from app import server as server_module
+
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        injector = LinkDropInjector(server_module.app, args.mtbf_mb * 1024 * 1024, args.seed)
+        server = serve_in_thread(injector, port, log_level="critical")
+        client = ScreenshotClient(base_url, delta_upload=False)
+        try:
+            print(f"截图 {args.width}x{args.height}，PNG {len(png) / 1024 / 1024:.1f} MB，"
+                  f"平均每 {args.mtbf_mb:g} MB 中断一次\n")
+
+            injector.reset()
+            request_id = create_request(base_url)
+            start = time.perf_counter()
+            attempts = upload_whole(client, request_id, png, args.max_attempts)
+            elapsed = time.perf_counter() - start
+            result = f"{attempts} 次尝试" if attempts > 0 else f"{args.max_attempts} 次尝试后仍失败"
+            print(f"整体上传: {result}，发送 {injector.received / 1024 / 1024:7.1f} MB，"
+                  f"中断 {injector.drops} 次，耗时 {elapsed:6.1f} s")
+
+            injector.reset()
+            request_id = create_request(base_url)
+            start = time.perf_counter()
+            success = client.upload_chunked(request_id, png)
+            elapsed = time.perf_counter() - start
+            print(f"分块上传: {'成功' if success else '失败'}，发送 {injector.received / 1024 / 1024:7.1f} MB，"
+                  f"中断 {injector.drops} 次，耗时 {elapsed:6.1f} s")
+
+            if success:
+                data = requests.get(f"{base_url}/api/get-screenshot/{request_id}").json()
+                served = requests.get(base_url + data["image_url"]).content
+                print(f"\n取回结果: {data['image_url']}，与原始PNG{'一致' if served == png else '不一致'}")
+        finally:
+            client.session.close()
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# bench_dedup.py - 按内容寻址的截图去重效果
+#
+# 模拟展览现场：画面大部分时间静止（静态作品），每个截图请求以 --change-prob
+# 的概率遇到画面变化；另有一部分请求是上传失败后的重传（同一请求重复上传）。
+# 服务器通过 FastAPI TestClient 在进程内运行，分别以完整上传和增量上传驱动，
+# 报告 /api/dedup-stats 的去重比例和节省的字节数，并检查按内容寻址的图片地址
+# 返回长期缓存头、带 If-None-Match 的再次请求返回 304。
+#
+# 用法: python benchmarks/bench_dedup.py [--requests 300] [--change-prob 0.1] [--retry-prob 0.05]
+import argparse
+import logging
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.testclient import TestClient
+
+from app import server
+from screenshot_client import CaptureBackend, ScreenshotClient, SyntheticBackend
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class StaticSceneBackend(CaptureBackend):
+    """只有调用 change() 时画面才会变化的截图后端"""
+
+    name = "static-scene"
+
+    def __init__(self, width: int, height: int, seed: int):
+        self.source = SyntheticBackend(width, height, seed=seed, grain=0.1)
+        self.frame = self.source.grab()
+
+    def change(self):
+        self.frame = self.source.grab()
+
+    def grab(self, bbox=None):
+        return self.frame.crop(bbox) if bbox else self.frame.copy()
+
+
+def reset_server():
+    server.screenshot_requests.clear()
+    server.screenshots.clear()
+    server.image_blobs.clear()
+    server.dedup_counters.update({"stored": 0, "duplicates": 0})
+    server.get_room(server.DEFAULT_ROOM).base_frame.update({"frame_id": None, "image": None})
+
+
+def run(delta: bool, args):
+    reset_server()
+    rng = random.Random(args.seed)
+    http = TestClient(server.app)
+    backend = StaticSceneBackend(args.width, args.height, args.seed)
+    client = ScreenshotClient("http://testserver", delta_upload=delta, capture_backend=backend)
+    client.session = http
+
+    urls = set()
+    for _ in range(args.requests):
+        if rng.random() < args.change_prob:
+            backend.change()
+        request_id = http.post("/api/request-screenshot", json={
+            "user_id": "bench", "viewport_width": 390, "device_pixel_ratio": 3
+        }).json()["request_id"]
+        for request in client.check_requests():
+            client.process_screenshot_request(request)
+            if rng.random() < args.retry_prob:
+                # 模拟电脑端没收到响应后重传同一张截图
+                client.upload_image(request["request_id"], backend.grab())
+        urls.add(http.get(f"/api/get-screenshot/{request_id}").json()["image_url"])
+
+    stats = http.get("/api/dedup-stats").json()
+    url = next(iter(urls))
+    first = http.get(url)
+    second = http.get(url, headers={"If-None-Match": first.headers["etag"]})
+    return stats, len(urls), first.headers["cache-control"], second.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图去重基准测试")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--change-prob", type=float, default=0.1, help="每个请求前画面发生变化的概率")
+    parser.add_argument("--retry-prob", type=float, default=0.05, help="上传后重复上传同一截图的概率")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.requests} 个请求，画面变化概率 {args.change_prob:.0%}，重传概率 {args.retry_prob:.0%}\n")
+    for delta in (False, True):
+        stats, url_count, cache_control, revalidate_status = run(delta, args)
+        name = "增量上传" if delta else "完整上传"
+        print(f"{name}: 保存 {stats['stored']} 次，其中重复 {stats['duplicates']} 次，"
+              f"实际图片 {stats['blobs']} 份 / 引用 {stats['references']} 个，"
+              f"去重比例 {stats['dedup_ratio']:.1f}x，节省 {stats['bytes_saved'] / 1024 / 1024:.1f} MB "
+              f"(实际 {stats['stored_bytes'] / 1024 / 1024:.1f} MB)，不同图片地址 {url_count} 个")
+    print(f"\n图片地址缓存头: {cache_control}，带 If-None-Match 再次请求: {revalidate_status}")
+
+
+if __name__ == "__main__":
+    main()
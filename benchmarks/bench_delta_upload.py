@@ -0,0 +1,88 @@
+# bench_delta_upload.py - 图块增量上传的带宽与上传延迟基准测试
+#
+# 使用合成的“缓慢演化的生成艺术”画面，每次截图随机改变约5%的图块，
+# 分别测量完整上传与增量上传的请求体大小和上传延迟。
+# 服务器通过 FastAPI TestClient 在进程内运行，不需要显示器和网络。
+#
+# 用法: python benchmarks/bench_delta_upload.py [--frames 30] [--change-ratio 0.05] [--bandwidth-mbps 20]
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.testclient import TestClient
+
+from _common import percentile
+from app import server
+import screenshot_client
+from screenshot_client import ScreenshotClient, SyntheticBackend
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def run(mode: str, frames, bandwidth_mbps: float, keyframe_interval: int, tile_size: int):
+    """按指定模式上传全部帧，返回 (总字节数, 每帧上传延迟列表)"""
+    server.get_room(server.DEFAULT_ROOM).base_frame.update({"frame_id": None, "image": None})
+    http = TestClient(server.app)
+    client = ScreenshotClient("http://testserver", delta_upload=(mode == "delta"),
+                              tile_size=tile_size, keyframe_interval=keyframe_interval)
+    client.session = http
+
+    sent = {"bytes": 0}
+    original_post = http.post
+
+    def counting_post(url, json=None, **kwargs):
+        response = original_post(url, json=json, **kwargs)
+        if "/api/upload-screenshot" in url:
+            sent["bytes"] += len(response.request.content)
+        return response
+
+    http.post = counting_post
+
+    latencies = []
+    for frame in frames:
+        request_id = http.post("/api/request-screenshot", json={"user_id": "bench"}).json()["request_id"]
+        before = sent["bytes"]
+        start = time.perf_counter()
+        assert client.upload_image(request_id, frame)
+        elapsed = time.perf_counter() - start
+        payload = sent["bytes"] - before
+        # 加上按链路带宽估算的传输时间
+        latencies.append(elapsed + payload * 8 / (bandwidth_mbps * 1_000_000))
+    return sent["bytes"], latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图块增量上传基准测试")
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--change-ratio", type=float, default=0.05)
+    parser.add_argument("--tile-size", type=int, default=screenshot_client.DEFAULT_TILE_SIZE)
+    parser.add_argument("--keyframe-interval", type=int, default=screenshot_client.DEFAULT_KEYFRAME_INTERVAL)
+    parser.add_argument("--bandwidth-mbps", type=float, default=20.0, help="估算传输时间使用的上行带宽")
+    args = parser.parse_args()
+
+    backend = SyntheticBackend(args.width, args.height, args.change_ratio, args.tile_size, seed=42)
+    frames = [backend.grab() for _ in range(args.frames)]
+
+    results = {}
+    for mode in ("full", "delta"):
+        results[mode] = run(mode, frames, args.bandwidth_mbps, args.keyframe_interval, args.tile_size)
+
+    print(f"帧数: {args.frames}, 分辨率: {args.width}x{args.height}, 每帧变化图块: {args.change_ratio:.0%}, "
+          f"带宽: {args.bandwidth_mbps} Mbit/s")
+    for mode, (total, latencies) in results.items():
+        print(f"{mode:>5}: 总上传 {total / 1024 / 1024:8.2f} MB, 每帧 {total / len(latencies) / 1024:8.1f} KB, "
+              f"延迟 p50 {percentile(latencies, 0.5) * 1000:7.1f} ms, p95 {percentile(latencies, 0.95) * 1000:7.1f} ms")
+    full_total, full_lat = results["full"]
+    delta_total, delta_lat = results["delta"]
+    print(f"带宽节省: {1 - delta_total / full_total:.1%}, "
+          f"p50 延迟节省: {1 - percentile(delta_lat, 0.5) / percentile(full_lat, 0.5):.1%}")
+
+
+if __name__ == "__main__":
+    main()
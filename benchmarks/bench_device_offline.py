@@ -0,0 +1,97 @@
+# bench_device_offline.py - 电脑端离线期间手机端的无效轮询
+#
+# 在子进程中启动 uvicorn 服务器（DEVICE_TIMEOUT 调小以缩短测试时间），模拟一次展厅故障：
+#   - 电脑端（ScreenshotClient，合成画面）先正常运行一段时间，随后退出（模拟关机或连续出错后退出）
+#   - 离线判定时间过后，一批手机按页面的逻辑发起截图请求：每1.5秒轮询一次，30秒后放弃；
+#     服务器返回503或 device_online 为 false 时立即停止
+# 统计每个手机发出的HTTP请求数和从点击到得到结果（放弃或提示离线）的时间。
+# 通过 --app-dir 可以指向另一份代码（例如旧版本的检出目录）做对比。
+#
+# 用法: python benchmarks/bench_device_offline.py [--phones 50] [--device-timeout 3] [--app-dir 路径]
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+
+from _common import free_port, start_server
+from screenshot_client import ScreenshotClient, SyntheticBackend
+
+logging.getLogger().setLevel(logging.WARNING)
+
+# 手机页面的轮询间隔和放弃时间（秒）
+PAGE_POLL_INTERVAL = 1.5
+PAGE_TIMEOUT = 30
+
+
+def phone(base_url: str, index: int) -> dict:
+    """按手机页面的逻辑截图一次，返回请求数、耗时和结果"""
+    start = time.perf_counter()
+    calls = 1
+    with requests.Session() as session:
+        response = session.post(f"{base_url}/api/request-screenshot", json={
+            "user_id": f"phone-{index}", "viewport_width": 390, "device_pixel_ratio": 3
+        }, timeout=30)
+        if response.status_code == 503:
+            return {"calls": calls, "elapsed": time.perf_counter() - start, "result": "offline"}
+        request_id = response.json()["request_id"]
+        while time.perf_counter() - start < PAGE_TIMEOUT:
+            time.sleep(PAGE_POLL_INTERVAL)
+            calls += 1
+            data = session.get(f"{base_url}/api/get-screenshot/{request_id}", timeout=30).json()
+            if data["status"] == "completed":
+                return {"calls": calls, "elapsed": time.perf_counter() - start, "result": "completed"}
+            if data.get("device_online") is False:
+                return {"calls": calls, "elapsed": time.perf_counter() - start, "result": "offline"}
+    return {"calls": calls, "elapsed": time.perf_counter() - start, "result": "timeout"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="电脑端离线期间手机端的无效轮询")
+    parser.add_argument("--phones", type=int, default=50)
+    parser.add_argument("--device-timeout", type=float, default=3, help="服务器的离线判定时间 DEVICE_TIMEOUT（秒）")
+    parser.add_argument("--online-seconds", type=float, default=3, help="电脑端退出前的运行时间（秒）")
+    parser.add_argument("--app-dir", default=ROOT, help="包含 app/server.py 的目录")
+    args = parser.parse_args()
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(port, workdir, os.path.abspath(args.app_dir), {"DEVICE_TIMEOUT": args.device_timeout})
+        try:
+            # 电脑端先正常工作，再退出；之后等待超过离线判定时间和服务器启动宽限期
+            client = ScreenshotClient(base_url, capture_backend=SyntheticBackend(480, 270))
+            thread = threading.Thread(target=client.run, args=(0.2,), daemon=True)
+            thread.start()
+            time.sleep(args.online_seconds)
+            client.stop()
+            thread.join()
+            time.sleep(args.device_timeout + 1)
+            with ThreadPoolExecutor(max_workers=args.phones) as pool:
+                results = list(pool.map(phone, [base_url] * args.phones, range(args.phones)))
+        finally:
+            server.terminate()
+            server.wait()
+
+    calls = [result["calls"] for result in results]
+    waits = [result["elapsed"] for result in results]
+    outcomes = {name: sum(1 for result in results if result["result"] == name)
+                for name in ("offline", "timeout", "completed")}
+    print(f"CPU核心数: {os.cpu_count()}，{args.phones} 个手机，DEVICE_TIMEOUT {args.device_timeout:g} s，"
+          f"代码目录 {os.path.abspath(args.app_dir)}\n")
+    print(f"结果: 提示离线 {outcomes['offline']}，超时放弃 {outcomes['timeout']}，完成 {outcomes['completed']}")
+    print(f"每个手机的HTTP请求数: 平均 {statistics.mean(calls):.1f}，最多 {max(calls)}，合计 {sum(calls)}")
+    print(f"从点击到得到结果: 中位数 {statistics.median(waits):.2f} s，最长 {max(waits):.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+# bench_e2e.py - 请求/截图/获取全流程的端到端负载测试
+#
+# 按真实流程驱动整个系统：
+#   - 手机端: 打开 /mobile，发起截图请求，轮询 /api/get-screenshot，下载 srcset 中按屏幕选择的图片；
+#     large_flood 场景中还会像全屏查看一样请求并下载全分辨率原图
+#   - 电脑端: M 个 ScreenshotClient（合成画面）运行真实的 run() 主循环，每个绑定一个房间，
+#     手机按顺序分配到各房间
+# 场景:
+#   - qr_burst:    大量手机在几秒内同时扫码，各截图一次
+#   - trickle:     手机按泊松过程持续到达，各截图一次
+#   - large_flood: 少量手机请求高分辨率、难压缩画面的原图（分块上传）
+# 统计吞吐量、端到端延迟 p50/p95/p99（发起请求到图片下载完成）、失败/超时次数，
+# 以及服务器CPU占用和常驻内存峰值。结果输出为JSON，--compare 可与之前的结果对比。
+#
+# 服务器默认在子进程中运行（每个场景一个新进程，--app-dir 可指向另一份代码）；
+# --mode inprocess 时在本进程的线程中运行 uvicorn，CPU和内存统计会包含负载生成本身。
+#
+# 用法: python benchmarks/bench_e2e.py [--scenarios qr_burst,trickle,large_flood] [--viewers 100]
+#                                      [--workers 4] [--output result.json] [--compare baseline.json]
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+import uvicorn
+
+from _common import free_port, percentile
+from screenshot_client import ScreenshotClient, SyntheticBackend
+
+logging.getLogger().setLevel(logging.WARNING)
+
+# 手机的 (CSS宽度, 设备像素比)，页面截图区域最宽500px
+PHONES = [(390, 3.0), (412, 2.625), (360, 2.0), (430, 3.0)]
+# 与 /mobile 页面一致的等待上限（秒）
+PHONE_TIMEOUT = 30
+
+
+def wait_until_ready(base_url: str):
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            requests.get(f"{base_url}/api/dedup-stats", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError("服务器启动失败")
+
+
+class SubprocessServer:
+    """在临时工作目录中运行的 uvicorn 子进程"""
+
+    def __init__(self, app_dir: str):
+        self.workdir = tempfile.TemporaryDirectory()
+        port = free_port()
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.server:app", "--app-dir", app_dir,
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=self.workdir.name, env={**os.environ, "SERVER_URL": self.base_url},
+        )
+        try:
+            wait_until_ready(self.base_url)
+        except RuntimeError:
+            self.close()
+            raise
+        self.pid = self.process.pid
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+        self.workdir.cleanup()
+
+
+class InProcessServer:
+    """在本进程后台线程中运行的 uvicorn，所有场景共用"""
+
+    def __init__(self, app_dir: str):
+        # app.server 导入时会在当前目录创建 static/ 和 uploads/
+        self.workdir = tempfile.TemporaryDirectory()
+        os.chdir(self.workdir.name)
+        sys.path.insert(0, app_dir)
+        from app import server as server_module
+        port = free_port()
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(server_module.app, host="127.0.0.1", port=port,
+                                                    log_level="warning"))
+        threading.Thread(target=self.server.run, daemon=True).start()
+        wait_until_ready(self.base_url)
+        self.pid = os.getpid()
+
+    def close(self):
+        self.server.should_exit = True
+
+
+def process_usage(pid: int):
+    """返回 (CPU秒数, 常驻内存字节)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+
+class UsageSampler:
+    """后台线程定时采样服务器进程，记录常驻内存峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, process_usage(self.pid)[1])
+
+    def __enter__(self):
+        self.cpu_start, self.rss_start = process_usage(self.pid)
+        self.peak_rss = self.rss_start
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        self.cpu_end, self.rss_end = process_usage(self.pid)
+        self.peak_rss = max(self.peak_rss, self.rss_end)
+
+    def result(self) -> dict:
+        return {
+            "cpu_seconds": round(self.cpu_end - self.cpu_start, 3),
+            "cpu_percent": round((self.cpu_end - self.cpu_start) / self.elapsed * 100, 1),
+            "rss_start_mb": round(self.rss_start / 1024 / 1024, 1),
+            "rss_peak_mb": round(self.peak_rss / 1024 / 1024, 1),
+            "rss_end_mb": round(self.rss_end / 1024 / 1024, 1),
+        }
+
+
+def latency_summary(values) -> dict:
+    def ms(value):
+        return round(value * 1000, 1) if values else None
+    return {"count": len(values), "p50_ms": ms(percentile(values, 0.5)), "p95_ms": ms(percentile(values, 0.95)),
+            "p99_ms": ms(percentile(values, 0.99)), "max_ms": ms(max(values) if values else None)}
+
+
+def pick_from_srcset(data: dict, css_width: float, pixel_ratio: float) -> str:
+    """按浏览器的规则选择 srcset 中不小于所需像素宽度的最小候选，没有 srcset 时使用原图"""
+    if not data.get("srcset"):
+        return data["image_url"]
+    candidates = sorted((int(w.rstrip("w")), url) for url, w in (item.split() for item in data["srcset"].split(", ")))
+    needed = min(css_width, 500) * pixel_ratio
+    for width, url in candidates:
+        if width >= needed:
+            return url
+    return candidates[-1][1]
+
+
+class Stats:
+    """各手机线程共享的结果，加锁更新"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = []  # 发起请求到图片下载完成
+        self.fullscreen_latency = []
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.bytes = 0
+
+    def add(self, **values):
+        with self.lock:
+            for name, value in values.items():
+                if isinstance(getattr(self, name), list):
+                    getattr(self, name).append(value)
+                else:
+                    setattr(self, name, getattr(self, name) + value)
+
+
+def capture(session: requests.Session, base_url: str, room: str, body: dict, poll: float) -> dict:
+    """发起一次截图请求并轮询到完成，返回 get-screenshot 的结果；超时抛出 TimeoutError"""
+    response = session.post(f"{base_url}/api/request-screenshot", json={**body, "room": room}, timeout=PHONE_TIMEOUT)
+    response.raise_for_status()
+    request_id = response.json()["request_id"]
+    deadline = time.time() + PHONE_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(poll)
+        response = session.get(f"{base_url}/api/get-screenshot/{request_id}", params={"room": room},
+                               timeout=PHONE_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()
+        if data["status"] == "completed":
+            data["request_id"] = request_id
+            return data
+    raise TimeoutError(request_id)
+
+
+def viewer(base_url: str, room: str, rng: random.Random, captures: int, fullscreen: bool, poll: float,
+           stats: Stats):
+    """一个手机按 /mobile 页面的流程截图和查看"""
+    css_width, pixel_ratio = rng.choice(PHONES)
+    with requests.Session() as session:
+        try:
+            session.get(f"{base_url}/mobile", params={"room": room}, timeout=PHONE_TIMEOUT).raise_for_status()
+            for _ in range(captures):
+                start = time.perf_counter()
+                data = capture(session, base_url, room, {
+                    "user_id": f"art_viewer_{rng.getrandbits(32)}",
+                    "viewport_width": min(css_width, 500), "device_pixel_ratio": pixel_ratio
+                }, poll)
+                image = session.get(base_url + pick_from_srcset(data, css_width, pixel_ratio), timeout=PHONE_TIMEOUT)
+                image.raise_for_status()
+                stats.add(latency=time.perf_counter() - start, completed=1, bytes=len(image.content))
+                if fullscreen:
+                    start = time.perf_counter()
+                    original = capture(session, base_url, room, {
+                        "user_id": f"art_viewer_{rng.getrandbits(32)}", "full_resolution_of": data["request_id"]
+                    }, poll)
+                    image = session.get(base_url + original["image_url"], timeout=PHONE_TIMEOUT)
+                    image.raise_for_status()
+                    stats.add(fullscreen_latency=time.perf_counter() - start, bytes=len(image.content))
+        except TimeoutError:
+            stats.add(timeouts=1)
+        except requests.RequestException:
+            stats.add(failed=1)
+
+
+def scenario_plan(name: str, args) -> dict:
+    """场景参数：手机数、到达时间、每个手机的截图次数、画面尺寸和纹理"""
+    rng = random.Random(args.seed)
+    if name == "qr_burst":
+        arrivals = sorted(rng.uniform(0, args.burst_window) for _ in range(args.viewers))
+        return {"arrivals": arrivals, "captures": 1, "fullscreen": False, "size": (1920, 1080), "grain": 0.0}
+    if name == "trickle":
+        arrivals, t = [], rng.expovariate(args.trickle_rate)
+        while t < args.trickle_duration:
+            arrivals.append(t)
+            t += rng.expovariate(args.trickle_rate)
+        return {"arrivals": arrivals, "captures": 1, "fullscreen": False, "size": (1920, 1080), "grain": 0.0}
+    if name == "large_flood":
+        arrivals = sorted(rng.uniform(0, 1) for _ in range(args.flood_viewers))
+        return {"arrivals": arrivals, "captures": args.flood_captures, "fullscreen": True,
+                "size": (args.flood_width, args.flood_height), "grain": 0.3}
+    raise ValueError(f"未知场景: {name}")
+
+
+def run_scenario(name: str, args, server) -> dict:
+    plan = scenario_plan(name, args)
+    width, height = plan["size"]
+    rooms = [f"load-{index}" for index in range(args.workers)] if args.workers > 1 else ["default"]
+    clients = [ScreenshotClient(server.base_url, capture_backend=SyntheticBackend(
+                   width, height, change_ratio=0.05, seed=index, grain=plan["grain"]), room=room)
+               for index, room in enumerate(rooms)]
+    client_threads = [threading.Thread(target=client.run, args=(args.client_poll,), daemon=True) for client in clients]
+    for thread in client_threads:
+        thread.start()
+    # 电脑端先完成连接测试并进入轮询
+    time.sleep(1)
+
+    stats = Stats()
+    rng = random.Random(args.seed)
+    phones = []
+    with UsageSampler(server.pid) as usage:
+        start = time.perf_counter()
+        for index, arrival in enumerate(plan["arrivals"]):
+            delay = start + arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            thread = threading.Thread(target=viewer, args=(
+                server.base_url, rooms[index % len(rooms)], random.Random(rng.getrandbits(32)),
+                plan["captures"], plan["fullscreen"], args.phone_poll, stats))
+            thread.start()
+            phones.append(thread)
+        for thread in phones:
+            thread.join()
+    for client in clients:
+        client.stop()
+    for thread in client_threads:
+        thread.join()
+
+    attempted = len(plan["arrivals"]) * plan["captures"]
+    return {
+        "viewers": len(plan["arrivals"]),
+        "capture_workers": len(clients),
+        "frame_size": f"{width}x{height}",
+        "attempted": attempted,
+        "completed": stats.completed,
+        "failed": stats.failed,
+        "timeouts": stats.timeouts,
+        "duration_s": round(usage.elapsed, 2),
+        "throughput_per_s": round(stats.completed / usage.elapsed, 2),
+        "downloaded_mb": round(stats.bytes / 1024 / 1024, 2),
+        "latency": latency_summary(stats.latency),
+        **({"fullscreen_latency": latency_summary(stats.fullscreen_latency)} if plan["fullscreen"] else {}),
+        "server": usage.result(),
+    }
+
+
+def git_commit(app_dir: str):
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=app_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(name: str, result: dict, baseline: dict = None):
+    latency = result["latency"]
+    print(f"{name:<12} 完成 {result['completed']}/{result['attempted']}（失败 {result['failed']}，超时 {result['timeouts']}），"
+          f"{result['throughput_per_s']:.2f} 次/秒，延迟 p50 {latency['p50_ms']} / p95 {latency['p95_ms']} / "
+          f"p99 {latency['p99_ms']} ms，服务器CPU {result['server']['cpu_percent']}%，"
+          f"内存峰值 {result['server']['rss_peak_mb']} MB")
+    if "fullscreen_latency" in result:
+        full = result["fullscreen_latency"]
+        print(f"{'':<12} 全屏原图延迟 p50 {full['p50_ms']} / p95 {full['p95_ms']} / p99 {full['p99_ms']} ms")
+    if baseline:
+        changes = []
+        for label, path in (("吞吐量", ("throughput_per_s",)), ("p50", ("latency", "p50_ms")),
+                            ("p99", ("latency", "p99_ms")), ("CPU", ("server", "cpu_percent")),
+                            ("内存峰值", ("server", "rss_peak_mb"))):
+            old, new = baseline, result
+            for key in path:
+                old, new = old.get(key) if old else None, new.get(key) if new else None
+            if old and new is not None:
+                changes.append(f"{label} {(new - old) / old:+.0%}")
+        print(f"{'':<12} 对比基准: {'，'.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="请求/截图/获取全流程负载测试")
+    parser.add_argument("--scenarios", default="qr_burst,trickle,large_flood")
+    parser.add_argument("--mode", choices=("subprocess", "inprocess"), default="subprocess")
+    parser.add_argument("--app-dir", default=ROOT, help="包含 app/server.py 的目录")
+    parser.add_argument("--workers", type=int, default=4, help="电脑端（截图客户端）数量，每个一个房间")
+    parser.add_argument("--client-poll", type=float, default=0.5, help="电脑端最小轮询间隔（秒）")
+    parser.add_argument("--phone-poll", type=float, default=0.5, help="手机端轮询间隔（秒，页面实际为1.5）")
+    parser.add_argument("--viewers", type=int, default=100, help="qr_burst 的手机数")
+    parser.add_argument("--burst-window", type=float, default=3, help="qr_burst 的到达时间窗（秒）")
+    parser.add_argument("--trickle-rate", type=float, default=2, help="trickle 每秒到达的手机数")
+    parser.add_argument("--trickle-duration", type=float, default=30)
+    parser.add_argument("--flood-viewers", type=int, default=8)
+    parser.add_argument("--flood-captures", type=int, default=2, help="large_flood 每个手机的截图次数")
+    parser.add_argument("--flood-width", type=int, default=3840)
+    parser.add_argument("--flood-height", type=int, default=2160)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="结果JSON的保存路径，默认只打印")
+    parser.add_argument("--compare", help="之前保存的结果JSON，打印各项变化")
+    args = parser.parse_args()
+
+    app_dir = os.path.abspath(args.app_dir)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["scenarios"]
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(app_dir),
+            "app_dir": app_dir,
+            "mode": args.mode,
+            # 进程内运行时服务器统计包含手机和电脑端模拟本身
+            "server_metrics_include_load_generator": args.mode == "inprocess",
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+    print(f"CPU核心数: {os.cpu_count()}，{args.mode} 模式，代码目录 {app_dir}（{report['meta']['commit']}），"
+          f"{args.workers} 个电脑端\n")
+
+    shared = InProcessServer(app_dir) if args.mode == "inprocess" else None
+    try:
+        for name in args.scenarios.split(","):
+            server = shared or SubprocessServer(app_dir)
+            try:
+                result = report["scenarios"][name] = run_scenario(name, args, server)
+            finally:
+                if server is not shared:
+                    server.close()
+            print_summary(name, result, baseline.get(name) if baseline else None)
+    finally:
+        if shared:
+            shared.close()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"\n结果已保存到 {args.output}")
+    else:
+        print("\n" + output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# bench_event_loop.py - 并发大图上传期间 /api/get-screenshot 的延迟
+#
+# 在子进程中启动 uvicorn 服务器，若干上传线程不断上传 1920x1080 的完整关键帧
+# （数MB的JSON请求体，服务器需要解析、base64解码、计算摘要并解码为基准帧），
+# 同时一个轮询线程模拟等待结果的手机，持续请求一个已完成截图的 /api/get-screenshot，
+# 统计空闲和上传期间的 p50/p99/最大延迟，以及首页（二维码）的延迟。
+# 通过 --app-dir 可以指向另一份代码（例如旧版本的检出目录）做对比。
+#
+# 用法: python benchmarks/bench_event_loop.py [--uploaders 4] [--duration 10] [--app-dir 路径]
+import argparse
+import base64
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+
+from _common import free_port, percentile, start_server
+from screenshot_client import SyntheticBackend, encode_png_bytes
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def upload(session: requests.Session, base_url: str, image_data: str) -> str:
+    request_id = session.post(f"{base_url}/api/request-screenshot", json={"user_id": "bench"}).json()["request_id"]
+    session.post(f"{base_url}/api/upload-screenshot", json={
+        "request_id": request_id, "image_data": image_data, "frame_id": uuid.uuid4().hex
+    }).raise_for_status()
+    return request_id
+
+
+def measure(base_url: str, path: str, stop: threading.Event, interval: float):
+    latencies = []
+    with requests.Session() as session:
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.get(base_url + path).raise_for_status()
+            latencies.append(time.perf_counter() - start)
+            time.sleep(interval)
+    return latencies
+
+
+def run_phase(base_url: str, poll_path: str, duration: float, uploaders: int, image_data: str):
+    """返回 (get-screenshot 延迟, 首页延迟, 完成的上传数)"""
+    stop = threading.Event()
+    results = {}
+    uploaded = [0]
+
+    def uploader():
+        with requests.Session() as session:
+            while not stop.is_set():
+                upload(session, base_url, image_data)
+                uploaded[0] += 1
+
+    threads = [threading.Thread(target=uploader) for _ in range(uploaders)]
+    threads.append(threading.Thread(target=lambda: results.update(poll=measure(base_url, poll_path, stop, 0.005))))
+    threads.append(threading.Thread(target=lambda: results.update(root=measure(base_url, "/", stop, 0.1))))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return results["poll"], results["root"], uploaded[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发上传期间的事件循环响应延迟")
+    parser.add_argument("--uploaders", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--app-dir", default=ROOT, help="包含 app/server.py 的目录")
+    args = parser.parse_args()
+
+    png = encode_png_bytes(SyntheticBackend(args.width, args.height, seed=1, grain=0.1).grab())
+    image_data = base64.b64encode(png).decode()
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(port, workdir, os.path.abspath(args.app_dir))
+        try:
+            with requests.Session() as session:
+                request_id = upload(session, base_url, image_data)
+            poll_path = f"/api/get-screenshot/{request_id}"
+            print(f"CPU核心数: {os.cpu_count()}，上传体 {len(image_data) / 1024 / 1024:.1f} MB，"
+                  f"代码目录 {os.path.abspath(args.app_dir)}\n")
+            for name, uploaders in (("空闲", 0), (f"{args.uploaders}路并发上传", args.uploaders)):
+                poll, root, uploaded = run_phase(base_url, poll_path, args.duration, uploaders, image_data)
+                print(f"{name:<10}: get-screenshot p50 {percentile(poll, 0.5) * 1000:7.1f} ms, "
+                      f"p99 {percentile(poll, 0.99) * 1000:7.1f} ms, 最大 {max(poll) * 1000:7.1f} ms | "
+                      f"首页 p50 {percentile(root, 0.5) * 1000:6.1f} ms | 完成上传 {uploaded} 次")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
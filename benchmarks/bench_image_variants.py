@@ -0,0 +1,148 @@
+# bench_image_variants.py - 响应式图片变体的流量与事件循环延迟
+#
+# 在后台线程中启动本地 uvicorn 服务器（app.server），上传一批截图后：
+#   1. 变体生成突发: 多个手机同时请求尚未生成的 thumb/mobile 变体，同时另一个线程
+#      持续轮询 /api/get-screenshot，统计轮询延迟（反映事件循环被阻塞的程度）。
+#      分别以 VARIANT_WORKERS=0（在事件循环中生成）和进程池运行。
+#   2. 每次查看的流量: 按典型手机的显示宽度和设备像素比，模拟浏览器从 srcset 中
+#      选择的图片，与直接下载PNG原图比较。
+#
+# 用法: python benchmarks/bench_image_variants.py [--images 16] [--viewers 8] [--workers 2]
+import argparse
+import base64
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+
+from _common import free_port, percentile, serve_in_thread
+from screenshot_client import SyntheticBackend, encode_png_bytes
+
+logging.getLogger().setLevel(logging.WARNING)
+
+# (说明, 显示宽度, 设备像素比)，显示宽度与 /mobile 页面一样限制在 500px 以内
+VIEWERS = [
+    ("iPhone 390@3x", 390, 3.0),
+    ("Android 412@2.625x", 412, 2.625),
+    ("小屏 360@2x", 360, 2.0),
+    ("平板 500@2x", 500, 2.0),
+]
+
+
+def upload_images(base_url: str, pngs):
+    """为每张图片创建请求并上传，返回 get-screenshot 的结果列表"""
+    results = []
+    with requests.Session() as session:
+        for png in pngs:
+            request_id = session.post(f"{base_url}/api/request-screenshot", json={"user_id": "bench"}).json()["request_id"]
+            session.post(f"{base_url}/api/upload-screenshot", json={
+                "request_id": request_id, "image_data": base64.b64encode(png).decode()
+            }).raise_for_status()
+            results.append((request_id, session.get(f"{base_url}/api/get-screenshot/{request_id}").json()))
+    return results
+
+
+def pick_from_srcset(srcset: str, css_width: float, pixel_ratio: float) -> str:
+    """按浏览器的规则选择 srcset 中不小于所需像素宽度的最小候选，都不够时选最大的"""
+    candidates = sorted((int(w.rstrip("w")), url) for url, w in (item.split() for item in srcset.split(", ")))
+    needed = css_width * pixel_ratio
+    for width, url in candidates:
+        if width >= needed:
+            return url
+    return candidates[-1][1]
+
+
+def burst(base_url: str, shots, viewers: int):
+    """并发请求全部图片的 thumb/mobile 变体，同时轮询 get-screenshot，返回 (突发耗时, 轮询延迟列表)"""
+    poll_id = shots[0][0]
+    latencies = []
+    done = threading.Event()
+
+    def poll():
+        with requests.Session() as session:
+            while not done.is_set():
+                start = time.perf_counter()
+                session.get(f"{base_url}/api/get-screenshot/{poll_id}")
+                latencies.append(time.perf_counter() - start)
+                time.sleep(0.01)
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    time.sleep(0.2)
+
+    urls = [data["variants"][name] for _, data in shots for name in ("thumb", "mobile")]
+    local = threading.local()
+
+    def fetch(url):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        local.session.get(base_url + url).raise_for_status()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(viewers) as pool:
+        list(pool.map(fetch, urls))
+    elapsed = time.perf_counter() - start
+    done.set()
+    poller.join()
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="响应式图片变体基准测试")
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--viewers", type=int, default=8, help="同时请求变体的手机数")
+    parser.add_argument("--workers", type=int, default=2, help="进程池大小")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    args = parser.parse_args()
+
+    backend = SyntheticBackend(args.width, args.height, change_ratio=0.3, seed=1, grain=0.1)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # app.server 导入时会在当前目录创建 static/ 和 uploads/
+        os.chdir(workdir)
+        from app import server as server_module
+
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = serve_in_thread(server_module.app, port)
+        try:
+            print(f"CPU核心数: {os.cpu_count()}，{args.images} 张 {args.width}x{args.height} 截图，"
+                  f"{args.viewers} 个手机同时请求变体（{server_module.VARIANT_FORMAT}）\n")
+            for workers in (0, args.workers):
+                server_module.VARIANT_WORKERS = workers
+                # 每轮使用新的画面，保证变体都需要重新生成
+                shots = upload_images(base_url, [encode_png_bytes(backend.grab()) for _ in range(args.images)])
+                elapsed, latencies = burst(base_url, shots, args.viewers)
+                name = "事件循环内生成" if workers == 0 else f"进程池({workers})"
+                print(f"{name:<10}: 生成 {args.images * 2} 个变体耗时 {elapsed:5.2f} s，期间轮询延迟 "
+                      f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms，p99 {percentile(latencies, 0.99) * 1000:7.1f} ms，"
+                      f"最大 {max(latencies) * 1000:7.1f} ms")
+
+            print("\n每次查看的流量（srcset 选择 vs PNG原图）:")
+            with requests.Session() as session:
+                sizes = {}
+                for _, data in shots:
+                    for url in (data["image_url"], *data["variants"].values()):
+                        sizes[url] = len(session.get(base_url + url).content)
+                original = sum(sizes[data["image_url"]] for _, data in shots) / len(shots)
+                for name, css_width, pixel_ratio in VIEWERS:
+                    picked = [pick_from_srcset(data["srcset"], css_width, pixel_ratio) for _, data in shots]
+                    average = sum(sizes[url] for url in picked) / len(picked)
+                    variant = picked[0].rsplit("/", 1)[-1]
+                    print(f"  {name:<20} -> {variant:<12} {average / 1024:7.1f} KB，原图 {original / 1024:7.1f} KB "
+                          f"(小 {original / average:4.1f}x)")
+        finally:
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# bench_journal.py - 状态日志的写入开销、崩溃恢复与重启耗时
+#
+# 三部分，服务器均在子进程中运行（临时工作目录）：
+#   - 写入开销: 分别在不启用和启用 JOURNAL_DIR 时，依次发起截图请求、由电脑端领取并上传
+#     （每次内容不同的PNG，启用时图片也要写入 blobs/），比较 request-screenshot 和
+#     upload-screenshot 的延迟
+#   - 崩溃恢复: 启用日志时创建一批请求并完成其中一半，等待一个写入窗口后 kill -9 服务器，
+#     重启后检查已完成的请求仍能取到图片、未完成的请求重新排队
+#   - 重启耗时: 用 app.server.Journal 直接生成 --entries 条日志（创建、领取、完成、过期），
+#     测量从启动 uvicorn 到第一个接口响应的时间：首次启动回放日志，压缩为快照后再次启动只读快照；
+#     并与不启用日志时对比
+#
+# 用法: python benchmarks/bench_journal.py [--requests 300] [--entries 100000] [--app-dir 路径]
+import argparse
+import base64
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+import requests
+from PIL import Image
+
+from _common import free_port, percentile, launch_server, wait_ready
+
+GENERATE_SCRIPT = """
+import os, sys, time, uuid
+sys.path.insert(0, sys.argv[1])
+os.chdir(sys.argv[2])
+from app import server
+entries, images = int(sys.argv[3]), sys.argv[4:]
+journal = server.Journal(os.path.join(sys.argv[2], "journal"))
+journal.start()
+now = time.time()
+# 每个请求依次: 创建、领取、完成（约一半）、过期（约十分之一），直到日志达到指定条数
+written = index = 0
+while written < entries:
+    key = uuid.uuid4().bytes
+    record = server.RequestRecord(user_id=f"phone-{index}", timestamp=now - 1800 + index * 1e-3,
+                                  viewport_width=390, device_pixel_ratio=3.0, room=f"exhibit-{index % 8}")
+    journal.append(("created", key, record))
+    written += 1
+    if index % 4 != 3:
+        journal.append(("claimed", key))
+        written += 1
+    if index % 2 == 0:
+        digest = str(index % len(images)).rjust(64, "0")
+        journal.append(("completed", key, digest, record.timestamp + 2, images[index % len(images)]))
+        written += 1
+    if index % 10 == 9:
+        journal.append(("expired", key))
+        written += 1
+    index += 1
+journal.close()
+print(written, len(journal.state))
+"""
+
+
+def journal_env(journal_dir) -> dict:
+    """JOURNAL_DIR 为 None 时从环境中删除，即不启用日志"""
+    return {"DEVICE_TIMEOUT": 3600, "JOURNAL_DIR": journal_dir}
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    process.wait()
+
+
+def random_png(rng: random.Random, width: int = 160, height: int = 90) -> bytes:
+    image = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def describe(values) -> str:
+    return (f"p50 {percentile(values, 0.5) * 1000:6.2f} ms  p99 {percentile(values, 0.99) * 1000:6.2f} ms  "
+            f"平均 {statistics.mean(values) * 1000:6.2f} ms")
+
+
+def request_and_upload(session, base_url: str, rng: random.Random, upload: bool = True) -> tuple:
+    """发起一次截图请求，电脑端领取并上传，返回 (请求ID, 请求耗时, 上传耗时)"""
+    start = time.perf_counter()
+    request_id = session.post(f"{base_url}/api/request-screenshot", json={
+        "user_id": "phone", "viewport_width": 390, "device_pixel_ratio": 3}).json()["request_id"]
+    created = time.perf_counter() - start
+    session.get(f"{base_url}/api/check-requests").raise_for_status()
+    if not upload:
+        return request_id, created, None
+    image_data = base64.b64encode(random_png(rng)).decode()
+    start = time.perf_counter()
+    session.post(f"{base_url}/api/upload-screenshot", json={
+        "request_id": request_id, "image_data": image_data}).raise_for_status()
+    return request_id, created, time.perf_counter() - start
+
+
+def measure_overhead(app_dir: str, count: int, journal: bool) -> tuple:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as workdir:
+        journal_dir = os.path.join(workdir, "journal") if journal else None
+        server = launch_server(port, workdir, app_dir, journal_env(journal_dir))
+        try:
+            wait_ready(base_url, timeout=120, interval=0.005)
+            created, uploaded = [], []
+            with requests.Session() as session:
+                for _ in range(20):
+                    request_and_upload(session, base_url, rng)
+                for _ in range(count):
+                    _, create_time, upload_time = request_and_upload(session, base_url, rng)
+                    created.append(create_time)
+                    uploaded.append(upload_time)
+            stats = requests.get(f"{base_url}/api/journal").json() if journal else {}
+        finally:
+            stop_server(server)
+    return created, uploaded, stats
+
+
+def crash_recovery(app_dir: str, count: int) -> dict:
+    """完成一半请求后 kill -9，重启后检查恢复结果"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    rng = random.Random(2)
+    with tempfile.TemporaryDirectory() as workdir:
+        journal_dir = os.path.join(workdir, "journal")
+        server = launch_server(port, workdir, app_dir, journal_env(journal_dir))
+        completed, pending = [], []
+        try:
+            wait_ready(base_url, timeout=120, interval=0.005)
+            with requests.Session() as session:
+                for index in range(count):
+                    request_id, _, _ = request_and_upload(session, base_url, rng, upload=index % 2 == 0)
+                    (completed if index % 2 == 0 else pending).append(request_id)
+            time.sleep(0.2)
+            server.send_signal(signal.SIGKILL)
+            server.wait()
+            server = launch_server(port, workdir, app_dir, journal_env(journal_dir))
+            wait_ready(base_url, timeout=120, interval=0.005)
+            with requests.Session() as session:
+                recovered = 0
+                for request_id in completed:
+                    data = session.get(f"{base_url}/api/get-screenshot/{request_id}").json()
+                    if data["status"] == "completed" and session.get(base_url + data["image_url"]).status_code == 200:
+                        recovered += 1
+                requeued = {request["request_id"] for request in
+                            session.get(f"{base_url}/api/check-requests").json().get("requests", [])}
+        finally:
+            stop_server(server)
+    return {"completed": len(completed), "recovered": recovered,
+            "pending": len(pending), "requeued": len(requeued & set(pending))}
+
+
+def measure_restart(app_dir: str, entries: int) -> dict:
+    rng = random.Random(3)
+    with tempfile.TemporaryDirectory() as workdir:
+        images = []
+        for index in range(20):
+            path = os.path.join(workdir, f"image-{index}.png")
+            with open(path, "wb") as f:
+                f.write(random_png(rng, 640, 360))
+            images.append(path)
+        start = time.perf_counter()
+        # 生成期间不压缩，全部留在日志中供首次启动回放
+        output = subprocess.run([sys.executable, "-c", GENERATE_SCRIPT, app_dir, workdir, str(entries), *images],
+                                env={**os.environ, "JOURNAL_COMPACT_ENTRIES": str(entries * 2)},
+                                capture_output=True, text=True, check=True)
+        written, records = map(int, output.stdout.split())
+        result = {"entries": written, "records": records, "generate": time.perf_counter() - start}
+
+        journal_dir = os.path.join(workdir, "journal")
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        for phase, journal in (("baseline", None), ("replay", journal_dir), ("snapshot", journal_dir)):
+            start = time.perf_counter()
+            server = launch_server(port, workdir, app_dir, journal_env(journal))
+            try:
+                wait_ready(base_url, timeout=120, interval=0.005)
+                result[phase] = time.perf_counter() - start
+                if journal:
+                    # 等待启动后的压缩完成，下一次启动只读取快照
+                    deadline = time.time() + 120
+                    while True:
+                        stats = requests.get(f"{base_url}/api/journal").json()
+                        if stats["compactions"] or not stats["entries"] or time.time() > deadline:
+                            break
+                        time.sleep(0.1)
+                    result[f"{phase}_stats"] = stats
+                    result[f"{phase}_pending"] = sum(room["pending"] for room in
+                                                     requests.get(f"{base_url}/api/rooms").json().values())
+            finally:
+                stop_server(server)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="状态日志的写入开销、崩溃恢复与重启耗时")
+    parser.add_argument("--requests", type=int, default=300, help="写入开销测试的请求数")
+    parser.add_argument("--crash-requests", type=int, default=100, help="崩溃恢复测试的请求数")
+    parser.add_argument("--entries", type=int, default=100000, help="重启测试的日志条数")
+    parser.add_argument("--app-dir", default=ROOT, help="包含 app/server.py 的目录")
+    args = parser.parse_args()
+    app_dir = os.path.abspath(args.app_dir)
+
+    print(f"CPU核心数: {os.cpu_count()}，代码目录 {app_dir}\n")
+    print(f"写入开销（{args.requests} 次请求 + 上传，160x90 随机PNG）:")
+    for journal in (False, True):
+        created, uploaded, stats = measure_overhead(app_dir, args.requests, journal)
+        label = "启用日志" if journal else "不启用  "
+        print(f"  {label} request-screenshot  {describe(created)}")
+        print(f"  {label} upload-screenshot   {describe(uploaded)}")
+        if stats:
+            print(f"  日志写入 {stats['written']} 条，{stats['batches']} 批（每批一次 fsync）")
+
+    recovery = crash_recovery(app_dir, args.crash_requests)
+    print(f"\n崩溃恢复（kill -9）: 已完成 {recovery['recovered']}/{recovery['completed']} 个仍可取到图片，"
+          f"未完成 {recovery['requeued']}/{recovery['pending']} 个重新排队")
+
+    restart = measure_restart(app_dir, args.entries)
+    replay, snapshot = restart["replay_stats"], restart["snapshot_stats"]
+    print(f"\n重启耗时（日志 {restart['entries']} 条，剩余 {restart['records']} 个请求，"
+          f"生成用时 {restart['generate']:.1f} s）:")
+    print(f"  不启用日志:        启动到首个响应 {restart['baseline'] * 1000:7.0f} ms")
+    print(f"  回放日志:          启动到首个响应 {restart['replay'] * 1000:7.0f} ms"
+          f"（回放 {replay['replayed']} 条 {replay['replay_seconds'] * 1000:.0f} ms，"
+          f"恢复 {replay['records']} 个请求，其中 {restart['replay_pending']} 个重新排队；"
+          f"随后后台压缩 {replay['compact_seconds'] * 1000:.0f} ms）")
+    print(f"  读取快照:          启动到首个响应 {restart['snapshot'] * 1000:7.0f} ms"
+          f"（读取 {snapshot['replayed']} 条 {snapshot['replay_seconds'] * 1000:.0f} ms，"
+          f"恢复 {snapshot['records']} 个请求）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# bench_live_stream.py - 实时观看（WebSocket扇出）负载测试
+#
+# 在子进程中启动 uvicorn 服务器，一个推流线程按 LIVE_FPS 推送预先编码好的JPEG帧，
+# 同时用 asyncio 模拟大量订阅 /api/live/ws 的手机，其中一部分是慢速手机
+# （按带宽计算每帧的传输时间，之后才回复确认）。统计：
+#   - 服务器进程CPU占用（/proc/<pid>/stat）和常驻内存
+#   - 正常手机与慢速手机的实际帧率、帧延迟（收到时间 - 服务器发布时间）、被跳过的帧
+#   - 测试结束时各画质档位的订阅人数（慢速手机应被自动降档）
+#
+# 用法: python benchmarks/bench_live_stream.py [--viewers 200] [--slow-ratio 0.1] [--duration 15]
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+import websockets
+
+from _common import free_port, percentile, start_server
+from screenshot_client import SyntheticBackend, encode_live_frame
+
+# 手机显示所需的像素宽度（CSS宽度 x 设备像素比，页面最宽500px）
+VIEWPORTS = [390 * 3, 412 * 2.625, 360 * 2, 500 * 2]
+
+
+def process_usage(pid: int):
+    """返回 (CPU秒数, 常驻内存字节)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+
+def publisher(base_url: str, frames, fps: float, stop: threading.Event):
+    """按目标帧率循环推送预先编码的帧"""
+    index = 0
+    with requests.Session() as session:
+        next_time = time.monotonic()
+        while not stop.is_set():
+            session.post(f"{base_url}/api/live/frame", data=frames[index % len(frames)],
+                         headers={"Content-Type": "image/jpeg"}).raise_for_status()
+            index += 1
+            next_time += 1 / fps
+            stop.wait(max(0.0, next_time - time.monotonic()))
+
+
+async def viewer(port: int, max_width: int, bandwidth, stats: dict, measuring: dict):
+    """一个订阅实时画面的手机；bandwidth 为每秒可接收的字节数，None表示不限速"""
+    async with websockets.connect(f"ws://127.0.0.1:{port}/api/live/ws?max_width={max_width}",
+                                  max_size=None, compression=None) as socket:
+        last_seq = None
+        while True:
+            info = json.loads(await socket.recv())
+            frame = await socket.recv()
+            if bandwidth:
+                # 模拟慢速网络的传输时间
+                await asyncio.sleep(len(frame) / bandwidth)
+            if measuring["on"]:
+                stats["frames"] += 1
+                stats["bytes"] += len(frame)
+                stats["lag"].append(time.time() - info["timestamp"])
+                if last_seq is not None:
+                    stats["skipped"] += info["seq"] - last_seq - 1
+            last_seq = info["seq"]
+            await socket.send("ack")
+
+
+async def run_viewers(args, port: int, base_url: str):
+    rng = random.Random(args.seed)
+    measuring = {"on": False}
+    groups = {"正常": {"frames": 0, "bytes": 0, "skipped": 0, "lag": [], "count": 0},
+              "慢速": {"frames": 0, "bytes": 0, "skipped": 0, "lag": [], "count": 0}}
+    tasks = []
+    for index in range(args.viewers):
+        slow = index < args.viewers * args.slow_ratio
+        group = groups["慢速" if slow else "正常"]
+        group["count"] += 1
+        bandwidth = args.slow_kbps * 1024 / 8 if slow else None
+        tasks.append(asyncio.create_task(viewer(port, int(rng.choice(VIEWPORTS)), bandwidth, group, measuring)))
+        await asyncio.sleep(0.005)
+
+    await asyncio.sleep(args.warmup)
+    stats_before = requests.get(f"{base_url}/api/live/stats").json()
+    measuring["on"] = True
+    return tasks, groups, measuring, stats_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="实时观看负载测试")
+    parser.add_argument("--viewers", type=int, default=200)
+    parser.add_argument("--slow-ratio", type=float, default=0.1, help="慢速手机的比例")
+    parser.add_argument("--slow-kbps", type=float, default=1000, help="慢速手机的带宽 (kbit/s)")
+    parser.add_argument("--fps", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--warmup", type=float, default=5, help="预热时长，慢速手机在此期间完成降档")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    backend = SyntheticBackend(args.width, args.height, change_ratio=0.1, seed=args.seed, grain=0.02)
+    frames = [encode_live_frame(backend.grab(), args.width) for _ in range(20)]
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(port, workdir, ROOT, {"LIVE_FPS": args.fps})
+        stop = threading.Event()
+        pusher = threading.Thread(target=publisher, args=(base_url, frames, args.fps, stop))
+        pusher.start()
+        try:
+            async def scenario():
+                tasks, groups, measuring, stats_before = await run_viewers(args, port, base_url)
+                cpu_start, _ = process_usage(server.pid)
+                await asyncio.sleep(args.duration)
+                cpu_end, rss = process_usage(server.pid)
+                measuring["on"] = False
+                stats_after = requests.get(f"{base_url}/api/live/stats").json()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                return groups, (cpu_end - cpu_start) / args.duration, rss, stats_before, stats_after
+
+            groups, cpu, rss, before, after = asyncio.run(scenario())
+        finally:
+            stop.set()
+            pusher.join()
+            server.terminate()
+            server.wait()
+
+    frame_kb = sum(len(frame) for frame in frames) / len(frames) / 1024
+    print(f"CPU核心数: {os.cpu_count()}，{args.viewers} 个订阅者（慢速 {args.slow_ratio:.0%}，"
+          f"{args.slow_kbps:g} kbit/s），推流 {args.fps:g} 帧/秒，{args.width}x{args.height} 帧平均 {frame_kb:.0f} KB，"
+          f"统计 {args.duration:g}s\n")
+    print(f"服务器CPU占用 {cpu:.0%}（单核），常驻内存 {rss / 1024 / 1024:.0f} MB，"
+          f"发布 {after['published'] - before['published']} 帧，"
+          f"发送 {after['sent'] - before['sent']} 帧，跳过 {after['dropped'] - before['dropped']} 帧")
+    for name, group in groups.items():
+        if not group["count"]:
+            continue
+        fps = group["frames"] / group["count"] / args.duration
+        bitrate = group["bytes"] * 8 / group["count"] / args.duration / 1000
+        print(f"{name}手机 x{group['count']:<4}: 实际 {fps:4.1f} 帧/秒，{bitrate:6.0f} kbit/s，"
+              f"帧延迟 p50 {percentile(group['lag'], 0.5) * 1000:6.0f} ms，p99 {percentile(group['lag'], 0.99) * 1000:6.0f} ms，"
+              f"跳过 {group['skipped']} 帧")
+    print(f"\n各档位订阅人数: {after['tiers']}，降档 {after['downgrades']} 次，升档 {after['upgrades']} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# bench_parallel_encode.py - 大尺寸截图的多核并行PNG编码基准测试
+#
+# 使用合成画面（不需要显示器），对比 PIL 单线程 PNG 编码与
+# screenshot_client.encode_png_parallel 在不同线程数下的耗时和输出大小，
+# 报告相对 PIL 的加速比。线程数默认从 1 递增到本机 CPU 核心数。
+#
+# 用法: python benchmarks/bench_parallel_encode.py [--repeat 3] [--max-workers 8]
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image, ImageChops
+
+import screenshot_client
+from screenshot_client import SyntheticBackend
+
+logging.getLogger().setLevel(logging.WARNING)
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+    "双4K": (7680, 2160),
+}
+
+
+def best_time(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def encode_pil(frame: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    frame.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多核并行PNG编码基准测试")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--grain", type=float, default=0.1, help="合成画面叠加噪点的比例 (0-1)")
+    args = parser.parse_args()
+
+    worker_counts = sorted({1, *[n for n in (2, 4, 8, 16, 32) if n <= args.max_workers], args.max_workers})
+    print(f"CPU核心数: {os.cpu_count()}, 测试线程数: {worker_counts}")
+
+    for name, (width, height) in RESOLUTIONS.items():
+        frame = SyntheticBackend(width, height, seed=7, grain=args.grain).grab()
+        # 基准直接调用 PIL：encode_png_bytes 对大画面会改走 encode_png_parallel
+        pil_bytes = encode_pil(frame)
+        pil_time = best_time(lambda: encode_pil(frame), args.repeat)
+        print(f"\n{name} ({width}x{height}) PIL单线程: {pil_time * 1000:8.1f} ms, {len(pil_bytes) / 1024:8.1f} KB")
+
+        for workers in worker_counts:
+            data = screenshot_client.encode_png_parallel(frame, workers)
+            decoded = Image.open(io.BytesIO(data))
+            assert ImageChops.difference(decoded.convert(frame.mode), frame).getbbox() is None, "并行编码结果与原图不一致"
+            elapsed = best_time(lambda: screenshot_client.encode_png_parallel(frame, workers), args.repeat)
+            print(f"  并行 {workers:2d} 线程: {elapsed * 1000:8.1f} ms, {len(data) / 1024:8.1f} KB, "
+                  f"相对PIL加速 {pil_time / elapsed:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
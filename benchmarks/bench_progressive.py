@@ -0,0 +1,168 @@
+# bench_progressive.py - 限速网络下手机端看到第一帧画面与完整画面的时间
+#
+# 在子进程中启动 uvicorn 服务器，手机端的请求经过本进程内的限速代理（下行带宽 --kbps，
+# 每个请求附加 --rtt-ms 往返延迟），模拟拥挤的展厅Wi-Fi；电脑端直接连接服务器：
+#   - 电脑端领取请求并上传一张合成的截图（完整PNG）
+#   - 手机端按页面的逻辑轮询 get-screenshot，拿到完成结果后按 srcset 为自己的屏幕选择变体并下载
+# 每轮从上传完成后手机端的那次轮询开始计时：
+#   - 首帧: 第一次能显示画面的时间——响应中带有内联预览时即为轮询响应到达，否则为变体下载完成
+#   - 完整: 适合屏幕的变体下载完成的时间
+# 由于没有无头浏览器，这里按页面的请求顺序直接发请求，不包含浏览器的解码和绘制时间。
+# 通过 --app-dir 可以指向另一份代码（例如旧版本的检出目录）做对比。
+#
+# 用法: python benchmarks/bench_progressive.py [--rounds 10] [--kbps 2000] [--rtt-ms 100] [--app-dir 路径]
+import argparse
+import base64
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+
+from _common import free_port, start_server
+from screenshot_client import SyntheticBackend, encode_png_bytes
+
+logging.getLogger().setLevel(logging.WARNING)
+
+# 代理每次转发的最大字节数，限速按这个粒度休眠
+PROXY_SLICE = 4096
+
+
+class ThrottlingProxy:
+    """TCP代理：上行每次发送前等待一个往返延迟，下行按带宽限速"""
+
+    def __init__(self, target_port: int, kbps: float, rtt: float):
+        self.target_port = target_port
+        self.rate = kbps * 1000 / 8  # 字节/秒
+        self.rtt = rtt
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(64)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._pump, args=(client, upstream, False), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client, True), daemon=True).start()
+
+    def _pump(self, source: socket.socket, destination: socket.socket, throttled: bool):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                if not throttled:
+                    time.sleep(self.rtt)
+                    destination.sendall(data)
+                    continue
+                for offset in range(0, len(data), PROXY_SLICE):
+                    piece = data[offset:offset + PROXY_SLICE]
+                    destination.sendall(piece)
+                    time.sleep(len(piece) / self.rate)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, destination):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def pick_srcset(srcset: str, device_width: int) -> str:
+    """按浏览器的规则选择变体：不小于所需像素宽度的最小一个，都不够时选最大的"""
+    candidates = sorted((int(width.rstrip("w")), url) for url, width in
+                        (item.split() for item in srcset.split(", ")))
+    for width, url in candidates:
+        if width >= device_width:
+            return url
+    return candidates[-1][1]
+
+
+def capture(server_url: str, png: bytes):
+    """电脑端：领取手机的请求并上传截图"""
+    requests_list = requests.get(f"{server_url}/api/check-requests").json().get("requests", [])
+    for request in requests_list:
+        requests.post(f"{server_url}/api/upload-screenshot", json={
+            "request_id": request["request_id"], "image_data": base64.b64encode(png).decode()
+        }).raise_for_status()
+
+
+def phone_round(phone_url: str, server_url: str, png: bytes, viewport: int, dpr: float) -> dict:
+    device_width = round(viewport * dpr)
+    with requests.Session() as session:
+        request_id = session.post(f"{phone_url}/api/request-screenshot", json={
+            "user_id": "phone", "viewport_width": viewport, "device_pixel_ratio": dpr}).json()["request_id"]
+        capture(server_url, png)
+        start = time.perf_counter()
+        response = session.get(f"{phone_url}/api/get-screenshot/{request_id}")
+        status_time = time.perf_counter() - start
+        data = response.json()
+        url = pick_srcset(data["srcset"], device_width) if data.get("srcset") else data["image_url"]
+        image = session.get(phone_url + url)
+        full_time = time.perf_counter() - start
+    return {
+        "first_pixel": status_time if data.get("preview") else full_time,
+        "full": full_time,
+        "status_bytes": len(response.content),
+        "preview_bytes": len(data.get("preview") or ""),
+        "image_bytes": len(image.content),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="限速网络下的首帧与完整画面时间")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--kbps", type=float, default=2000, help="手机端下行带宽（kbit/s）")
+    parser.add_argument("--rtt-ms", type=float, default=100, help="每个请求附加的往返延迟（毫秒）")
+    parser.add_argument("--viewport", type=int, default=390, help="手机屏幕宽度（CSS像素）")
+    parser.add_argument("--dpr", type=float, default=3, help="设备像素比")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--app-dir", default=ROOT, help="包含 app/server.py 的目录")
+    args = parser.parse_args()
+
+    port = free_port()
+    server_url = f"http://127.0.0.1:{port}"
+    backend = SyntheticBackend(args.width, args.height, seed=1, grain=0.02)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(port, workdir, os.path.abspath(args.app_dir))
+        try:
+            proxy = ThrottlingProxy(port, args.kbps, args.rtt_ms / 1000)
+            phone_url = f"http://127.0.0.1:{proxy.port}"
+            for _ in range(args.rounds):
+                # 每轮画面都不同，避免命中已生成的变体和预览
+                png = encode_png_bytes(backend.grab(None))
+                results.append(phone_round(phone_url, server_url, png, args.viewport, args.dpr))
+        finally:
+            server.terminate()
+            server.wait()
+
+    def median(name):
+        return statistics.median(result[name] for result in results)
+
+    print(f"CPU核心数: {os.cpu_count()}，{args.rounds} 轮，下行 {args.kbps:g} kbit/s，附加往返延迟 {args.rtt_ms:g} ms，"
+          f"画面 {args.width}x{args.height}，手机 {args.viewport}px x{args.dpr:g}，代码目录 {os.path.abspath(args.app_dir)}\n")
+    print(f"首帧（中位数）:   {median('first_pixel') * 1000:7.0f} ms")
+    print(f"完整画面（中位数）: {median('full') * 1000:7.0f} ms")
+    print(f"轮询响应 {median('status_bytes') / 1024:.1f} KB（其中内联预览 {median('preview_bytes') / 1024:.1f} KB），"
+          f"变体 {median('image_bytes') / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# bench_record_memory.py - 请求/截图记录的内存占用对比
+#
+# 分别在独立子进程中构造 10 万个截图请求和 1000 张截图：
+#   - before: 原始表示，36字符UUID字符串键 + 字典记录，截图保存为 base64 字符串
+#   - after:  app.server 的 RequestRecord/ScreenshotRecord（__slots__、枚举状态），
+#             16字节UUID键，截图保存为原始 bytes
+# 用 tracemalloc 统计每个请求的平均开销，用 RSS 统计整体内存增长；tracemalloc
+# 自身会占用内存，因此两项分别在不同子进程中测量。两种模式都先导入 app.server，使基线一致。
+#
+# 用法: python benchmarks/bench_record_memory.py [--requests 100000] [--images 1000] [--image-kb 200]
+import argparse
+import base64
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def current_rss() -> int:
+    """当前进程的常驻内存（字节）"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def build(mode: str, request_count: int, image_count: int, image_size: int, trace: bool) -> dict:
+    from app import server
+
+    gc.collect()
+    rss_start = current_rss()
+    if trace:
+        tracemalloc.start()
+
+    keys = []
+    if mode == "before":
+        requests_store, screenshots_store = {}, {}
+        for index in range(request_count):
+            key = str(uuid.uuid4())
+            requests_store[key] = {
+                "user_id": f"art_viewer_{index}",
+                "timestamp": time.time(),
+                "status": "pending",
+                "viewport_width": 390,
+                "device_pixel_ratio": 3.0,
+                "full_resolution_of": None
+            }
+            keys.append(key)
+    else:
+        requests_store, screenshots_store = server.screenshot_requests, server.screenshots
+        for index in range(request_count):
+            key = uuid.uuid4().bytes
+            requests_store[key] = server.RequestRecord(
+                user_id=f"art_viewer_{index}",
+                timestamp=time.time(),
+                viewport_width=390,
+                device_pixel_ratio=3.0
+            )
+            keys.append(key)
+
+    if trace:
+        # keys 列表本身不属于存储开销
+        request_bytes = tracemalloc.get_traced_memory()[0] - sys.getsizeof(keys)
+        tracemalloc.stop()
+        return {"per_request": request_bytes / request_count}
+    gc.collect()
+    rss_requests = current_rss()
+
+    for key in keys[:image_count]:
+        raw = os.urandom(image_size)
+        if mode == "before":
+            screenshots_store[key] = {"image_data": base64.b64encode(raw).decode(), "timestamp": time.time()}
+        else:
+            screenshots_store[key] = server.ScreenshotRecord(timestamp=time.time(), digest=server.retain_blob(raw))
+        del raw
+    gc.collect()
+    rss_end = current_rss()
+
+    return {
+        "rss_requests": rss_requests - rss_start,
+        "rss_images": rss_end - rss_requests,
+        "rss_total": rss_end - rss_start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="请求/截图记录内存占用对比")
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--images", type=int, default=1000)
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--mode", choices=("before", "after"), help=argparse.SUPPRESS)
+    parser.add_argument("--trace", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(build(args.mode, args.requests, args.images, args.image_kb * 1024, args.trace)))
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        # app.server 导入时会在当前目录创建 static/ 和 uploads/
+        for mode in ("before", "after"):
+            results[mode] = {}
+            for trace in (True, False):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--mode", mode, "--requests", str(args.requests),
+                     "--images", str(args.images), "--image-kb", str(args.image_kb)] + (["--trace"] if trace else []),
+                    cwd=workdir, capture_output=True, text=True, check=True
+                ).stdout
+                results[mode].update(json.loads(output.strip().splitlines()[-1]))
+
+    mb = 1024 * 1024
+    print(f"{args.requests} 个请求，{args.images} 张 {args.image_kb} KB 截图\n")
+    for mode, result in results.items():
+        print(f"{mode:>6}: 每个请求 {result['per_request']:6.0f} B，请求 RSS {result['rss_requests'] / mb:6.1f} MB，"
+              f"截图 RSS {result['rss_images'] / mb:6.1f} MB，合计 {result['rss_total'] / mb:6.1f} MB")
+    before, after = results["before"], results["after"]
+    print(f"\n每个请求开销减少 {1 - after['per_request'] / before['per_request']:.0%}，"
+          f"截图内存减少 {1 - after['rss_images'] / before['rss_images']:.0%}，"
+          f"合计减少 {1 - after['rss_total'] / before['rss_total']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
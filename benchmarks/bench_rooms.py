@@ -0,0 +1,168 @@
+# bench_rooms.py - 多房间（展项）部署的隔离性与轮询开销
+#
+# 在子进程中启动 uvicorn 服务器，模拟一台服务器服务多个展项：
+#   - 每个房间一个电脑端（ScreenshotClient，合成画面、增量上传，绑定到该房间），各自一个线程轮询
+#   - 每个房间若干手机并发地发起截图请求并轮询结果
+# 统计：
+#   - 串房间: 电脑端领到其他房间的请求、手机用自己的房间查不到自己的请求、
+#     用其他房间的名义能查到别人的请求（应为404）
+#   - 增量上传的基准帧冲突（409，电脑端回退为完整上传）次数
+#   - 手机端从请求到拿到截图的延迟
+#   - 另一个房间积压大量无人处理的请求时，空房间 check-requests 的延迟（应与积压量无关）
+# 通过 --app-dir 可以指向另一份代码（例如旧版本的检出目录）做对比。
+#
+# 用法: python benchmarks/bench_rooms.py [--rooms 50] [--phones 2] [--rounds 3] [--backlog 20000] [--app-dir 路径]
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+
+from _common import free_port, percentile, start_server
+from screenshot_client import ScreenshotClient, SyntheticBackend
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class CountingClient(ScreenshotClient):
+    """记录领到的请求和基准帧冲突次数"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.handled = []
+        self.mismatches = 0
+
+    def upload_delta(self, payload):
+        result = super().upload_delta(payload)
+        if result is None:
+            self.mismatches += 1
+        return result
+
+
+def capture_loop(client: CountingClient, room: str, poll_interval: float, stop: threading.Event):
+    """一个房间的电脑端：轮询本房间的请求并上传截图"""
+    while not stop.is_set():
+        for request in client.check_requests():
+            client.handled.append((request["request_id"], room))
+            client.process_screenshot_request(request)
+        stop.wait(poll_interval)
+
+
+def phone(base_url: str, room: str, other_room: str, rounds: int, results: dict):
+    """一个手机：发起截图请求并轮询结果，顺便用其他房间的名义查询自己的请求"""
+    with requests.Session() as session:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            request_id = session.post(f"{base_url}/api/request-screenshot", json={
+                "user_id": f"phone-{room}", "viewport_width": 390, "device_pixel_ratio": 2, "room": room
+            }).json()["request_id"]
+            results["created"].append((request_id, room))
+            deadline = time.time() + 30
+            while time.time() < deadline:
+                response = session.get(f"{base_url}/api/get-screenshot/{request_id}", params={"room": room})
+                if response.status_code == 404:
+                    results["lost"] += 1
+                    break
+                if response.json()["status"] == "completed":
+                    results["latency"].append(time.perf_counter() - start)
+                    if session.get(f"{base_url}/api/get-screenshot/{request_id}",
+                                   params={"room": other_room}).status_code != 404:
+                        results["foreign_reads"] += 1
+                    break
+                time.sleep(0.2)
+            else:
+                results["timeouts"] += 1
+
+
+def probe_check_requests(base_url: str, room: str, count: int) -> list:
+    """测量空房间 check-requests 的延迟"""
+    latencies = []
+    with requests.Session() as session:
+        for _ in range(count):
+            start = time.perf_counter()
+            session.get(f"{base_url}/api/check-requests", params={"room": room}).raise_for_status()
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多房间隔离性与轮询开销")
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--phones", type=int, default=2, help="每个房间的手机数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个手机发起的截图次数")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="电脑端轮询间隔（秒）")
+    parser.add_argument("--backlog", type=int, default=20000, help="积压房间中无人处理的请求数")
+    parser.add_argument("--width", type=int, default=480)
+    parser.add_argument("--height", type=int, default=270)
+    parser.add_argument("--app-dir", default=ROOT, help="包含 app/server.py 的目录")
+    args = parser.parse_args()
+
+    names = [f"exhibit-{index:02d}" for index in range(args.rooms)]
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    results = {"created": [], "latency": [], "lost": 0, "timeouts": 0, "foreign_reads": 0}
+    with tempfile.TemporaryDirectory() as workdir:
+        # 积压房间没有电脑端，放宽离线判定以免积压请求被503拒绝
+        server = start_server(port, workdir, os.path.abspath(args.app_dir), {"DEVICE_TIMEOUT": 3600})
+        stop = threading.Event()
+        clients = [CountingClient(base_url, capture_backend=SyntheticBackend(args.width, args.height, seed=index),
+                                  room=name) for index, name in enumerate(names)]
+        capture_threads = [threading.Thread(target=capture_loop, args=(client, name, args.poll_interval, stop))
+                           for client, name in zip(clients, names)]
+        try:
+            # 房间由电脑端首次轮询创建，手机端开始前先让每个房间完成一次轮询
+            with requests.Session() as session:
+                for name in names + ["backlog"]:
+                    session.get(f"{base_url}/api/check-requests", params={"room": name}).raise_for_status()
+            for thread in capture_threads:
+                thread.start()
+            start = time.perf_counter()
+            phones = [threading.Thread(target=phone, args=(base_url, name, names[(index + 1) % len(names)],
+                                                           args.rounds, results))
+                      for index, name in enumerate(names) for _ in range(args.phones)]
+            for thread in phones:
+                thread.start()
+            for thread in phones:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            stop.set()
+            for thread in capture_threads:
+                thread.join()
+
+            # 积压对其他房间轮询的影响
+            idle = probe_check_requests(base_url, "idle", 200)
+            with requests.Session() as session:
+                for _ in range(args.backlog):
+                    session.post(f"{base_url}/api/request-screenshot", json={"user_id": "backlog", "room": "backlog"})
+            loaded = probe_check_requests(base_url, "idle", 200)
+        finally:
+            stop.set()
+            server.terminate()
+            server.wait()
+
+    created = dict(results["created"])
+    handled = [(request_id, room) for client in clients for request_id, room in client.handled]
+    foreign = sum(1 for request_id, room in handled if created.get(request_id, room) != room)
+    print(f"CPU核心数: {os.cpu_count()}，{args.rooms} 个房间，每个房间 1 个电脑端 + {args.phones} 个手机"
+          f"（各 {args.rounds} 次截图），画面 {args.width}x{args.height}，代码目录 {os.path.abspath(args.app_dir)}\n")
+    print(f"完成 {len(results['latency'])}/{len(created)} 次截图，耗时 {elapsed:.1f} s，"
+          f"手机端延迟 p50 {percentile(results['latency'], 0.5) * 1000:.0f} ms，"
+          f"p99 {percentile(results['latency'], 0.99) * 1000:.0f} ms，超时 {results['timeouts']} 次")
+    print(f"串房间: 电脑端领到其他房间的请求 {foreign} 次，手机查不到自己的请求 {results['lost']} 次，"
+          f"以其他房间名义读到结果 {results['foreign_reads']} 次")
+    print(f"增量上传基准帧冲突（回退完整上传）: {sum(client.mismatches for client in clients)} 次")
+    print(f"空房间 check-requests 延迟: 无积压 p50 {percentile(idle, 0.5) * 1000:.2f} ms / "
+          f"p99 {percentile(idle, 0.99) * 1000:.2f} ms，"
+          f"另一房间积压 {args.backlog} 个请求时 p50 {percentile(loaded, 0.5) * 1000:.2f} ms / "
+          f"p99 {percentile(loaded, 0.99) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
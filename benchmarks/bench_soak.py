@@ -0,0 +1,230 @@
+# bench_soak.py - 长时间运行的内存浸泡测试与泄漏检测
+#
+# 以 CLOCK_SPEED 加速服务器时间，在几分钟内重放数小时的展厅流量，使请求过期
+# （REQUEST_TTL）和定时清理（CLEANUP_INTERVAL）按真实节奏反复发生：
+#   - 服务器（app.server）在本进程的线程中运行，工作目录为临时目录
+#   - 一个电脑端（ScreenshotClient，合成画面、增量上传）运行真实的 run() 主循环
+#   - 手机按泊松过程到达，发起截图请求、轮询结果并下载 srcset 中的图片
+# 每隔一段虚拟时间用 tracemalloc 拍摄快照（之前先 gc），记录相对流量开始前的内存增长、
+# 内存存储中的请求/截图/图片数量和RSS。流量结束后再等待请求全部过期并被清理，
+# 此时存储应为空，剩余的内存增长即为疑似泄漏。报告列出增长最多的分配位置。
+#
+# 失败条件（退出码1）: 任一快照的内存增长超过 --budget-mb，或排空后存储中仍有残留。
+#
+# 用法: python benchmarks/bench_soak.py [--hours 6] [--speed 60] [--visitors-per-hour 120] [--budget-mb 64]
+import argparse
+import gc
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+
+from _common import free_port, serve_in_thread
+from screenshot_client import ScreenshotClient, SyntheticBackend
+
+logging.getLogger().setLevel(logging.WARNING)
+
+# 不计入统计的分配：tracemalloc 自身和模块导入
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def current_rss() -> int:
+    """当前进程的常驻内存（字节）"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def take_snapshot(server):
+    """gc 后拍摄快照，返回 (快照, 存储状态)"""
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+    store = {
+        "requests": len(server.screenshot_requests),
+        "screenshots": len(server.screenshots),
+        "blobs": len(server.image_blobs),
+        "blob_bytes": sum(blob.size for blob in server.image_blobs.values() if blob.data is not None),
+        "uploads": len(server.chunked_uploads),
+        "pending": sum(len(room.pending) for room in server.rooms.values()),
+    }
+    return snapshot, store
+
+
+def traced_bytes(snapshot) -> int:
+    return sum(stat.size for stat in snapshot.statistics("filename"))
+
+
+def short_location(frame) -> str:
+    """分配位置的简短形式：本仓库内的相对路径，或 site-packages 之后的部分"""
+    path = frame.filename
+    root = os.path.abspath(ROOT)
+    if path.startswith(root):
+        path = os.path.relpath(path, root)
+    elif "site-packages" in path:
+        path = path.split("site-packages" + os.sep, 1)[1]
+    return f"{path}:{frame.lineno}"
+
+
+def print_top_sites(snapshot, baseline, limit: int):
+    for stat in snapshot.compare_to(baseline, "lineno")[:limit]:
+        print(f"    {stat.size_diff / 1024:+10.1f} KB  {stat.count_diff:+7d} 个  {short_location(stat.traceback[0])}")
+
+
+def visit(base_url: str, user_id: str, stats: dict, lock: threading.Lock):
+    """一个手机：截图一次并下载适合屏幕的图片"""
+    try:
+        with requests.Session() as session:
+            request_id = session.post(f"{base_url}/api/request-screenshot", json={
+                "user_id": user_id, "viewport_width": 390, "device_pixel_ratio": 3
+            }, timeout=30).json()["request_id"]
+            deadline = time.time() + 30
+            while time.time() < deadline:
+                data = session.get(f"{base_url}/api/get-screenshot/{request_id}", timeout=30).json()
+                if data["status"] == "completed":
+                    url = data["srcset"].split(", ")[-1].split()[0] if data.get("srcset") else data["image_url"]
+                    session.get(base_url + url, timeout=30).raise_for_status()
+                    result = "completed"
+                    break
+                time.sleep(0.25)
+            else:
+                result = "timeouts"
+    except requests.RequestException:
+        result = "failed"
+    with lock:
+        stats[result] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="内存浸泡测试与泄漏检测")
+    parser.add_argument("--hours", type=float, default=6, help="重放的虚拟时长（小时）")
+    parser.add_argument("--speed", type=float, default=60, help="时间加速倍数（CLOCK_SPEED）")
+    parser.add_argument("--visitors-per-hour", type=float, default=120, help="每虚拟小时到达的手机数")
+    parser.add_argument("--snapshot-minutes", type=float, default=30, help="快照间隔（虚拟分钟）")
+    parser.add_argument("--budget-mb", type=float, default=64, help="内存存储允许的最大增长（MB）")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--top", type=int, default=10, help="报告中列出的分配位置数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as workdir:
+        # app.server 导入时会在当前目录创建 static/ 和 uploads/
+        os.chdir(workdir)
+        os.environ["CLOCK_SPEED"] = str(args.speed)
+        from app import server
+
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        uvicorn_server = serve_in_thread(server.app, port)
+        client = ScreenshotClient(base_url, capture_backend=SyntheticBackend(args.width, args.height, seed=args.seed))
+        threading.Thread(target=client.run, args=(0.2,), daemon=True).start()
+        phones = ThreadPoolExecutor(max_workers=32)
+        stats = {"completed": 0, "failed": 0, "timeouts": 0}
+        lock = threading.Lock()
+        rng = random.Random(args.seed)
+        try:
+            time.sleep(1)
+            baseline, _ = take_snapshot(server)
+            baseline_rss = current_rss()
+            start_clock = server.clock()
+            # 请求过期并经历一次清理后存储才进入稳定状态
+            warmup = server.REQUEST_TTL + server.CLEANUP_INTERVAL
+            print(f"CPU核心数: {os.cpu_count()}，时间加速 {args.speed:g} 倍，虚拟 {args.hours:g} 小时"
+                  f"（实际约 {args.hours * 3600 / args.speed:.0f} s），每小时 {args.visitors_per_hour:g} 个手机，"
+                  f"画面 {args.width}x{args.height}，预算 {args.budget_mb:g} MB\n")
+            print(f"  {'虚拟时间':>8} {'手机':>6} {'请求':>5} {'截图':>5} {'图片':>5} {'图片字节':>9} "
+                  f"{'内存增长':>9} {'RSS增长':>9}")
+
+            # 到达时间按虚拟时间预先生成，拍摄快照期间错过的手机随后补发
+            end = start_clock + args.hours * 3600
+            arrivals = deque()
+            arrival = start_clock + rng.expovariate(args.visitors_per_hour / 3600)
+            while arrival < end:
+                arrivals.append(arrival)
+                arrival += rng.expovariate(args.visitors_per_hour / 3600)
+            samples = []
+            peak_snapshot = None
+            next_snapshot = start_clock + args.snapshot_minutes * 60
+            visitors = 0
+            while server.clock() < end:
+                while arrivals and arrivals[0] <= server.clock():
+                    arrivals.popleft()
+                    phones.submit(visit, base_url, f"soak_{visitors}", stats, lock)
+                    visitors += 1
+                if server.clock() >= next_snapshot:
+                    snapshot, store = take_snapshot(server)
+                    elapsed = server.clock() - start_clock
+                    growth = traced_bytes(snapshot) - traced_bytes(baseline)
+                    # 只保留增长最大的快照用于报告
+                    if peak_snapshot is None or growth > max(sample["growth"] for sample in samples):
+                        peak_snapshot = snapshot
+                    del snapshot
+                    samples.append({"elapsed": elapsed, "growth": growth, "store": store,
+                                    "rss": current_rss() - baseline_rss})
+                    print(f"  {elapsed / 3600:7.2f}h {visitors:6d} {store['requests']:5d} {store['screenshots']:5d} "
+                          f"{store['blobs']:5d} {store['blob_bytes'] / 1024 / 1024:7.1f}MB "
+                          f"{growth / 1024 / 1024:7.1f}MB {samples[-1]['rss'] / 1024 / 1024:7.1f}MB")
+                    next_snapshot += args.snapshot_minutes * 60
+                time.sleep(0.02)
+
+            phones.shutdown(wait=True)
+            # 排空: 等待所有请求过期并被清理
+            drain_until = server.clock() + server.REQUEST_TTL + 2 * server.CLEANUP_INTERVAL
+            while server.clock() < drain_until:
+                time.sleep(0.5)
+            client.stop()
+            time.sleep(1)
+            drained, store = take_snapshot(server)
+            residual = traced_bytes(drained) - traced_bytes(baseline)
+        finally:
+            client.stop()
+            phones.shutdown(wait=False, cancel_futures=True)
+            uvicorn_server.should_exit = True
+
+    steady = [sample for sample in samples if sample["elapsed"] >= warmup]
+    peak = max(samples, key=lambda sample: sample["growth"]) if samples else None
+    print(f"\n手机 {visitors} 个: 完成 {stats['completed']}，失败 {stats['failed']}，超时 {stats['timeouts']}")
+    if len(steady) >= 2:
+        hours = (steady[-1]["elapsed"] - steady[0]["elapsed"]) / 3600
+        slope = (steady[-1]["growth"] - steady[0]["growth"]) / hours if hours else 0.0
+        print(f"稳定阶段（{warmup / 3600:.2f}h 之后）内存增长变化 {slope / 1024 / 1024:+.2f} MB/虚拟小时")
+    if peak:
+        print(f"内存增长峰值 {peak['growth'] / 1024 / 1024:.1f} MB（{peak['elapsed'] / 3600:.2f}h），"
+              f"预算 {args.budget_mb:g} MB")
+        print("  增长最多的分配位置（峰值快照 对比 流量开始前）:")
+        print_top_sites(peak_snapshot, baseline, args.top)
+    print(f"\n排空后: 请求 {store['requests']}，截图 {store['screenshots']}，图片 {store['blobs']}，"
+          f"分块上传 {store['uploads']}，待处理队列 {store['pending']}，剩余内存增长 {residual / 1024 / 1024:.2f} MB")
+    print("  剩余增长最多的分配位置（排空后 对比 流量开始前）:")
+    print_top_sites(drained, baseline, args.top)
+
+    failures = []
+    if peak and peak["growth"] > args.budget_mb * 1024 * 1024:
+        failures.append(f"内存增长 {peak['growth'] / 1024 / 1024:.1f} MB 超过预算 {args.budget_mb:g} MB")
+    leftovers = {name: count for name, count in store.items() if name != "blob_bytes" and count}
+    if leftovers:
+        failures.append(f"排空后存储中仍有残留: {leftovers}")
+    if failures:
+        print("\n失败: " + "；".join(failures))
+        sys.exit(1)
+    print("\n通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# bench_startup.py - 服务器模块导入与启动耗时
+#
+# 每次测量都在新的子进程中进行（临时工作目录，不设置 SERVER_URL，由服务器自行确定二维码地址）：
+#   - 导入:   import app.server 的耗时
+#   - 地址:   导入后确定二维码中服务器地址的耗时（旧版本在导入时完成，此项为0）
+#   - 启动:   启动 uvicorn 到第一个接口响应的耗时
+#   - 首页:   启动后第一次打开首页（确定地址并生成二维码）的耗时
+# 另外用 -X importtime 列出 app.server 直接导入的模块中累计耗时最多的几个。
+# --offline 时在新的网络命名空间中（unshare -n，需要root）测量导入和地址，其中只有一个局域网接口
+# （veth，192.168.50.10/24）而没有默认路由，模拟不连外网的展厅局域网。
+# --app-dir 可指向另一份代码（例如旧版本的检出目录）做对比。
+#
+# 用法: python benchmarks/bench_startup.py [--runs 5] [--offline] [--app-dir 路径]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+import requests
+
+from _common import free_port
+
+IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+from app import server
+imported = time.perf_counter()
+url = server.get_server_url() if hasattr(server, "get_server_url") else server.SERVER_URL
+print(json.dumps({"import": imported - start, "address": time.perf_counter() - imported, "server_url": url}))
+"""
+
+# 断网局域网：一对veth，一端配置局域网地址，不设默认路由
+OFFLINE_LAN = ("ip link add lan0 type veth peer name lan1 && ip addr add 192.168.50.10/24 dev lan0 "
+               "&& ip link set lan0 up && ip link set lan1 up")
+
+
+def server_env() -> dict:
+    env = {key: value for key, value in os.environ.items() if key != "SERVER_URL"}
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def measure_import(app_dir: str, offline: bool) -> dict:
+    command = [sys.executable, "-c", IMPORT_SCRIPT, app_dir]
+    if offline:
+        command = ["unshare", "-n", "sh", "-c", f'{OFFLINE_LAN} && exec "$@"', "sh"] + command
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(command, cwd=workdir, env=server_env(), capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def measure_server(app_dir: str) -> dict:
+    """启动 uvicorn，返回到第一个接口响应和第一次打开首页的耗时"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.server:app", "--app-dir", app_dir,
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=workdir, env=server_env(),
+        )
+        try:
+            deadline = time.time() + 30
+            while True:
+                try:
+                    requests.get(f"{base_url}/api/dedup-stats", timeout=1).raise_for_status()
+                    break
+                except requests.RequestException:
+                    if time.time() > deadline:
+                        raise RuntimeError("服务器启动失败")
+                    time.sleep(0.01)
+            ready = time.perf_counter()
+            requests.get(f"{base_url}/", timeout=30).raise_for_status()
+            return {"startup": ready - start, "first_page": time.perf_counter() - ready}
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def import_profile(app_dir: str, limit: int) -> list:
+    """-X importtime 的输出中 app.server 及其直接导入的模块，按累计耗时排序 [(微秒, 模块名)]"""
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {app_dir!r}); import app.server"],
+            cwd=workdir, env=server_env(), capture_output=True, text=True, check=True)
+    # 子模块的行在其导入者之前输出，遇到顶层的 app.server 时，之前收集的第一层即是它的直接导入
+    children = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((int(cumulative), name.strip()))
+        elif depth == 0:
+            if name.strip() == "app.server":
+                return sorted(children + [(int(cumulative), "app.server")], reverse=True)[:limit]
+            children = []
+    return []
+
+
+def describe(values) -> str:
+    return f"中位数 {statistics.median(values) * 1000:7.1f} ms，最小 {min(values) * 1000:7.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务器模块导入与启动耗时")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--offline", action="store_true", help="在没有默认路由的局域网命名空间中测量导入和地址")
+    parser.add_argument("--top", type=int, default=10, help="列出的导入耗时最多的模块数")
+    parser.add_argument("--app-dir", default=ROOT, help="包含 app/server.py 的目录")
+    args = parser.parse_args()
+    app_dir = os.path.abspath(args.app_dir)
+
+    imports = [measure_import(app_dir, args.offline) for _ in range(args.runs)]
+    servers = [measure_server(app_dir) for _ in range(args.runs)]
+    print(f"CPU核心数: {os.cpu_count()}，{args.runs} 次，代码目录 {app_dir}"
+          f"{'，断网局域网（unshare -n，无默认路由）' if args.offline else ''}\n")
+    print(f"导入 app.server:  {describe([result['import'] for result in imports])}")
+    print(f"确定服务器地址:   {describe([result['address'] for result in imports])}"
+          f"（{imports[-1]['server_url']}）")
+    print(f"启动到首个响应:   {describe([result['startup'] for result in servers])}")
+    print(f"首次打开首页:     {describe([result['first_page'] for result in servers])}")
+    print("\n累计导入耗时最多的模块（app.server 及其直接导入）:")
+    for cumulative, name in import_profile(app_dir, args.top):
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
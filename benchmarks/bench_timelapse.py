@@ -0,0 +1,157 @@
+# bench_timelapse.py - 延时摄影环形缓冲区与流式导出
+#
+# 在后台线程中启动本地 uvicorn 服务器（app.server，工作目录为临时目录）：
+#   1. 端到端: 开启延时摄影后由 ScreenshotClient（合成画面、增量上传）按普通请求处理
+#      服务器安排的截图，确认帧按间隔写入环形缓冲区，且请求和截图不会在内存中累积。
+#   2. 长时间录制: 直接向环形缓冲区写入大量帧（容量远小于帧数），每隔一段统计 RSS
+#      和磁盘占用，二者都应在缓冲区写满后保持不变。
+#   3. 流式导出: 导出动画WebP和ZIP，边接收边写入临时文件，统计导出期间的RSS增长
+#      并校验输出（WebP帧数、ZIP条目数）。
+#
+# 用法: python benchmarks/bench_timelapse.py [--frames 4000] [--capacity 500] [--interval 1]
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+from PIL import Image
+
+from _common import free_port, serve_in_thread
+from screenshot_client import ScreenshotClient, SyntheticBackend
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def current_rss() -> int:
+    """当前进程的常驻内存（字节）"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def end_to_end(server, http, base_url: str, interval: float, duration: float, width: int, height: int):
+    """电脑端按普通请求处理延时摄影请求，返回延时摄影状态"""
+    client = ScreenshotClient(base_url, capture_backend=SyntheticBackend(width, height, seed=2))
+    headers = {"Authorization": f"Bearer {server.TIMELAPSE_TOKEN}"}
+    http.post(f"{base_url}/api/timelapse/start", json={"interval": interval, "clear": True},
+              headers=headers).raise_for_status()
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        for request in client.check_requests():
+            client.process_screenshot_request(request)
+        time.sleep(0.1)
+    http.post(f"{base_url}/api/timelapse/stop", headers=headers).raise_for_status()
+    time.sleep(server.TIMELAPSE_TICK * 3)  # 等待最后一帧被收集
+    return http.get(f"{base_url}/api/timelapse").json(), len(server.screenshot_requests), len(server.screenshots)
+
+
+def long_recording(server, total: int, width: int, height: int, checkpoints: int):
+    """直接写入大量帧，返回 [(已写入帧数, RSS, 缓冲区帧数, 磁盘字节数)]"""
+    backend = SyntheticBackend(width, height, change_ratio=0.05, seed=3)
+    samples = []
+
+    async def record():
+        for index in range(1, total + 1):
+            await server.append_timelapse_frame(backend.grab(), time.time())
+            if index % (total // checkpoints) == 0:
+                gc.collect()
+                disk = sum(entry.stat().st_size for entry in os.scandir(server.TIMELAPSE_DIR))
+                samples.append((index, current_rss(), len(server.timelapse_frames), disk))
+
+    asyncio.run(record())
+    return samples
+
+
+def export(http, base_url: str, export_format: str, path: str):
+    """流式下载导出文件，返回 (字节数, 耗时, 导出期间RSS峰值增长)"""
+    gc.collect()
+    baseline = current_rss()
+    peak = [baseline]
+    done = threading.Event()
+
+    def monitor():
+        while not done.wait(0.01):
+            peak[0] = max(peak[0], current_rss())
+
+    sampler = threading.Thread(target=monitor)
+    sampler.start()
+    start = time.perf_counter()
+    size = 0
+    with http.get(f"{base_url}/api/timelapse/export?format={export_format}&fps=24", stream=True) as response, \
+            open(path, "wb") as f:
+        response.raise_for_status()
+        for chunk in response.iter_content(64 * 1024):
+            f.write(chunk)
+            size += len(chunk)
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    return size, elapsed, peak[0] - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="延时摄影环形缓冲区与流式导出")
+    parser.add_argument("--frames", type=int, default=4000, help="长时间录制阶段写入的帧数")
+    parser.add_argument("--capacity", type=int, default=500, help="环形缓冲区容量（帧）")
+    parser.add_argument("--interval", type=float, default=1, help="端到端阶段的拍摄间隔（秒）")
+    parser.add_argument("--duration", type=float, default=10, help="端到端阶段的时长（秒）")
+    parser.add_argument("--width", type=int, default=1280, help="端到端阶段的画面宽度")
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--record-width", type=int, default=640, help="长时间录制阶段的画面宽度")
+    parser.add_argument("--record-height", type=int, default=360)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # app.server 导入时会在当前目录创建 static/、uploads/ 和 static/timelapse/
+        os.chdir(workdir)
+        os.environ["TIMELAPSE_CAPACITY"] = str(args.capacity)
+        os.environ["TIMELAPSE_TOKEN"] = "bench"
+        from app import server
+
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        uvicorn_server = serve_in_thread(server.app, port)
+        try:
+            http = requests.Session()
+            status, request_count, screenshot_count = end_to_end(
+                server, http, base_url, args.interval, args.duration, args.width, args.height)
+            expected = int(args.duration / args.interval)
+            print(f"端到端: 间隔 {args.interval:g}s 录制 {args.duration:g}s，写入 {status['recorded']} 帧"
+                  f"（理论约 {expected}），放弃 {status['missed']} 帧，"
+                  f"残留请求 {request_count} 个 / 截图 {screenshot_count} 个\n")
+
+            samples = long_recording(server, args.frames, args.record_width, args.record_height, checkpoints=8)
+            print(f"长时间录制: 容量 {args.capacity} 帧，{args.record_width}x{args.record_height}")
+            for written, rss, buffered, disk in samples:
+                print(f"  已写入 {written:5d} 帧: 缓冲区 {buffered:4d} 帧，磁盘 {disk / 1024 / 1024:6.1f} MB，"
+                      f"RSS {rss / 1024 / 1024:6.1f} MB")
+
+            print("\n流式导出:")
+            for export_format in ("webp", "zip"):
+                path = os.path.join(workdir, f"export.{export_format}")
+                size, elapsed, rss_growth = export(http, base_url, export_format, path)
+                if export_format == "webp":
+                    with Image.open(path) as image:
+                        check = f"动画帧数 {image.n_frames}"
+                        image.seek(image.n_frames - 1)
+                        image.load()
+                else:
+                    with zipfile.ZipFile(path) as archive:
+                        check = f"条目 {len(archive.namelist())} 个（含清单），CRC {'正确' if archive.testzip() is None else '错误'}"
+                print(f"  {export_format:<4}: {size / 1024 / 1024:6.1f} MB，耗时 {elapsed:5.2f} s，"
+                      f"导出期间RSS增长 {rss_growth / 1024 / 1024:5.1f} MB，{check}")
+        finally:
+            uvicorn_server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# bench_upload_spool.py - 上传失败暂存重试的故障注入测试
+#
+# 在后台线程中启动本地 uvicorn 服务器（app.server），外面包一层故障注入，电脑端经过本进程内的
+# TCP代理连接服务器。中断窗口内按 --faults 注入以下故障之一，窗口外上传按 --fail-rate 随机返回 503：
+#   - 503:     整个窗口内上传接口返回 503
+#   - refused: 窗口前半段上传返回 503（截图进入暂存），后半段代理关闭监听并断开所有连接，
+#              暂存重试和轮询都遇到连接被拒绝
+#   - timeout: 同上，但后半段代理不再转发数据，请求在客户端超时（--client-timeout）后失败
+# 手机端的截图请求直接发给服务器。按固定速率创建截图请求，由 ScreenshotClient.run() 处理，分别在
+#   - 不启用暂存（上传失败即丢弃，原始行为）
+#   - 启用暂存（UploadSpool，后台线程在租约内重试）
+# 两种模式下统计：租约内送达的比例、送达延迟、暂存重试延迟、被放弃的暂存条目以及暂存队列峰值大小。
+# 网络故障下的重试应计为重试而不是放弃（rejected 应为0）。
+#
+# 用法: python benchmarks/bench_upload_spool.py [--duration 20] [--outage 4,12] [--lease 15] [--faults 503,refused,timeout]
+import argparse
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import requests
+
+from _common import free_port, percentile, serve_in_thread
+from screenshot_client import ScreenshotClient, SyntheticBackend, UploadSpool
+
+logging.getLogger().setLevel(logging.WARNING)
+
+UPLOAD_PATHS = ("/api/upload-screenshot", "/api/upload-screenshot-delta")
+FAULTS = ("503", "refused", "timeout")
+
+
+class FailureInjector:
+    """ASGI 包装层：按时间窗口或概率让上传接口返回 503"""
+
+    def __init__(self, app, outage, fail_rate: float, seed: int):
+        self.app = app
+        self.outage = outage
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.started_at = time.time()
+        self.injected = 0
+
+    def reset(self, outage):
+        self.outage = outage
+        self.started_at = time.time()
+        self.injected = 0
+
+    def should_fail(self) -> bool:
+        elapsed = time.time() - self.started_at
+        return self.outage[0] <= elapsed < self.outage[1] or self.rng.random() < self.fail_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in UPLOAD_PATHS and self.should_fail():
+            # 读完请求体再返回，保持长连接可复用
+            message = await receive()
+            while message.get("more_body"):
+                message = await receive()
+            self.injected += 1
+            await send({"type": "http.response.start", "status": 503,
+                        "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b"injected failure"})
+            return
+        await self.app(scope, receive, send)
+
+
+class FaultProxy:
+    """
+    电脑端与服务器之间的TCP代理，在时间窗口内注入网络故障
+
+    refused: 关闭监听端口并断开已有连接，新连接被拒绝；timeout: 接受连接但不再转发数据。
+    """
+
+    def __init__(self, target_port: int):
+        self.target_port = target_port
+        self.port = free_port()
+        self.fault = None
+        self.window = (0.0, 0.0)
+        self.started_at = time.time()
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.listener = None
+        self.listen()
+        threading.Thread(target=self._control, daemon=True).start()
+
+    def reset(self, fault, window):
+        self.fault = fault
+        self.window = window
+        self.started_at = time.time()
+
+    def active(self) -> bool:
+        elapsed = time.time() - self.started_at
+        return self.fault is not None and self.window[0] <= elapsed < self.window[1]
+
+    def listen(self):
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", self.port))
+        listener.listen(64)
+        self.listener = listener
+        threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+
+    def _control(self):
+        """refused 故障开始时关闭监听和所有连接，结束时重新监听"""
+        while True:
+            time.sleep(0.02)
+            refusing = self.fault == "refused" and self.active()
+            if refusing and self.listener is not None:
+                self.listener.close()
+                self.listener = None
+                with self.lock:
+                    connections, self.connections = self.connections, set()
+                for sock in connections:
+                    self._close(sock)
+            elif not refusing and self.listener is None:
+                self.listen()
+
+    def _accept(self, listener):
+        while True:
+            try:
+                client, _ = listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            with self.lock:
+                self.connections.update((client, upstream))
+            threading.Thread(target=self._pump, args=(client, upstream), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client), daemon=True).start()
+
+    def _pump(self, source: socket.socket, destination: socket.socket):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                # timeout 故障期间数据滞留在代理中，客户端等到超时后断开
+                while self.fault == "timeout" and self.active():
+                    time.sleep(0.02)
+                destination.sendall(data)
+        except OSError:
+            pass
+        finally:
+            self._close(source)
+            self._close(destination)
+
+    @staticmethod
+    def _close(sock: socket.socket):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+
+def run_scenario(base_url: str, proxy_url: str, server_module, injector: FailureInjector, proxy: FaultProxy,
+                 fault: str, use_spool: bool, args):
+    """返回 (创建的请求数, 租约内送达延迟列表, 注入的失败次数, 暂存统计, 暂存峰值字节数)"""
+    server_module.screenshot_requests.clear()
+    server_module.screenshots.clear()
+    server_module.get_room(server_module.DEFAULT_ROOM).base_frame.update({"frame_id": None, "image": None})
+
+    with tempfile.TemporaryDirectory() as spool_dir:
+        spool = UploadSpool(spool_dir) if use_spool else None
+        client = ScreenshotClient(proxy_url, capture_backend=SyntheticBackend(args.width, args.height, grain=0.1),
+                                  spool=spool, spool_lease=args.lease)
+        client.timeout = args.client_timeout
+        worker = threading.Thread(target=client.run, args=(0.2, 1.0), daemon=True)
+        worker.start()
+        time.sleep(0.5)  # 等待连接测试完成，避免其领取第一批请求
+
+        peak = {"bytes": 0}
+        stop_monitor = threading.Event()
+
+        def monitor():
+            while not stop_monitor.wait(0.1):
+                if spool:
+                    peak["bytes"] = max(peak["bytes"], spool.get_stats()["bytes"])
+
+        threading.Thread(target=monitor, daemon=True).start()
+
+        # 网络故障只占窗口后半段，前半段上传返回503，保证有截图进入暂存
+        start, end = args.outage
+        middle = (start + end) / 2
+        injector.reset((start, end) if fault == "503" else (start, middle))
+        proxy.reset(None if fault == "503" else fault, (middle, end))
+        created = {}
+        with requests.Session() as session:
+            start = time.time()
+            index = 0
+            while time.time() - start < args.duration:
+                response = session.post(f"{base_url}/api/request-screenshot", json={"user_id": f"bench_{index}"})
+                created[response.json()["request_id"]] = time.time()
+                index += 1
+                time.sleep(1 / args.rate)
+        # 等最后一个请求的租约结束
+        time.sleep(args.lease)
+
+        client.stop()
+        worker.join(timeout=10)
+        stop_monitor.set()
+
+        delivered = []
+        for request_id, created_at in created.items():
+            screenshot = server_module.screenshots.get(server_module.parse_request_id(request_id))
+            if screenshot and screenshot.timestamp - created_at <= args.lease:
+                delivered.append(screenshot.timestamp - created_at)
+        stats = client.get_spool_stats()
+        client.session.close()
+        return len(created), delivered, injector.injected, stats, peak["bytes"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上传失败暂存重试故障注入测试")
+    parser.add_argument("--duration", type=float, default=20, help="创建请求的时长（秒）")
+    parser.add_argument("--rate", type=float, default=2, help="每秒创建的请求数")
+    parser.add_argument("--outage", default="4,12", help="注入故障的时间窗口 开始,结束（秒）")
+    parser.add_argument("--faults", default=",".join(FAULTS), help=f"依次测试的故障类型，可选 {'/'.join(FAULTS)}")
+    parser.add_argument("--client-timeout", type=float, default=1.0, help="电脑端请求超时（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.05, help="窗口外上传随机失败的概率")
+    parser.add_argument("--lease", type=float, default=15, help="请求租约（秒）")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    args.outage = outage = tuple(float(v) for v in args.outage.split(","))
+    faults = args.faults.split(",")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # app.server 导入时会在当前目录创建 static/
+        os.chdir(workdir)
+        from app import server as server_module
+
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        injector = FailureInjector(server_module.app, outage, args.fail_rate, args.seed)
+        server = serve_in_thread(injector, port)
+        proxy = FaultProxy(port)
+        proxy_url = f"http://127.0.0.1:{proxy.port}"
+        try:
+            print(f"每秒 {args.rate:g} 个请求，持续 {args.duration:g}s，故障窗口 {outage[0]:g}-{outage[1]:g}s，"
+                  f"窗口外失败率 {args.fail_rate:.0%}，租约 {args.lease:g}s，电脑端超时 {args.client_timeout:g}s，"
+                  f"画面 {args.width}x{args.height}")
+            for fault in faults:
+                print(f"\n故障类型: {fault}")
+                for use_spool in (False, True):
+                    total, delivered, injected, stats, peak = run_scenario(base_url, proxy_url, server_module,
+                                                                           injector, proxy, fault, use_spool, args)
+                    name = "暂存重试" if use_spool else "失败丢弃"
+                    print(f"  {name}: 租约内送达 {len(delivered)}/{total} ({len(delivered) / total:.0%})，"
+                          f"注入503 {injected} 次，送达延迟 p50 {percentile(delivered, 0.5):5.2f}s "
+                          f"p95 {percentile(delivered, 0.95):5.2f}s")
+                    if stats:
+                        print(f"            暂存 {stats['spooled']} 个，重试送达 {stats['delivered']}，"
+                              f"放弃 {stats['rejected']}，过期 {stats['expired']}，重试 {stats['retries']} 次，"
+                              f"重试延迟 p50 {stats.get('retry_latency_p50', float('nan')):5.2f}s "
+                              f"max {stats.get('retry_latency_max', float('nan')):5.2f}s，"
+                              f"暂存峰值 {peak / 1024:.0f} KB")
+        finally:
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench_viewport_downscale.py - 按手机端显示尺寸缩小后再编码的基准测试
+#
+# 对典型手机的显示宽度和设备像素比，比较“全分辨率编码”和“缩小后编码”
+# （含缩放耗时）的编码时间与PNG大小，并与缩放比例的平方对照。
+# 最后通过进程内服务器走一遍 request -> check-requests -> 上传 -> get-screenshot，
+# 确认显示信息被转发给电脑端、返回的截图宽度符合预期。
+#
+# 用法: python benchmarks/bench_viewport_downscale.py [--repeat 3]
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app import server
+from screenshot_client import (ScreenshotClient, SyntheticBackend, downscale_image, encode_png_bytes,
+                               get_target_width)
+
+logging.getLogger().setLevel(logging.WARNING)
+
+SOURCES = {"1080p": (1920, 1080), "4K": (3840, 2160)}
+# (说明, 显示宽度, 设备像素比)，显示宽度与 /mobile 页面一样限制在 500px 以内
+VIEWERS = [
+    ("iPhone 390@3x", 390, 3.0),
+    ("Android 412@2.625x", 412, 2.625),
+    ("小屏 360@2x", 360, 2.0),
+    ("平板 500@2x", 500, 2.0),
+]
+
+
+def best_time(func, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def end_to_end_check():
+    """进程内完整走一遍请求流程，返回上传的截图宽度"""
+    http = TestClient(server.app)
+    client = ScreenshotClient("http://testserver", capture_backend=SyntheticBackend(seed=3))
+    client.session = http
+    request_id = http.post("/api/request-screenshot", json={
+        "user_id": "bench", "viewport_width": 390, "device_pixel_ratio": 3
+    }).json()["request_id"]
+    for request in client.check_requests():
+        client.process_screenshot_request(request)
+    data = http.get(f"/api/get-screenshot/{request_id}").json()
+    small = Image.open(io.BytesIO(http.get(data["image_url"]).content))
+
+    full_id = http.post("/api/request-screenshot", json={
+        "user_id": "bench", "full_resolution_of": request_id
+    }).json()["request_id"]
+    for request in client.check_requests():
+        client.process_screenshot_request(request)
+    data = http.get(f"/api/get-screenshot/{full_id}").json()
+    full = Image.open(io.BytesIO(http.get(data["image_url"]).content))
+    return small.width, full.width
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按显示尺寸缩小编码基准测试")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--grain", type=float, default=0.1, help="合成画面叠加噪点的比例 (0-1)")
+    args = parser.parse_args()
+
+    for source, (width, height) in SOURCES.items():
+        frame = SyntheticBackend(width, height, seed=1, grain=args.grain).grab()
+        full_time, full_png = best_time(lambda: encode_png_bytes(frame), args.repeat)
+        print(f"\n{source} ({width}x{height}) 全分辨率: 编码 {full_time * 1000:7.1f} ms, {len(full_png) / 1024:8.1f} KB")
+        for name, viewport_width, pixel_ratio in VIEWERS:
+            target = get_target_width({"viewport_width": viewport_width, "device_pixel_ratio": pixel_ratio})
+            elapsed, png = best_time(lambda: encode_png_bytes(downscale_image(frame, target)), args.repeat)
+            factor_squared = (width / min(target, width)) ** 2
+            print(f"  {name:<20} -> {min(target, width):4d}px: 缩放+编码 {elapsed * 1000:7.1f} ms "
+                  f"(快 {full_time / elapsed:4.1f}x), {len(png) / 1024:7.1f} KB "
+                  f"(小 {len(full_png) / len(png):4.1f}x), 缩放比例平方 {factor_squared:4.1f}")
+
+    small_width, full_width = end_to_end_check()
+    print(f"\n端到端: 缩小请求返回宽度 {small_width}px，原图请求返回宽度 {full_width}px")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# sim_adaptive_polling.py - 自适应轮询的全天模拟
+#
+# 在虚拟时钟上重放一整天的请求轨迹（夜间无人、展览时段内观众成簇到来，
+# 中午服务器中断10分钟），比较以下轮询策略：
+#   - 原始固定间隔（0.8s / 0.2s），连续5次出错后退出
+#   - AdaptivePollScheduler（空闲逐步放慢、出错指数退避持续重连）
+#   - AdaptivePollScheduler + 服务器 next_poll_after 提示
+# 报告服务器收到的轮询次数和取件延迟（请求发出到被电脑端取走）的分布。
+# 不访问网络，几秒内完成。
+#
+# 用法: python benchmarks/sim_adaptive_polling.py [--seed 1] [--visitors-per-hour 20]
+import argparse
+import bisect
+import logging
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from screenshot_client import AdaptivePollScheduler
+
+logging.getLogger().setLevel(logging.WARNING)
+
+DAY = 24 * 3600
+OPEN_HOURS = (10 * 3600, 18 * 3600)
+OUTAGE = (13 * 3600, 13 * 3600 + 600)
+CAPTURE_SECONDS = 0.3
+# 与 app/server.py 的默认值一致
+ACTIVE_POLL_INTERVAL = 0.5
+VIEWER_ACTIVE_WINDOW = 60
+
+
+def make_trace(rng: random.Random, visitors_per_hour: float):
+    """生成一天内的截图请求时间：每位观众在几十秒内连续请求1-4次"""
+    times = []
+    t = OPEN_HOURS[0]
+    while True:
+        t += rng.expovariate(visitors_per_hour / 3600)
+        if t >= OPEN_HOURS[1]:
+            break
+        burst = t
+        for _ in range(rng.randint(1, 4)):
+            times.append(burst)
+            burst += rng.uniform(10, 40)
+    return sorted(times)
+
+
+def simulate(trace, strategy: str, rng: random.Random):
+    """返回 (轮询次数, [(请求时间, 取件延迟)], 未被取走的请求数)"""
+    now = 0.0
+    polls = 0
+    latencies = []
+    picked = 0
+    scheduler = None
+    if strategy.startswith("adaptive"):
+        scheduler = AdaptivePollScheduler(0.8, 10.0, clock=lambda: now, rng=rng)
+    fixed_interval = {"fixed-0.8s": 0.8, "fixed-0.2s": 0.2}.get(strategy)
+    consecutive_errors = 0
+
+    while now < DAY:
+        polls += 1
+        if OUTAGE[0] <= now < OUTAGE[1]:
+            if scheduler:
+                now += scheduler.record_error()
+                continue
+            consecutive_errors += 1
+            if consecutive_errors >= 5:
+                break  # 原始客户端连续出错5次后退出
+            now += fixed_interval * 2
+            continue
+        consecutive_errors = 0
+
+        ready = bisect.bisect_right(trace, now)
+        new_requests = trace[picked:ready]
+        latencies.extend((t, now - t) for t in new_requests)
+        picked = ready
+
+        if scheduler:
+            if new_requests:
+                scheduler.record_activity()
+            else:
+                scheduler.record_idle()
+            # 服务器在最近一分钟内有手机端活动时下发快速轮询提示
+            recent = picked and now - trace[picked - 1] < VIEWER_ACTIVE_WINDOW
+            if strategy == "adaptive+hint" and recent:
+                scheduler.set_server_hint(ACTIVE_POLL_INTERVAL)
+            delay = scheduler.next_delay()
+        else:
+            delay = fixed_interval
+        now += CAPTURE_SECONDS * len(new_requests) + delay
+
+    return polls, latencies, len(trace) - picked
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="自适应轮询全天模拟")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--visitors-per-hour", type=float, default=20)
+    args = parser.parse_args()
+
+    trace = make_trace(random.Random(args.seed), args.visitors_per_hour)
+    print(f"一天共 {len(trace)} 个截图请求，展览时段 10:00-18:00，13:00 服务器中断10分钟\n")
+    print(f"{'策略':<14}{'轮询次数':>10}{'p50延迟':>10}{'p95延迟':>10}{'最大延迟':>10}{'中断期间最大':>10}{'未取走':>8}")
+    for strategy in ("fixed-0.8s", "fixed-0.2s", "adaptive", "adaptive+hint"):
+        polls, records, missed = simulate(trace, strategy, random.Random(args.seed))
+        normal = [latency for t, latency in records if not OUTAGE[0] <= t < OUTAGE[1]]
+        outage = [latency for t, latency in records if OUTAGE[0] <= t < OUTAGE[1]]
+        print(f"{strategy:<14}{polls:>12}{percentile(normal, 0.5):>10.2f}s{percentile(normal, 0.95):>9.2f}s"
+              f"{max(normal, default=float('nan')):>9.1f}s{max(outage, default=float('nan')):>13.1f}s{missed:>9}")
+
+
+if __name__ == "__main__":
+    main()
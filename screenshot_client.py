@@ -2,9 +2,24 @@
 import requests
 import time
 import base64
+import cProfile
+import functools
+import hashlib
 import io
 import json
-from PIL import ImageGrab
+import math
+import os
+import pstats
+import random
+import re
+import signal
+import struct
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import configparser
+from PIL import Image, ImageChops, ImageDraw, ImageGrab
 import logging
 from typing import List, Dict, Any, Optional, Tuple
 import sys
@@ -23,62 +38,910 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# HTTP请求超时（秒），防止服务器无响应时主循环永久阻塞
+REQUEST_TIMEOUT = 10
+
+# 增量上传默认参数
+DEFAULT_TILE_SIZE = 64
+DEFAULT_KEYFRAME_INTERVAL = 30
+# 变化图块占比超过该值时直接完整上传，增量已无收益
+MAX_DELTA_TILE_RATIO = 0.5
+
+# 手机端设备像素比上限，更高的像素密度肉眼已无法分辨
+MAX_DEVICE_PIXEL_RATIO = 3.0
+# 保留最近几次截图的原始画面，供手机端随后请求全分辨率原图
+RECENT_FRAMES_CAPACITY = 4
+
+# 自适应轮询参数
+DEFAULT_MAX_POLL_INTERVAL = 10.0
+# 最近一次出现请求后，保持最快轮询的时长（秒）
+POLL_IDLE_GRACE = 60.0
+# 空闲时每次轮询后间隔的增长倍数
+POLL_IDLE_DECAY = 1.5
+# 出错后重连的指数退避起点与上限（秒）
+ERROR_BACKOFF_BASE = 1.0
+ERROR_BACKOFF_MAX = 60.0
+
+# 上传失败暂存参数
+DEFAULT_SPOOL_DIR = "upload_spool"
+DEFAULT_SPOOL_MAX_BYTES = 200 * 1024 * 1024
+# 请求租约（秒）：手机端等待30秒后放弃，超过租约的暂存上传不再重试
+DEFAULT_SPOOL_LEASE = 30.0
+# 暂存上传的重试退避起点与上限（秒）
+SPOOL_RETRY_BASE = 0.5
+SPOOL_RETRY_MAX = 8.0
+
+# 分块上传参数：PNG超过该大小时分块上传，中断后从服务器确认的偏移量续传
+CHUNKED_UPLOAD_THRESHOLD = 4 * 1024 * 1024
+# 单个数据块连续失败的重试次数上限
+CHUNK_RETRY_LIMIT = 5
+
+# 实时推流参数：服务器未指定时的画面最大宽度、JPEG质量，连续失败多少次后停止推流
+LIVE_DEFAULT_MAX_WIDTH = 1280
+LIVE_JPEG_QUALITY = 70
+LIVE_FAILURE_LIMIT = 5
+
+# 性能分析：开启后对截图和上传阶段做 cProfile 统计，关闭时写出 pstats 文件
+DEFAULT_PROFILE_PATH = "screenshot_client.prof"
+# 写入日志的耗时最多的函数数
+PROFILE_LOG_LINES = 15
+
+# 并行编码参数：像素数低于该阈值时单线程编码更快
+PARALLEL_ENCODE_MIN_PIXELS = 1280 * 720
+# 每个条带至少包含的行数，避免条带过小导致压缩率下降
+PARALLEL_ENCODE_MIN_STRIP_ROWS = 64
+# PNG颜色类型: 模式 -> (颜色类型, 每像素字节数)
+PNG_COLOR_TYPES = {"L": (0, 1), "RGB": (2, 3), "RGBA": (6, 4)}
+
+_encode_pool: Optional[ThreadPoolExecutor] = None
+_encode_pool_workers = 0
+_encode_pool_lock = threading.Lock()
+
+def chunk_retry_delay(failures: int) -> float:
+    """数据块第 failures 次重试前的等待时间（秒）：指数增长，在上限的一半到上限之间随机取值"""
+    ceiling = min(SPOOL_RETRY_MAX, SPOOL_RETRY_BASE * 2 ** failures)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+def get_encode_workers() -> int:
+    """并行编码使用的线程数，默认等于CPU核心数"""
+    return os.cpu_count() or 1
+
+def _get_encode_pool(workers: int) -> ThreadPoolExecutor:
+    """获取（必要时重建）编码线程池"""
+    global _encode_pool, _encode_pool_workers
+    with _encode_pool_lock:
+        if _encode_pool is None or _encode_pool_workers != workers:
+            if _encode_pool is not None:
+                _encode_pool.shutdown(wait=False)
+            _encode_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="png-encode")
+            _encode_pool_workers = workers
+        return _encode_pool
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """构造一个PNG数据块"""
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+def _deflate_strip(data: bytes, level: int, zdict: Optional[bytes], is_last: bool) -> bytes:
+    """把一个条带压缩为原始deflate数据；非末尾条带以同步刷新结束，便于直接拼接"""
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH)
+
+def encode_png_parallel(image: Image.Image, workers: int, level: int = 6) -> bytes:
+    """
+    按行条带并行压缩，生成单个标准PNG文件
+    
+    每行使用Up滤波（由ImageChops在C层面批量计算），各条带在线程池中
+    独立deflate压缩（zlib压缩期间释放GIL），并以上一条带末尾32KB作为
+    预设字典以保持压缩率，最后拼接为一个zlib流。
+    
+    Args:
+        image: 要编码的PIL图像
+        workers: 并行线程数
+        level: zlib压缩级别
+        
+    Returns:
+        PNG字节
+    """
+    if image.mode not in PNG_COLOR_TYPES:
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    color_type, bytes_per_pixel = PNG_COLOR_TYPES[image.mode]
+    width, height = image.size
+    stride = width * bytes_per_pixel
+    
+    # Up滤波: 每行减去上一行（首行减去全零行）
+    shifted = Image.new(image.mode, image.size)
+    shifted.paste(image.crop((0, 0, width, height - 1)), (0, 1))
+    raw = memoryview(ImageChops.subtract_modulo(image, shifted).tobytes())
+    
+    rows_per_strip = max(PARALLEL_ENCODE_MIN_STRIP_ROWS, -(-height // workers))
+    strips = []
+    for start in range(0, height, rows_per_strip):
+        end = min(start + rows_per_strip, height)
+        rows = [raw[row * stride:(row + 1) * stride] for row in range(start, end)]
+        strips.append(b"\x02" + b"\x02".join(rows))
+    
+    pool = _get_encode_pool(workers)
+    futures = [
+        pool.submit(_deflate_strip, strip, level, strips[index - 1][-32768:] if index else None,
+                    index == len(strips) - 1)
+        for index, strip in enumerate(strips)
+    ]
+    checksum = 1
+    for strip in strips:
+        checksum = zlib.adler32(strip, checksum)
+    idat = b"\x78\x9c" + b"".join(future.result() for future in futures) + struct.pack(">I", checksum)
+    
+    return (b"\x89PNG\r\n\x1a\n"
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+            + _png_chunk(b"IDAT", idat)
+            + _png_chunk(b"IEND", b""))
+
+def encode_png_bytes(image: Image.Image, workers: Optional[int] = None) -> bytes:
+    """
+    把PIL图像编码为PNG字节，大画面在多核上并行编码
+    
+    Args:
+        image: 要编码的PIL图像
+        workers: 并行线程数，None表示使用全部CPU核心
+        
+    Returns:
+        PNG字节
+    """
+    # 即使只有一个核心，Up滤波的条带编码也比PIL的自适应滤波更快
+    workers = workers or get_encode_workers()
+    if image.width * image.height >= PARALLEL_ENCODE_MIN_PIXELS:
+        try:
+            return encode_png_parallel(image, workers)
+        except Exception as e:
+            logger.warning(f"并行编码失败，回退为单线程编码: {e}")
+    
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def get_target_width(request: Dict[str, Any]) -> Optional[int]:
+    """
+    根据手机端上报的显示宽度和设备像素比计算需要的画面宽度
+    
+    Args:
+        request: 截图请求信息
+        
+    Returns:
+        目标宽度（像素）；请求未携带显示信息时返回None
+    """
+    viewport_width = request.get("viewport_width")
+    if not viewport_width:
+        return None
+    pixel_ratio = min(float(request.get("device_pixel_ratio") or 1.0), MAX_DEVICE_PIXEL_RATIO)
+    return max(1, math.ceil(viewport_width * pixel_ratio))
+
+def downscale_image(image: Image.Image, target_width: int) -> Image.Image:
+    """
+    等比缩小画面到目标宽度，不会放大
+    
+    先用 reduce() 做整数倍盒式降采样，再用双线性插值完成剩余缩放，
+    两步都在 Pillow 的C实现中批量完成，比直接高质量重采样快得多。
+    """
+    if target_width >= image.width:
+        return image
+    target_height = max(1, round(image.height * target_width / image.width))
+    return image.resize((target_width, target_height), Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+def encode_live_frame(image: Image.Image, max_width: int, quality: int = LIVE_JPEG_QUALITY) -> bytes:
+    """把实时画面缩小到最大宽度并编码为JPEG"""
+    buffer = io.BytesIO()
+    downscale_image(image, max_width).convert("RGB").save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+def find_changed_tiles(base: Image.Image, image: Image.Image, tile_size: int) -> List[Tuple[int, int, int, int]]:
+    """
+    找出相对基准帧发生变化的图块
+    
+    Args:
+        base: 服务器已确认的基准帧
+        image: 新截取的画面，尺寸和模式需与基准帧一致
+        tile_size: 图块边长（像素）
+        
+    Returns:
+        变化图块的区域列表 (left, top, right, bottom)
+    """
+    diff = ImageChops.difference(base, image)
+    if diff.getbbox() is None:
+        return []
+    
+    width, height = image.size
+    changed = []
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            box = (left, top, min(left + tile_size, width), min(top + tile_size, height))
+            if diff.crop(box).getbbox() is not None:
+                changed.append(box)
+    return changed
+
+def count_tiles(size: Tuple[int, int], tile_size: int) -> int:
+    """计算给定尺寸的画面被切分出的图块总数"""
+    width, height = size
+    return ((width + tile_size - 1) // tile_size) * ((height + tile_size - 1) // tile_size)
+
+class AdaptivePollScheduler:
+    """
+    自适应轮询调度器
+    
+    有请求时按最小间隔快速轮询；空闲超过宽限期后间隔按倍数增长，直到最大间隔；
+    出错时使用带抖动的指数退避；服务器返回的 next_poll_after 优先于本地计划。
+    """
+    
+    def __init__(self, min_interval: float = 0.8, max_interval: float = DEFAULT_MAX_POLL_INTERVAL,
+                 idle_grace: float = POLL_IDLE_GRACE, idle_decay: float = POLL_IDLE_DECAY,
+                 error_base: float = ERROR_BACKOFF_BASE, error_max: float = ERROR_BACKOFF_MAX,
+                 clock=time.monotonic, rng: Optional[random.Random] = None):
+        """
+        Args:
+            min_interval: 最小轮询间隔（秒），有活动时使用
+            max_interval: 空闲时的最大轮询间隔（秒），也是空闲时取件延迟的上限
+            idle_grace: 最近一次活动后保持最小间隔的时长（秒）
+            idle_decay: 空闲时每次轮询后间隔的增长倍数
+            error_base: 出错后第一次重连的退避时间（秒）
+            error_max: 出错退避时间的上限（秒）
+            clock: 单调时钟函数，模拟测试时可替换
+            rng: 随机数生成器，用于退避抖动
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.configured_max_interval = self.max_interval
+        self.idle_grace = idle_grace
+        self.idle_decay = idle_decay
+        self.error_base = error_base
+        self.error_max = error_max
+        self.clock = clock
+        self.rng = rng or random.Random()
+        
+        self.interval = min_interval
+        self.last_activity = clock()
+        self.consecutive_errors = 0
+        self._server_hint: Optional[float] = None
+    
+    def record_activity(self):
+        """本次轮询发现了请求：回到最快轮询"""
+        self.last_activity = self.clock()
+        self.interval = self.min_interval
+        self.consecutive_errors = 0
+    
+    def record_idle(self):
+        """本次轮询没有请求：超过宽限期后逐步放慢"""
+        self.consecutive_errors = 0
+        if self.clock() - self.last_activity >= self.idle_grace:
+            self.interval = min(self.max_interval, self.interval * self.idle_decay)
+    
+    def record_error(self) -> float:
+        """
+        本次轮询失败
+        
+        Returns:
+            下次重连前的等待时间（秒），在退避上限的一半到上限之间随机取值
+        """
+        self.consecutive_errors += 1
+        ceiling = min(self.error_max, self.error_base * 2 ** min(self.consecutive_errors - 1, 16))
+        return ceiling / 2 + self.rng.uniform(0, ceiling / 2)
+    
+    def set_server_hint(self, seconds: Optional[float]):
+        """记录服务器建议的下次轮询时间，仅对下一次轮询生效"""
+        self._server_hint = seconds
+    
+    def set_heartbeat_interval(self, seconds: Optional[float]):
+        """服务器要求的最长轮询间隔：轮询兼作心跳，空闲时的间隔不超过该值，否则服务器会认为本机离线"""
+        limit = self.configured_max_interval if not seconds else min(self.configured_max_interval, float(seconds))
+        self.max_interval = max(self.min_interval, limit)
+        self.interval = min(self.interval, self.max_interval)
+    
+    def next_delay(self) -> float:
+        """距离下次轮询的等待时间（秒）"""
+        if self._server_hint is not None:
+            hint, self._server_hint = self._server_hint, None
+            return max(0.0, min(float(hint), self.max_interval))
+        return self.interval
+
+class UploadSpool:
+    """
+    上传失败截图的磁盘暂存队列
+    
+    每个条目保存为 <请求ID>.png 和 <请求ID>.json（过期时间），先写临时文件再
+    重命名，客户端重启后仍可继续重试。总大小超过上限时优先丢弃最早过期的条目。
+    """
+    
+    def __init__(self, directory: str = DEFAULT_SPOOL_DIR, max_bytes: int = DEFAULT_SPOOL_MAX_BYTES,
+                 clock=time.time):
+        """
+        Args:
+            directory: 暂存目录
+            max_bytes: 暂存总大小上限（字节）
+            clock: 时钟函数，模拟测试时可替换
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._total_bytes = 0
+        self._counters = {"spooled": 0, "delivered": 0, "expired": 0, "rejected": 0, "overflow": 0, "retries": 0}
+        self._retry_latencies: List[float] = []
+        os.makedirs(directory, exist_ok=True)
+        self._load_existing()
+    
+    def _path(self, request_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9_-]", "_", request_id) + suffix)
+    
+    def _load_existing(self):
+        """加载上次运行遗留的暂存条目"""
+        now = self.clock()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    meta = json.load(f)
+                size = os.path.getsize(self._path(meta["request_id"], ".png"))
+            except (OSError, ValueError, KeyError):
+                continue
+            meta.update({"size": size, "attempts": 0, "next_attempt": now})
+            self._entries[meta["request_id"]] = meta
+            self._total_bytes += size
+        if self._entries:
+            logger.info(f"发现 {len(self._entries)} 个上次未完成的暂存上传")
+    
+    def _remove_files(self, request_id: str):
+        for suffix in (".png", ".json"):
+            try:
+                os.remove(self._path(request_id, suffix))
+            except OSError:
+                pass
+    
+    def _drop(self, request_id: str, counter: Optional[str], remove_files: bool = True):
+        meta = self._entries.pop(request_id, None)
+        if meta is not None:
+            self._total_bytes -= meta["size"]
+            if counter:
+                self._counters[counter] += 1
+            if remove_files:
+                self._remove_files(request_id)
+    
+    def put(self, request_id: str, data: bytes, expires_at: float) -> bool:
+        """
+        暂存一次失败的上传
+        
+        Args:
+            request_id: 请求ID
+            data: 编码后的PNG字节
+            expires_at: 租约到期时间，之后不再重试
+            
+        Returns:
+            是否成功暂存（超过容量上限时返回False）
+        """
+        if len(data) > self.max_bytes:
+            with self._lock:
+                self._counters["overflow"] += 1
+            return False
+        
+        meta = {"request_id": request_id, "created": self.clock(), "expires_at": expires_at}
+        for suffix, content in ((".png", data), (".json", json.dumps(meta).encode("utf-8"))):
+            temp_path = self._path(request_id, suffix + ".tmp")
+            with open(temp_path, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, self._path(request_id, suffix))
+        
+        with self._lock:
+            # 同一请求再次暂存时覆盖旧条目（文件已被上面的写入替换）
+            self._drop(request_id, None, remove_files=False)
+            # 超出容量时丢弃最早过期的条目
+            while self._entries and self._total_bytes + len(data) > self.max_bytes:
+                oldest = min(self._entries.values(), key=lambda entry: entry["expires_at"])
+                self._drop(oldest["request_id"], "overflow")
+            meta.update({"size": len(data), "attempts": 0, "next_attempt": meta["created"]})
+            self._entries[request_id] = meta
+            self._total_bytes += len(data)
+            self._counters["spooled"] += 1
+        return True
+    
+    def expire(self) -> int:
+        """丢弃租约已过期的条目，返回丢弃数量"""
+        now = self.clock()
+        with self._lock:
+            expired = [request_id for request_id, meta in self._entries.items() if meta["expires_at"] <= now]
+            for request_id in expired:
+                self._drop(request_id, "expired")
+        return len(expired)
+    
+    def due(self) -> List[Dict[str, Any]]:
+        """当前应当重试的条目"""
+        now = self.clock()
+        with self._lock:
+            return [dict(meta) for meta in self._entries.values() if meta["next_attempt"] <= now]
+    
+    def next_wakeup(self) -> Optional[float]:
+        """最近一次需要重试或过期处理的时间"""
+        with self._lock:
+            if not self._entries:
+                return None
+            return min(min(meta["next_attempt"], meta["expires_at"]) for meta in self._entries.values())
+    
+    def read(self, request_id: str) -> bytes:
+        with open(self._path(request_id, ".png"), "rb") as f:
+            return f.read()
+    
+    def mark_retry(self, request_id: str):
+        """本次重试失败，按指数退避安排下次重试"""
+        with self._lock:
+            meta = self._entries.get(request_id)
+            if meta is not None:
+                meta["attempts"] += 1
+                self._counters["retries"] += 1
+                delay = min(SPOOL_RETRY_MAX, SPOOL_RETRY_BASE * 2 ** min(meta["attempts"] - 1, 16))
+                meta["next_attempt"] = self.clock() + delay
+    
+    def complete(self, request_id: str):
+        """重试上传成功"""
+        with self._lock:
+            meta = self._entries.get(request_id)
+            if meta is not None:
+                self._retry_latencies.append(self.clock() - meta["created"])
+                self._retry_latencies = self._retry_latencies[-1000:]
+                self._drop(request_id, "delivered")
+    
+    def reject(self, request_id: str):
+        """服务器已不认识该请求（例如已过期被清理），不再重试"""
+        with self._lock:
+            self._drop(request_id, "rejected")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        暂存队列统计
+        
+        Returns:
+            条目数、字节数、各类计数，以及重试成功的延迟（从暂存到送达，秒）
+        """
+        with self._lock:
+            latencies = sorted(self._retry_latencies)
+            stats = {"entries": len(self._entries), "bytes": self._total_bytes, **self._counters}
+        if latencies:
+            stats.update({
+                "retry_latency_p50": latencies[len(latencies) // 2],
+                "retry_latency_max": latencies[-1],
+            })
+        return stats
+
+class CaptureBackend:
+    """截图后端接口"""
+    
+    name = "base"
+    
+    def grab(self, bbox: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        """
+        截取画面
+        
+        Args:
+            bbox: 截图范围 (left, top, right, bottom)，None表示全屏
+            
+        Returns:
+            RGB模式的PIL图像
+        """
+        raise NotImplementedError
+    
+    def close(self):
+        """释放后端占用的资源"""
+        pass
+
+class ImageGrabBackend(CaptureBackend):
+    """基于 PIL.ImageGrab 的截图后端，兼容性最好"""
+    
+    name = "imagegrab"
+    
+    def grab(self, bbox: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        return ImageGrab.grab(bbox=bbox)
+
+class MSSBackend(CaptureBackend):
+    """基于 mss 的截图后端，在 Linux/X11 上使用共享内存(XShm)，比 ImageGrab 快得多"""
+    
+    name = "mss"
+    
+    def __init__(self):
+        import mss  # 可选依赖: pip install mss
+        self._mss = mss
+        # mss实例不能跨线程使用，每个线程各自创建
+        self._local = threading.local()
+    
+    def _get_sct(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            sct = self._local.sct = self._mss.mss()
+        return sct
+    
+    def grab(self, bbox: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        sct = self._get_sct()
+        if bbox:
+            left, top, right, bottom = bbox
+            monitor = {"left": left, "top": top, "width": right - left, "height": bottom - top}
+        else:
+            # 与 ImageGrab.grab() 一致，默认只截取主显示器
+            monitor = sct.monitors[1]
+        shot = sct.grab(monitor)
+        return Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+    
+    def close(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is not None:
+            sct.close()
+            self._local.sct = None
+
+class SyntheticBackend(CaptureBackend):
+    """
+    在内存中生成“缓慢演化的生成艺术”画面的截图后端
+    
+    不需要显示器，用于无头环境下的测试与基准测试。每次截图都会在随机
+    挑选的一部分图块中绘制新的笔触。
+    """
+    
+    name = "synthetic"
+    
+    def __init__(self, width: int = 1920, height: int = 1080, change_ratio: float = 0.05,
+                 tile_size: int = DEFAULT_TILE_SIZE, seed: int = 0, grain: float = 0.0):
+        """
+        Args:
+            width: 画面宽度
+            height: 画面高度
+            change_ratio: 每次截图发生变化的图块比例
+            tile_size: 变化图块的边长（像素）
+            seed: 随机种子，相同种子生成相同的画面序列
+            grain: 叠加噪点的比例 (0-1)，模拟纹理丰富、难以压缩的作品
+        """
+        self.width = width
+        self.height = height
+        self.change_ratio = change_ratio
+        self.tile_size = tile_size
+        self.grain = grain
+        self._rng = random.Random(seed)
+        self._frame = self._make_base_frame()
+        self._lock = threading.Lock()
+        self._first = True
+    
+    def _random_color(self) -> Tuple[int, int, int]:
+        return tuple(self._rng.randrange(256) for _ in range(3))
+    
+    def _make_base_frame(self) -> Image.Image:
+        """生成带渐变和色块的初始画面"""
+        gradient = Image.linear_gradient("L").resize((self.width, self.height))
+        frame = Image.merge("RGB", (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient.rotate(180)))
+        draw = ImageDraw.Draw(frame)
+        for _ in range(200):
+            x, y = self._rng.randrange(self.width), self._rng.randrange(self.height)
+            r = self._rng.randrange(10, 80)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=self._random_color())
+        if self.grain:
+            noise = Image.effect_noise((self.width, self.height), 64).convert("RGB")
+            frame = Image.blend(frame, noise, self.grain)
+        return frame
+    
+    def _evolve(self):
+        """随机挑选一部分图块，在其中绘制新的笔触"""
+        frame = self._frame.copy()
+        draw = ImageDraw.Draw(frame)
+        tile_size = self.tile_size
+        columns = (self.width + tile_size - 1) // tile_size
+        total = count_tiles((self.width, self.height), tile_size)
+        for index in self._rng.sample(range(total), max(1, int(total * self.change_ratio))):
+            left, top = (index % columns) * tile_size, (index // columns) * tile_size
+            x, y = left + self._rng.randrange(tile_size), top + self._rng.randrange(tile_size)
+            draw.line((left, top, x, y), fill=self._random_color(), width=3)
+        self._frame = frame
+    
+    def grab(self, bbox: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        with self._lock:
+            if self._first:
+                self._first = False
+            elif self.change_ratio > 0:
+                self._evolve()
+            frame = self._frame
+        # 每帧都是新的图像对象，调用方可以安全地长期持有
+        return frame.crop(bbox) if bbox else frame
+
+CAPTURE_BACKENDS = {
+    ImageGrabBackend.name: ImageGrabBackend,
+    MSSBackend.name: MSSBackend,
+    SyntheticBackend.name: SyntheticBackend,
+}
+
+def create_capture_backend(name: str = "imagegrab", **options) -> CaptureBackend:
+    """
+    按名称创建截图后端，不可用时回退为 ImageGrab
+    
+    Args:
+        name: 后端名称，imagegrab / mss / synthetic
+        options: 传给后端构造函数的参数
+        
+    Returns:
+        截图后端实例
+    """
+    backend_class = CAPTURE_BACKENDS.get(name.strip().lower())
+    if backend_class is None:
+        logger.warning(f"未知的截图后端: {name}，使用 imagegrab")
+        return ImageGrabBackend()
+    try:
+        return backend_class(**options)
+    except ImportError as e:
+        logger.warning(f"截图后端 {name} 不可用 ({e})，使用 imagegrab")
+        return ImageGrabBackend()
+
+def load_client_config(path: str = "client_config.ini") -> Dict[str, Any]:
+    """
+    读取客户端配置文件
+    
+    Args:
+        path: 配置文件路径，文件不存在时全部使用默认值
+        
+    Returns:
+        配置字典
+    """
+    parser = configparser.ConfigParser()
+    parser.read(path, encoding="utf-8")
+    section = parser["DEFAULT"]
+    
+    capture_region = None
+    if section.get("capture_mode", "fullscreen") == "region":
+        capture_region = (
+            section.getint("region_x", 0),
+            section.getint("region_y", 0),
+            section.getint("region_width", 1920),
+            section.getint("region_height", 1080),
+        )
+    
+    return {
+        "server_url": section.get("server_url", "https://qrcode.zeabur.app"),
+        "room": section.get("room", "") or None,
+        "poll_interval": section.getfloat("poll_interval", 0.8),
+        "max_poll_interval": section.getfloat("max_poll_interval", DEFAULT_MAX_POLL_INTERVAL),
+        "capture_region": capture_region,
+        "capture_backend": section.get("capture_backend", "imagegrab"),
+        "spool_dir": section.get("spool_dir", DEFAULT_SPOOL_DIR),
+        "spool_max_mb": section.getfloat("spool_max_mb", DEFAULT_SPOOL_MAX_BYTES / 1024 / 1024),
+        "spool_lease_seconds": section.getfloat("spool_lease_seconds", DEFAULT_SPOOL_LEASE),
+        "synthetic_width": section.getint("synthetic_width", 1920),
+        "synthetic_height": section.getint("synthetic_height", 1080),
+        "synthetic_change_ratio": section.getfloat("synthetic_change_ratio", 0.05),
+        "profile": section.getboolean("profile", False),
+        "profile_path": section.get("profile_path", DEFAULT_PROFILE_PATH),
+    }
+
+def create_capture_backend_from_config(config: Dict[str, Any]) -> CaptureBackend:
+    """根据 load_client_config 返回的配置创建截图后端"""
+    name = config["capture_backend"]
+    if name == SyntheticBackend.name:
+        return create_capture_backend(name, width=config["synthetic_width"], height=config["synthetic_height"],
+                                      change_ratio=config["synthetic_change_ratio"])
+    return create_capture_backend(name)
+
+class MethodProfiler:
+    """
+    用 cProfile 统计对象上几个方法的调用
+
+    开启时在实例上用包装函数覆盖这些方法，关闭时删除覆盖、恢复为类上的原方法，
+    未开启时调用路径与没有分析器完全相同。同一时间只统计一个线程的调用，
+    其他线程和嵌套调用（已在统计范围内）直接调用原方法。
+    """
+
+    def __init__(self, target: Any, method_names: Tuple[str, ...], output_path: str):
+        self.target = target
+        self.method_names = method_names
+        self.output_path = output_path
+        self.profile: Optional[cProfile.Profile] = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.profile is not None
+
+    def _wrap(self, method, profile: cProfile.Profile):
+        lock = self._lock
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if not lock.acquire(blocking=False):
+                return method(*args, **kwargs)
+            try:
+                return profile.runcall(method, *args, **kwargs)
+            finally:
+                lock.release()
+        return wrapper
+
+    def start(self):
+        if self.profile is not None:
+            return
+        self.profile = cProfile.Profile()
+        for name in self.method_names:
+            setattr(self.target, name, self._wrap(getattr(self.target, name), self.profile))
+        logger.info(f"性能分析已开启: {', '.join(self.method_names)}")
+
+    def stop(self) -> Optional[str]:
+        """
+        关闭统计并写出结果，不能在被统计的方法内部调用
+
+        Returns:
+            pstats 文件路径，未开启时为None
+        """
+        if self.profile is None:
+            return None
+        for name in self.method_names:
+            vars(self.target).pop(name, None)
+        # 等待正在统计的调用结束
+        with self._lock:
+            profile, self.profile = self.profile, None
+        profile.dump_stats(self.output_path)
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(PROFILE_LOG_LINES)
+        logger.info(f"性能分析已关闭，结果保存到 {self.output_path}（可用 snakeviz 等工具查看）\n{report.getvalue()}")
+        return self.output_path
+
+    def toggle(self):
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+def install_profile_signal(client: "ScreenshotClient") -> Optional[str]:
+    """
+    注册切换性能分析的信号：POSIX 为 SIGUSR1（kill -USR1 <pid>），Windows 控制台为 Ctrl+Break
+
+    Returns:
+        信号名，当前平台不支持时为None
+    """
+    signum = getattr(signal, "SIGUSR1", None) or getattr(signal, "SIGBREAK", None)
+    if signum is None:
+        return None
+    signal.signal(signum, lambda *_: client.request_profile_toggle())
+    return signal.Signals(signum).name
+
 class ScreenshotClient:
-    def __init__(self, server_url: str = "https://qrcode.zeabur.app", capture_region: Optional[Tuple[int, int, int, int]] = None):
+    # 性能分析统计的截图和上传阶段
+    profiled_methods = ("take_screenshot", "prepare_image", "upload_screenshot", "upload_image")
+
+    def __init__(self, server_url: str = "https://qrcode.zeabur.app", capture_region: Optional[Tuple[int, int, int, int]] = None,
+                 delta_upload: bool = True, tile_size: int = DEFAULT_TILE_SIZE,
+                 keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL, encode_workers: Optional[int] = None,
+                 capture_backend: Optional[CaptureBackend] = None, spool: Optional[UploadSpool] = None,
+                 spool_lease: float = DEFAULT_SPOOL_LEASE, room: Optional[str] = None,
+                 profile: bool = False, profile_path: str = DEFAULT_PROFILE_PATH):
         """
         初始化截图客户端
         
         Args:
             server_url: 服务器地址，例如 "https://qrcode.zeabur.app"
             capture_region: 截图区域 (x, y, width, height)，None表示全屏截图
+            delta_upload: 是否启用图块增量上传
+            tile_size: 增量上传的图块边长（像素）
+            keyframe_interval: 每隔多少帧强制完整上传一次关键帧
+            encode_workers: PNG并行编码线程数，None表示使用全部CPU核心
+            capture_backend: 截图后端，None表示使用 ImageGrab
+            spool: 上传失败时的磁盘暂存队列，None表示失败即丢弃
+            spool_lease: 请求租约（秒），暂存的上传只在租约内重试
+            room: 本机所属的房间（展项），只处理该房间手机端的请求，None表示默认房间
+            profile: 是否在客户端启动时即开启性能分析（运行中也可通过 request_profile_toggle 切换）
+            profile_path: 性能分析结果（pstats）的保存路径
         """
         self.server_url = server_url.rstrip('/')
+        self.room = room
+        # 轮询和实时推流带上房间参数；上传按请求ID定位，无需房间
+        self.room_params = {"room": room} if room else {}
         self.session = requests.Session()
-        self.session.timeout = 10
+        # requests.Session 没有全局超时设置，需要在每次请求时传入
+        self.timeout = REQUEST_TIMEOUT
         self.running = False
+        self._stop_event = threading.Event()
         self.capture_region = capture_region
+        self.capture_backend = capture_backend or ImageGrabBackend()
+        
+        # 增量上传状态：服务器最近确认的基准帧
+        self.delta_upload = delta_upload
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self._base_frame: Optional[Image.Image] = None
+        self._base_frame_id: Optional[str] = None
+        self._frames_since_keyframe = 0
+        self.encode_workers = encode_workers
+        
+        # 最近截取的原始画面: 请求ID -> 图像
+        self._recent_frames: OrderedDict = OrderedDict()
         
-        logger.info(f"截图客户端初始化完成，服务器地址: {self.server_url}")
+        # 上传失败暂存与后台重试
+        self.spool = spool
+        self.spool_lease = spool_lease
+        self._spool_stop = threading.Event()
+        self._spool_thread: Optional[threading.Thread] = None
+        
+        # 实时推流：服务器提示有手机订阅时启动，无人观看时自动停止
+        self.live_fps = 0.0
+        self.live_max_width = LIVE_DEFAULT_MAX_WIDTH
+        self._live_stop = threading.Event()
+        self._live_thread: Optional[threading.Thread] = None
+        # 服务器要求的最长轮询间隔（轮询兼作心跳）
+        self.heartbeat_interval: Optional[float] = None
+        
+        # 性能分析：切换请求由主循环在两次轮询之间处理，信号处理函数中只设置标记
+        self.profile_on_start = profile
+        self.profiler = MethodProfiler(self, self.profiled_methods, profile_path)
+        self._profile_toggle = threading.Event()
+        
+        logger.info(f"截图客户端初始化完成，服务器地址: {self.server_url}，截图后端: {self.capture_backend.name}"
+                    + (f"，房间: {room}" if room else ""))
         if self.capture_region:
             logger.info(f"截图区域: x={self.capture_region[0]}, y={self.capture_region[1]}, "
                        f"width={self.capture_region[2]}, height={self.capture_region[3]}")
         else:
             logger.info("截图模式: 全屏截图")
     
-    def take_screenshot(self) -> str:
+    def _capture_bbox(self) -> Optional[Tuple[int, int, int, int]]:
+        """截图区域对应的 (left, top, right, bottom)，全屏时为None"""
+        if not self.capture_region:
+            return None
+        x, y, width, height = self.capture_region
+        return (x, y, x + width, y + height)
+    
+    def capture_image(self) -> Image.Image:
         """
-        截取屏幕并返回base64编码的图片数据
+        截取屏幕
         
         Returns:
-            base64编码的PNG图片字符串
+            截取到的PIL图像
         """
         try:
             if self.capture_region:
                 # 指定区域截图
                 x, y, width, height = self.capture_region
-                bbox = (x, y, x + width, y + height)
-                screenshot = ImageGrab.grab(bbox=bbox)
+                screenshot = self.capture_backend.grab(self._capture_bbox())
                 logger.info(f"区域截图成功，区域: ({x}, {y}, {width}, {height})")
             else:
                 # 全屏截图
-                screenshot = ImageGrab.grab()
+                screenshot = self.capture_backend.grab()
                 logger.info("全屏截图成功")
-            
-            # 转换为字节流
-            buffer = io.BytesIO()
-            screenshot.save(buffer, format='PNG')
-            buffer.seek(0)
-            
-            # 编码为base64
-            image_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            logger.info(f"截图编码完成，图片大小: {len(image_data)} 字符")
-            return image_data
+            return screenshot
             
         except Exception as e:
             logger.error(f"截图失败: {e}")
             raise
     
+    def take_screenshot(self) -> str:
+        """
+        截取屏幕并返回base64编码的图片数据
+        
+        Returns:
+            base64编码的PNG图片字符串
+        """
+        image_data = base64.b64encode(encode_png_bytes(self.capture_image(), self.encode_workers)).decode('utf-8')
+        logger.info(f"截图编码完成，图片大小: {len(image_data)} 字符")
+        return image_data
+    
+    def fetch_requests(self) -> Tuple[List[Dict[str, Any]], Optional[float]]:
+        """
+        向服务器拉取新的截图请求，失败时抛出异常
+        
+        Returns:
+            (待处理的请求列表, 服务器建议的下次轮询等待秒数或None)
+        """
+        response = self.session.get(f"{self.server_url}/api/check-requests", params=self.room_params,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        
+        data = response.json()
+        hint = data.get("next_poll_after")
+        self.heartbeat_interval = data.get("heartbeat_interval")
+        self.set_live_mode(data.get("live_fps"), data.get("live_max_width"))
+        if data.get("has_requests", False):
+            requests_list = data.get("requests", [])
+            logger.info(f"发现 {len(requests_list)} 个待处理的截图请求")
+            return requests_list, hint
+        
+        return [], hint
+    
     def check_requests(self) -> List[Dict[str, Any]]:
         """
         检查服务器是否有新的截图请求
@@ -87,16 +950,7 @@ class ScreenshotClient:
             待处理的请求列表
         """
         try:
-            response = self.session.get(f"{self.server_url}/api/check-requests")
-            response.raise_for_status()
-            
-            data = response.json()
-            if data.get("has_requests", False):
-                requests_list = data.get("requests", [])
-                logger.info(f"发现 {len(requests_list)} 个待处理的截图请求")
-                return requests_list
-            
-            return []
+            return self.fetch_requests()[0]
             
         except requests.RequestException as e:
             logger.error(f"检查请求失败: {e}")
@@ -105,13 +959,14 @@ class ScreenshotClient:
             logger.error(f"解析服务器响应失败: {e}")
             return []
     
-    def upload_screenshot(self, request_id: str, image_data: str) -> bool:
+    def upload_screenshot(self, request_id: str, image_data: str, frame_id: Optional[str] = None) -> bool:
         """
         上传截图到服务器
         
         Args:
             request_id: 请求ID
             image_data: base64编码的图片数据
+            frame_id: 帧ID，提供时服务器会把该帧保存为增量上传的基准帧
             
         Returns:
             是否上传成功
@@ -121,13 +976,21 @@ class ScreenshotClient:
                 "request_id": request_id,
                 "image_data": image_data
             }
+            if frame_id:
+                payload["frame_id"] = frame_id
             
             response = self.session.post(
                 f"{self.server_url}/api/upload-screenshot",
-                json=payload
+                json=payload,
+                timeout=self.timeout
             )
             response.raise_for_status()
             
+            if frame_id:
+                # 旧版服务器不返回frame_id，此时不会建立基准帧
+                acked = response.json().get("frame_id") == frame_id
+                self._base_frame_id = frame_id if acked else None
+            
             logger.info(f"截图上传成功，请求ID: {request_id}")
             return True
             
@@ -138,6 +1001,228 @@ class ScreenshotClient:
             logger.error(f"上传截图时发生未知错误: {e}")
             return False
     
+    def send_chunked(self, session: requests.Session, request_id: str, data: bytes,
+                     frame_id: Optional[str] = None) -> requests.Response:
+        """
+        分块上传PNG数据：初始化 -> 按偏移量上传数据块 -> 完成
+        
+        数据块失败时查询服务器已确认的偏移量并从该处续传；同一请求再次上传相同内容时
+        服务器会返回上次的进度，因此暂存重试也能续传。
+        
+        Args:
+            session: 使用的HTTP会话
+            request_id: 请求ID
+            data: PNG字节数据
+            frame_id: 帧ID，提供时服务器会把该帧保存为增量上传的基准帧
+            
+        Returns:
+            初始化失败时为初始化响应，否则为完成上传的响应
+            
+        Raises:
+            requests.RequestException: 数据块连续失败超过重试上限
+        """
+        response = session.post(f"{self.server_url}/api/upload-init", json={
+            "request_id": request_id,
+            "total_size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "frame_id": frame_id
+        }, timeout=self.timeout)
+        if response.status_code >= 400:
+            return response
+        
+        info = response.json()
+        chunk_url = f"{self.server_url}/api/upload-chunk/{info['upload_id']}"
+        offset, chunk_size = info["offset"], info["chunk_size"]
+        if offset:
+            logger.info(f"从偏移量 {offset}/{len(data)} 续传 - ID: {request_id}")
+        
+        failures = 0
+        while offset < len(data):
+            try:
+                response = session.put(chunk_url, params={"offset": offset}, data=data[offset:offset + chunk_size],
+                                       headers={"Content-Type": "application/octet-stream"}, timeout=self.timeout)
+                if response.status_code == 409:
+                    # 偏移量不一致或上一个数据块仍在写入：以服务器确认的为准，同样计入重试次数并退避，
+                    # 避免在服务器写入期间反复请求
+                    offset = response.json()["offset"]
+                    failures += 1
+                    if failures > CHUNK_RETRY_LIMIT:
+                        response.raise_for_status()
+                    time.sleep(chunk_retry_delay(failures))
+                    continue
+                response.raise_for_status()
+                offset = response.json()["offset"]
+                failures = 0
+            except requests.RequestException as e:
+                failures += 1
+                if failures > CHUNK_RETRY_LIMIT:
+                    raise
+                logger.warning(f"数据块上传失败，准备续传 - ID: {request_id}, 偏移量: {offset}, 错误: {e}")
+                time.sleep(chunk_retry_delay(failures))
+                try:
+                    offset = session.get(chunk_url, timeout=self.timeout).json()["offset"]
+                except (requests.RequestException, ValueError, KeyError):
+                    pass
+        
+        return session.post(f"{self.server_url}/api/upload-finalize/{info['upload_id']}", timeout=self.timeout)
+    
+    def upload_chunked(self, request_id: str, data: bytes, frame_id: Optional[str] = None) -> bool:
+        """
+        分块上传截图，适用于多显示器或4K等大尺寸截图
+        
+        Args:
+            request_id: 请求ID
+            data: PNG字节数据
+            frame_id: 帧ID，提供时服务器会把该帧保存为增量上传的基准帧
+            
+        Returns:
+            是否上传成功
+        """
+        try:
+            response = self.send_chunked(self.session, request_id, data, frame_id)
+            response.raise_for_status()
+            
+            if frame_id:
+                acked = response.json().get("frame_id") == frame_id
+                self._base_frame_id = frame_id if acked else None
+            
+            logger.info(f"分块上传成功，请求ID: {request_id}，大小: {len(data) / 1024:.0f} KB")
+            return True
+            
+        except requests.RequestException as e:
+            logger.error(f"分块上传失败: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"分块上传时发生未知错误: {e}")
+            return False
+    
+    def build_delta_payload(self, request_id: str, image: Image.Image) -> Optional[Dict[str, Any]]:
+        """
+        构造相对基准帧的增量上传数据
+        
+        Args:
+            request_id: 请求ID
+            image: 新截取的画面
+            
+        Returns:
+            增量上传的请求体；无基准帧、需要关键帧或变化过多时返回None
+        """
+        base = self._base_frame
+        if (not self.delta_upload or base is None or self._base_frame_id is None
+                or base.size != image.size or base.mode != image.mode
+                or self._frames_since_keyframe >= self.keyframe_interval):
+            return None
+        
+        changed = find_changed_tiles(base, image, self.tile_size)
+        if len(changed) > count_tiles(image.size, self.tile_size) * MAX_DELTA_TILE_RATIO:
+            return None
+        
+        tiles = [
+            {
+                "x": box[0],
+                "y": box[1],
+                "image_data": base64.b64encode(encode_png_bytes(image.crop(box))).decode('utf-8')
+            }
+            for box in changed
+        ]
+        return {
+            "request_id": request_id,
+            "base_frame_id": self._base_frame_id,
+            "frame_id": uuid.uuid4().hex,
+            "width": image.width,
+            "height": image.height,
+            "tiles": tiles
+        }
+    
+    def upload_delta(self, payload: Dict[str, Any]) -> Optional[bool]:
+        """
+        上传增量图块
+        
+        Args:
+            payload: build_delta_payload 构造的请求体
+            
+        Returns:
+            True表示成功；False表示失败；None表示服务器基准帧不一致，需要完整上传
+        """
+        try:
+            response = self.session.post(
+                f"{self.server_url}/api/upload-screenshot-delta",
+                json=payload,
+                timeout=self.timeout
+            )
+            if response.status_code == 409:
+                logger.info("服务器基准帧不一致，回退为完整上传")
+                return None
+            response.raise_for_status()
+            
+            self._base_frame_id = payload["frame_id"]
+            logger.info(f"增量上传成功，请求ID: {payload['request_id']}，变化图块: {len(payload['tiles'])}")
+            return True
+            
+        except requests.RequestException as e:
+            logger.error(f"增量上传失败: {e}")
+            return False
+    
+    def upload_image(self, request_id: str, image: Image.Image) -> bool:
+        """
+        上传截取的画面，优先使用图块增量，必要时回退为完整关键帧
+        
+        Args:
+            request_id: 请求ID
+            image: 截取到的PIL图像
+            
+        Returns:
+            是否上传成功
+        """
+        payload = self.build_delta_payload(request_id, image)
+        if payload is not None:
+            result = self.upload_delta(payload)
+            if result is not None:
+                if result:
+                    self._base_frame = image
+                    self._frames_since_keyframe += 1
+                return result
+            self._base_frame_id = None
+        
+        png = encode_png_bytes(image, self.encode_workers)
+        frame_id = uuid.uuid4().hex if self.delta_upload else None
+        if len(png) >= CHUNKED_UPLOAD_THRESHOLD:
+            success = self.upload_chunked(request_id, png, frame_id)
+        else:
+            success = self.upload_screenshot(request_id, base64.b64encode(png).decode('utf-8'), frame_id)
+        if success and self._base_frame_id:
+            self._base_frame = image
+            self._frames_since_keyframe = 0
+        return success
+    
+    def prepare_image(self, request: Dict[str, Any]) -> Image.Image:
+        """
+        为请求准备要上传的画面：截图（或取用保留的原图）并按手机端尺寸缩小
+        
+        Args:
+            request: 截图请求信息
+            
+        Returns:
+            要上传的PIL图像
+        """
+        request_id = request.get("request_id")
+        source_id = request.get("full_resolution_of")
+        image = self._recent_frames.get(source_id) if source_id else None
+        if image is not None:
+            # 手机端请求之前某次截图的原图，直接使用保留的原始画面
+            logger.info(f"使用请求 {source_id} 的原始画面")
+        else:
+            image = self.capture_image()
+            self._remember_frame(request_id, image)
+        
+        # 按手机端显示尺寸缩小，编码和传输量随缩放比例的平方下降
+        target_width = get_target_width(request)
+        if target_width and target_width < image.width:
+            original_size = image.size
+            image = downscale_image(image, target_width)
+            logger.info(f"画面已按手机端尺寸缩小: {original_size[0]}x{original_size[1]} -> {image.width}x{image.height}")
+        return image
+    
     def process_screenshot_request(self, request: Dict[str, Any]) -> bool:
         """
         处理单个截图请求
@@ -150,20 +1235,22 @@ class ScreenshotClient:
         """
         request_id = request.get("request_id")
         user_id = request.get("user_id")
+        received_at = time.time()
         
         logger.info(f"开始处理截图请求 - ID: {request_id}, 用户: {user_id}")
         
         try:
             # 截图
-            image_data = self.take_screenshot()
+            image = self.prepare_image(request)
             
-            # 上传截图
-            success = self.upload_screenshot(request_id, image_data)
+            # 上传截图（增量或完整）
+            success = self.upload_image(request_id, image)
             
             if success:
                 logger.info(f"截图请求处理完成 - ID: {request_id}")
             else:
                 logger.error(f"截图请求处理失败 - ID: {request_id}")
+                self.spool_failed_upload(request_id, image, received_at)
             
             return success
             
@@ -171,6 +1258,150 @@ class ScreenshotClient:
             logger.error(f"处理截图请求时发生错误 - ID: {request_id}, 错误: {e}")
             return False
     
+    def spool_failed_upload(self, request_id: str, image: Image.Image, received_at: float) -> bool:
+        """
+        把上传失败的截图写入磁盘暂存，由后台线程在租约内重试
+        
+        Args:
+            request_id: 请求ID
+            image: 要上传的画面
+            received_at: 收到请求的时间，租约从此时开始计算
+            
+        Returns:
+            是否已暂存
+        """
+        if self.spool is None:
+            return False
+        try:
+            spooled = self.spool.put(request_id, encode_png_bytes(image, self.encode_workers),
+                                     received_at + self.spool_lease)
+        except OSError as e:
+            logger.error(f"写入上传暂存失败 - ID: {request_id}, 错误: {e}")
+            return False
+        if spooled:
+            logger.info(f"截图已暂存，稍后重试上传 - ID: {request_id}")
+        else:
+            logger.error(f"截图超过暂存容量上限，已丢弃 - ID: {request_id}")
+        return spooled
+    
+    def retry_spooled_upload(self, session: requests.Session, request_id: str):
+        """重试一个暂存的上传，并根据结果更新暂存队列"""
+        # requests.RequestException 是 OSError 的子类，读取失败和网络失败必须分开捕获，
+        # 否则连接失败也会被当作文件损坏而丢弃暂存的截图
+        try:
+            data = self.spool.read(request_id)
+        except OSError as e:
+            logger.error(f"读取暂存截图失败 - ID: {request_id}, 错误: {e}")
+            self.spool.reject(request_id)
+            return
+        try:
+            if len(data) >= CHUNKED_UPLOAD_THRESHOLD:
+                response = self.send_chunked(session, request_id, data)
+            else:
+                response = session.post(
+                    f"{self.server_url}/api/upload-screenshot",
+                    json={"request_id": request_id, "image_data": base64.b64encode(data).decode('utf-8')},
+                    timeout=self.timeout
+                )
+        except requests.RequestException as e:
+            logger.warning(f"暂存上传重试失败 - ID: {request_id}, 错误: {e}")
+            self.spool.mark_retry(request_id)
+            return
+        
+        if response.status_code == 404:
+            logger.warning(f"服务器已不存在该请求，放弃暂存上传 - ID: {request_id}")
+            self.spool.reject(request_id)
+        elif response.ok:
+            self.spool.complete(request_id)
+            stats = self.spool.get_stats()
+            logger.info(f"暂存上传重试成功 - ID: {request_id}，剩余暂存 {stats['entries']} 个 / "
+                        f"{stats['bytes'] / 1024:.0f} KB")
+        else:
+            logger.warning(f"暂存上传重试失败 - ID: {request_id}, 状态码: {response.status_code}")
+            self.spool.mark_retry(request_id)
+    
+    def _spool_worker_loop(self):
+        """后台线程：按退避计划重试暂存的上传，丢弃租约过期的条目"""
+        with requests.Session() as session:
+            while not self._spool_stop.is_set():
+                expired = self.spool.expire()
+                if expired:
+                    logger.warning(f"{expired} 个暂存上传已超过租约，放弃重试")
+                for entry in self.spool.due():
+                    if self._spool_stop.is_set():
+                        break
+                    self.retry_spooled_upload(session, entry["request_id"])
+                
+                wakeup = self.spool.next_wakeup()
+                delay = 1.0 if wakeup is None else min(1.0, max(0.05, wakeup - self.spool.clock()))
+                self._spool_stop.wait(delay)
+    
+    def start_spool_worker(self):
+        """启动暂存重试线程（未配置暂存队列时不做任何事）"""
+        if self.spool is None or (self._spool_thread and self._spool_thread.is_alive()):
+            return
+        self._spool_stop.clear()
+        self._spool_thread = threading.Thread(target=self._spool_worker_loop, name="upload-spool", daemon=True)
+        self._spool_thread.start()
+    
+    def get_spool_stats(self) -> Optional[Dict[str, Any]]:
+        """暂存队列统计，未配置暂存队列时返回None"""
+        return self.spool.get_stats() if self.spool else None
+    
+    def set_live_mode(self, fps: Optional[float], max_width: Optional[int] = None):
+        """
+        根据服务器的提示启动实时推流
+        
+        Args:
+            fps: 目标帧率，None或0表示当前没有手机订阅（推流线程会在服务器报告无人观看后自行停止）
+            max_width: 推送画面的最大宽度
+        """
+        if not fps:
+            return
+        self.live_fps = fps
+        self.live_max_width = max_width or LIVE_DEFAULT_MAX_WIDTH
+        if self._live_thread and self._live_thread.is_alive():
+            return
+        self._live_stop.clear()
+        self._live_thread = threading.Thread(target=self._live_worker_loop, name="live-stream", daemon=True)
+        self._live_thread.start()
+        logger.info(f"有手机订阅实时画面，开始推流: {fps:g} 帧/秒，最大宽度 {self.live_max_width}")
+    
+    def _live_worker_loop(self):
+        """后台线程：按目标帧率截图并推送JPEG帧，服务器报告无人观看或连续失败时停止"""
+        frames = failures = 0
+        with requests.Session() as session:
+            while not self._live_stop.is_set():
+                started = time.monotonic()
+                try:
+                    data = encode_live_frame(self.capture_backend.grab(self._capture_bbox()), self.live_max_width)
+                    response = session.post(f"{self.server_url}/api/live/frame", data=data, params=self.room_params,
+                                            headers={"Content-Type": "image/jpeg"}, timeout=self.timeout)
+                    response.raise_for_status()
+                    result = response.json()
+                except Exception as e:
+                    failures += 1
+                    logger.warning(f"实时帧推送失败 (连续 {failures} 次): {e}")
+                    if failures >= LIVE_FAILURE_LIMIT:
+                        break
+                    self._live_stop.wait(1.0)
+                    continue
+                
+                frames += 1
+                failures = 0
+                if not result.get("viewers"):
+                    break
+                self.live_fps = result.get("fps") or self.live_fps
+                # 截图、编码和上传的耗时计入帧间隔，跟不上目标帧率时直接推送下一帧
+                self._live_stop.wait(max(0.0, 1 / self.live_fps - (time.monotonic() - started)))
+        logger.info(f"实时推流已停止，共推送 {frames} 帧")
+    
+    def _remember_frame(self, request_id: str, image: Image.Image):
+        """保留最近的原始画面，超出容量时丢弃最早的"""
+        self._recent_frames[request_id] = image
+        while len(self._recent_frames) > RECENT_FRAMES_CAPACITY:
+            self._recent_frames.popitem(last=False)
+    
     def test_connection(self) -> bool:
         """
         测试与服务器的连接
@@ -179,7 +1410,8 @@ class ScreenshotClient:
             连接是否正常
         """
         try:
-            response = self.session.get(f"{self.server_url}/api/check-requests")
+            response = self.session.get(f"{self.server_url}/api/check-requests", params=self.room_params,
+                                    timeout=self.timeout)
             response.raise_for_status()
             logger.info("服务器连接测试成功")
             return True
@@ -187,32 +1419,57 @@ class ScreenshotClient:
             logger.error(f"服务器连接测试失败: {e}")
             return False
     
-    def run(self, poll_interval: float = 0.8):
+    def run(self, poll_interval: float = 0.8, max_poll_interval: float = DEFAULT_MAX_POLL_INTERVAL):
         """
         启动客户端主循环
         
         Args:
-            poll_interval: 轮询间隔（秒）
+            poll_interval: 最小轮询间隔（秒），有请求时使用
+            max_poll_interval: 长时间空闲时的最大轮询间隔（秒）
         """
         logger.info("截图客户端启动中...")
         
-        # 测试连接
+        # 测试连接，失败时不退出，由主循环按退避策略持续重连
         if not self.test_connection():
-            logger.error("无法连接到服务器，请检查服务器地址和网络连接")
-            return
+            logger.error("无法连接到服务器，将持续重试，请检查服务器地址和网络连接")
         
         self.running = True
-        consecutive_errors = 0
-        max_consecutive_errors = 5
+        self._stop_event.clear()
+        scheduler = AdaptivePollScheduler(poll_interval, max_poll_interval)
+        self.start_spool_worker()
+        if self.profile_on_start:
+            self.profiler.start()
         
-        logger.info(f"开始轮询服务器，间隔: {poll_interval} 秒")
+        logger.info(f"开始轮询服务器，间隔: {poll_interval} - {scheduler.max_interval} 秒（空闲时自动放慢）")
         logger.info("按 Ctrl+C 停止客户端")
         
         try:
             while self.running:
+                self.apply_profile_toggle()
                 try:
                     # 检查是否有新请求
-                    requests_list = self.check_requests()
+                    requests_list, hint = self.fetch_requests()
+                    
+                except KeyboardInterrupt:
+                    logger.info("接收到停止信号")
+                    break
+                    
+                except Exception as e:
+                    delay = scheduler.record_error()
+                    logger.error(f"轮询服务器失败 (连续 {scheduler.consecutive_errors} 次)，{delay:.1f} 秒后重连: {e}")
+                    self._stop_event.wait(delay)
+                    continue
+                
+                if scheduler.consecutive_errors:
+                    logger.info("已重新连接到服务器")
+                
+                try:
+                    if requests_list:
+                        scheduler.record_activity()
+                    else:
+                        scheduler.record_idle()
+                    scheduler.set_server_hint(hint)
+                    scheduler.set_heartbeat_interval(self.heartbeat_interval)
                     
                     # 处理所有待处理的请求
                     for request in requests_list:
@@ -220,34 +1477,34 @@ class ScreenshotClient:
                             break
                         self.process_screenshot_request(request)
                     
-                    # 重置错误计数
-                    consecutive_errors = 0
-                    
-                    # 等待下次轮询
-                    time.sleep(poll_interval)
+                    # 等待下次轮询（stop() 可立即唤醒）
+                    self._stop_event.wait(scheduler.next_delay())
                     
                 except KeyboardInterrupt:
                     logger.info("接收到停止信号")
                     break
-                    
-                except Exception as e:
-                    consecutive_errors += 1
-                    logger.error(f"轮询循环中发生错误 ({consecutive_errors}/{max_consecutive_errors}): {e}")
-                    
-                    if consecutive_errors >= max_consecutive_errors:
-                        logger.error("连续错误次数过多，停止客户端")
-                        break
-                    
-                    # 等待更长时间后重试
-                    time.sleep(poll_interval * 2)
         
         finally:
             self.running = False
+            self.profiler.stop()
             logger.info("截图客户端已停止")
     
     def stop(self):
         """停止客户端"""
         self.running = False
+        self._stop_event.set()
+        self._spool_stop.set()
+        self._live_stop.set()
+    
+    def request_profile_toggle(self):
+        """请求开启或关闭性能分析，在下一次轮询前生效（可在信号处理函数中调用）"""
+        self._profile_toggle.set()
+    
+    def apply_profile_toggle(self):
+        """处理切换请求"""
+        if self._profile_toggle.is_set():
+            self._profile_toggle.clear()
+            self.profiler.toggle()
     
     def set_capture_region(self, region: Optional[Tuple[int, int, int, int]]):
         """
@@ -284,9 +1541,6 @@ class RegionSelector:
             import tkinter as tk
             from tkinter import messagebox
             
-            # 先全屏截图作为背景
-            screenshot = ImageGrab.grab()
-            
             # 创建全屏窗口
             root = tk.Tk()
             root.attributes('-fullscreen', True)
@@ -466,23 +1720,31 @@ def main():
     print("请确保服务器已启动并且网络连通")
     print()
     
+    # 读取配置文件中的默认值
+    config = load_client_config()
+    
     # 截图区域配置
     capture_region = get_capture_region()
     
     # 服务器地址配置
-    server_url = input("\n请输入服务器地址 (默认: https://qrcode.zeabur.app): ").strip()
+    server_url = input(f"\n请输入服务器地址 (默认: {config['server_url']}): ").strip()
     if not server_url:
-        server_url = "https://qrcode.zeabur.app"
+        server_url = config["server_url"]
     
     # 轮询间隔配置
     try:
-        poll_interval = float(input("请输入轮询间隔秒数 (默认: 0.8): ") or "0.8")
+        poll_interval = float(input(f"请输入轮询间隔秒数 (默认: {config['poll_interval']}): ") or config["poll_interval"])
     except ValueError:
-        poll_interval = 0.8
+        poll_interval = config["poll_interval"]
+    
+    # 截图后端配置
+    capture_backend = create_capture_backend_from_config(config)
     
     print(f"\n=== 配置信息 ===")
     print(f"服务器地址: {server_url}")
-    print(f"轮询间隔: {poll_interval} 秒")
+    print(f"房间: {config['room'] or '默认'}")
+    print(f"轮询间隔: {poll_interval} 秒（空闲时最长 {config['max_poll_interval']} 秒）")
+    print(f"截图后端: {capture_backend.name}")
     if capture_region:
         print(f"截图区域: x={capture_region[0]}, y={capture_region[1]}, width={capture_region[2]}, height={capture_region[3]}")
     else:
@@ -491,16 +1753,24 @@ def main():
     print("\n正在启动客户端...")
     
     # 创建并启动客户端
-    client = ScreenshotClient(server_url, capture_region)
+    spool = UploadSpool(config["spool_dir"], int(config["spool_max_mb"] * 1024 * 1024)) if config["spool_dir"] else None
+    client = ScreenshotClient(server_url, capture_region, capture_backend=capture_backend,
+                              spool=spool, spool_lease=config["spool_lease_seconds"], room=config["room"],
+                              profile=config["profile"], profile_path=config["profile_path"])
+    profile_signal = install_profile_signal(client)
+    if profile_signal:
+        print(f"性能分析: {'已开启' if config['profile'] else '未开启'}，发送 {profile_signal} 可随时切换"
+              f"（结果保存到 {config['profile_path']}）")
     
     try:
-        client.run(poll_interval)
+        client.run(poll_interval, config["max_poll_interval"])
     except KeyboardInterrupt:
         logger.info("用户手动停止客户端")
     except Exception as e:
         logger.error(f"客户端运行时发生未知错误: {e}")
     finally:
         client.stop()
+        capture_backend.close()
         print("\n客户端已停止")
 
 if __name__ == "__main__":
@@ -0,0 +1,478 @@
+# screenshot_client_async.py
+# 基于 asyncio 的截图客户端，公开接口与 ScreenshotClient 一致（I/O 方法为协程）
+import asyncio
+import base64
+import hashlib
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+from screenshot_client import (
+    AdaptivePollScheduler, CaptureBackend, CHUNK_RETRY_LIMIT, CHUNKED_UPLOAD_THRESHOLD, DEFAULT_KEYFRAME_INTERVAL,
+    DEFAULT_MAX_POLL_INTERVAL, DEFAULT_PROFILE_PATH, DEFAULT_SPOOL_LEASE, DEFAULT_TILE_SIZE, ScreenshotClient,
+    UploadSpool, chunk_retry_delay, create_capture_backend_from_config, encode_png_bytes, get_capture_region,
+    install_profile_signal, load_client_config, logger,
+)
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2: pip install httpx[http2]
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 分阶段超时（秒）：建立连接、读取响应、发送请求体、等待连接池空闲连接
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+WRITE_TIMEOUT = 30.0
+POOL_TIMEOUT = 10.0
+# 连接池上限，同时也是并发上传的上限
+MAX_CONNECTIONS = 4
+
+
+class AsyncScreenshotClient(ScreenshotClient):
+    """
+    异步截图客户端
+
+    使用 httpx.AsyncClient 复用有上限的连接池（可用时启用 HTTP/2 长连接），
+    每个阶段都有真实的超时；截图、缩放和编码在线程中执行，不阻塞事件循环；
+    同一批次的多个请求并发上传。启用增量上传时，只有增量需要等待其基准帧上传完成，
+    完整帧和关键帧不等待，与其他上传并发进行。
+    """
+
+    # 协程无法用 cProfile 按调用统计，这里统计在线程中执行的截图/缩放和增量编码
+    profiled_methods = ("prepare_image", "build_delta_payload")
+
+    def __init__(self, server_url: str = "https://qrcode.zeabur.app", capture_region: Optional[Tuple[int, int, int, int]] = None,
+                 delta_upload: bool = True, tile_size: int = DEFAULT_TILE_SIZE,
+                 keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL, encode_workers: Optional[int] = None,
+                 capture_backend: Optional[CaptureBackend] = None, spool: Optional[UploadSpool] = None,
+                 spool_lease: float = DEFAULT_SPOOL_LEASE, max_connections: int = MAX_CONNECTIONS,
+                 room: Optional[str] = None, profile: bool = False, profile_path: str = DEFAULT_PROFILE_PATH):
+        """
+        初始化异步截图客户端
+
+        Args:
+            server_url: 服务器地址，例如 "https://qrcode.zeabur.app"
+            capture_region: 截图区域 (x, y, width, height)，None表示全屏截图
+            delta_upload: 是否启用图块增量上传
+            tile_size: 增量上传的图块边长（像素）
+            keyframe_interval: 每隔多少帧强制完整上传一次关键帧
+            encode_workers: PNG并行编码线程数，None表示使用全部CPU核心
+            capture_backend: 截图后端，None表示使用 ImageGrab
+            spool: 上传失败时的磁盘暂存队列，None表示失败即丢弃
+            spool_lease: 请求租约（秒），暂存的上传只在租约内重试
+            max_connections: 连接池上限，也是并发上传的上限
+            room: 本机所属的房间（展项），None表示默认房间
+            profile: 是否在客户端启动时即开启性能分析
+            profile_path: 性能分析结果（pstats）的保存路径
+        """
+        super().__init__(server_url, capture_region, delta_upload, tile_size, keyframe_interval,
+                         encode_workers, capture_backend, spool, spool_lease, room, profile, profile_path)
+        self.session.close()
+        self.max_connections = max_connections
+        self.session = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=WRITE_TIMEOUT, pool=POOL_TIMEOUT),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self._stop_event = asyncio.Event()
+        # 差分和基准帧状态的更新需要串行（差分在线程中读取基准帧），网络往返不在锁内
+        self._delta_lock = asyncio.Lock()
+        # 最新基准帧的上传结果（Future，服务器接受时为True），以它为基准的增量等它完成后再发送
+        self._chain_tail: Optional[asyncio.Future] = None
+        # 截图和增量状态只能在一个线程里顺序访问
+        self._capture_lock = asyncio.Lock()
+        self._upload_slots = asyncio.Semaphore(max_connections)
+        logger.info(f"异步客户端连接池: {max_connections} 个连接，HTTP/2: {'启用' if HTTP2_AVAILABLE else '不可用'}")
+
+    async def take_screenshot(self) -> str:
+        """
+        截取屏幕并返回base64编码的图片数据
+
+        Returns:
+            base64编码的PNG图片字符串
+        """
+        image = await asyncio.to_thread(self.capture_image)
+        png = await asyncio.to_thread(encode_png_bytes, image, self.encode_workers)
+        image_data = base64.b64encode(png).decode('utf-8')
+        logger.info(f"截图编码完成，图片大小: {len(image_data)} 字符")
+        return image_data
+
+    async def fetch_requests(self) -> Tuple[List[Dict[str, Any]], Optional[float]]:
+        """
+        向服务器拉取新的截图请求，失败时抛出异常
+
+        Returns:
+            (待处理的请求列表, 服务器建议的下次轮询等待秒数或None)
+        """
+        response = await self.session.get(f"{self.server_url}/api/check-requests", params=self.room_params)
+        response.raise_for_status()
+
+        data = response.json()
+        hint = data.get("next_poll_after")
+        self.heartbeat_interval = data.get("heartbeat_interval")
+        # 实时推流使用独立线程和同步连接，与主循环互不阻塞
+        self.set_live_mode(data.get("live_fps"), data.get("live_max_width"))
+        if data.get("has_requests", False):
+            requests_list = data.get("requests", [])
+            logger.info(f"发现 {len(requests_list)} 个待处理的截图请求")
+            return requests_list, hint
+
+        return [], hint
+
+    async def check_requests(self) -> List[Dict[str, Any]]:
+        """
+        检查服务器是否有新的截图请求
+
+        Returns:
+            待处理的请求列表
+        """
+        try:
+            return (await self.fetch_requests())[0]
+        except httpx.HTTPError as e:
+            logger.error(f"检查请求失败: {e}")
+            return []
+        except ValueError as e:
+            logger.error(f"解析服务器响应失败: {e}")
+            return []
+
+    async def upload_screenshot(self, request_id: str, image_data: str, frame_id: Optional[str] = None) -> bool:
+        """
+        上传截图到服务器
+
+        Args:
+            request_id: 请求ID
+            image_data: base64编码的图片数据
+            frame_id: 帧ID，提供时服务器会把该帧保存为增量上传的基准帧
+
+        Returns:
+            是否上传成功
+        """
+        try:
+            payload = {
+                "request_id": request_id,
+                "image_data": image_data
+            }
+            if frame_id:
+                payload["frame_id"] = frame_id
+
+            async with self._upload_slots:
+                response = await self.session.post(f"{self.server_url}/api/upload-screenshot", json=payload)
+            response.raise_for_status()
+
+            if frame_id and response.json().get("frame_id") != frame_id:
+                self._reject_frame(frame_id)
+
+            logger.info(f"截图上传成功，请求ID: {request_id}")
+            return True
+
+        except httpx.HTTPError as e:
+            logger.error(f"上传截图失败: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"上传截图时发生未知错误: {e}")
+            return False
+
+    async def upload_delta(self, payload: Dict[str, Any]) -> Optional[bool]:
+        """
+        上传增量图块
+
+        Args:
+            payload: build_delta_payload 构造的请求体
+
+        Returns:
+            True表示成功；False表示失败；None表示服务器基准帧不一致，需要完整上传
+        """
+        try:
+            async with self._upload_slots:
+                response = await self.session.post(f"{self.server_url}/api/upload-screenshot-delta", json=payload)
+            if response.status_code == 409:
+                logger.info("服务器基准帧不一致，回退为完整上传")
+                return None
+            response.raise_for_status()
+
+            logger.info(f"增量上传成功，请求ID: {payload['request_id']}，变化图块: {len(payload['tiles'])}")
+            return True
+
+        except httpx.HTTPError as e:
+            logger.error(f"增量上传失败: {e}")
+            return False
+
+    async def upload_chunked(self, request_id: str, data: bytes, frame_id: Optional[str] = None) -> bool:
+        """
+        分块上传截图：初始化 -> 按偏移量上传数据块 -> 完成，失败的数据块从服务器确认的偏移量续传
+
+        Args:
+            request_id: 请求ID
+            data: PNG字节数据
+            frame_id: 帧ID，提供时服务器会把该帧保存为增量上传的基准帧
+
+        Returns:
+            是否上传成功
+        """
+        try:
+            async with self._upload_slots:
+                response = await self.session.post(f"{self.server_url}/api/upload-init", json={
+                    "request_id": request_id,
+                    "total_size": len(data),
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                    "frame_id": frame_id
+                })
+                response.raise_for_status()
+
+                info = response.json()
+                chunk_url = f"{self.server_url}/api/upload-chunk/{info['upload_id']}"
+                offset, chunk_size = info["offset"], info["chunk_size"]
+                failures = 0
+                while offset < len(data):
+                    try:
+                        response = await self.session.put(chunk_url, params={"offset": offset},
+                                                          content=data[offset:offset + chunk_size],
+                                                          headers={"Content-Type": "application/octet-stream"})
+                        if response.status_code == 409:
+                            # 偏移量不一致或上一个数据块仍在写入：同样计入重试次数并退避
+                            offset = response.json()["offset"]
+                            failures += 1
+                            if failures > CHUNK_RETRY_LIMIT:
+                                response.raise_for_status()
+                            await asyncio.sleep(chunk_retry_delay(failures))
+                            continue
+                        response.raise_for_status()
+                        offset = response.json()["offset"]
+                        failures = 0
+                    except httpx.HTTPError as e:
+                        failures += 1
+                        if failures > CHUNK_RETRY_LIMIT:
+                            raise
+                        logger.warning(f"数据块上传失败，准备续传 - ID: {request_id}, 偏移量: {offset}, 错误: {e}")
+                        await asyncio.sleep(chunk_retry_delay(failures))
+                        try:
+                            offset = (await self.session.get(chunk_url)).json()["offset"]
+                        except (httpx.HTTPError, ValueError, KeyError):
+                            pass
+
+                response = await self.session.post(f"{self.server_url}/api/upload-finalize/{info['upload_id']}")
+            response.raise_for_status()
+
+            if frame_id and response.json().get("frame_id") != frame_id:
+                self._reject_frame(frame_id)
+
+            logger.info(f"分块上传成功，请求ID: {request_id}，大小: {len(data) / 1024:.0f} KB")
+            return True
+
+        except httpx.HTTPError as e:
+            logger.error(f"分块上传失败: {e}")
+            return False
+
+    async def _upload_full(self, request_id: str, image: Image.Image, frame_id: Optional[str] = None) -> bool:
+        """编码并完整上传画面，大尺寸截图改用分块上传"""
+        png = await asyncio.to_thread(encode_png_bytes, image, self.encode_workers)
+        if len(png) >= CHUNKED_UPLOAD_THRESHOLD:
+            return await self.upload_chunked(request_id, png, frame_id)
+        return await self.upload_screenshot(request_id, base64.b64encode(png).decode('utf-8'), frame_id)
+
+    def _reject_frame(self, frame_id: str):
+        """该帧未被服务器保存为基准帧：仍是链上最后一帧时下一帧改为完整上传"""
+        if self._base_frame_id == frame_id:
+            self._base_frame_id = None
+
+    async def upload_image(self, request_id: str, image: Image.Image) -> bool:
+        """
+        上传截取的画面，优先使用图块增量，必要时回退为完整关键帧
+
+        锁内只做差分和基准帧状态的更新：构造好本帧后立即把它作为新的基准帧，下一帧可以在
+        本帧上传期间开始差分和编码。服务器只接受以其当前基准帧为基准的增量，所以增量要等
+        基准帧的响应后再发送，基准帧未被接受时改为完整上传；完整帧不依赖其他帧，直接并发上传，
+        与进行中的增量乱序到达时服务器返回409，后续增量回退为完整上传。
+
+        Args:
+            request_id: 请求ID
+            image: 截取到的PIL图像
+
+        Returns:
+            是否上传成功
+        """
+        if not self.delta_upload:
+            return await self._upload_full(request_id, image)
+
+        async with self._delta_lock:
+            payload = await asyncio.to_thread(self.build_delta_payload, request_id, image)
+            frame_id = payload["frame_id"] if payload is not None else uuid.uuid4().hex
+            previous = self._chain_tail
+            applied = self._chain_tail = asyncio.get_running_loop().create_future()
+            self._base_frame, self._base_frame_id = image, frame_id
+            self._frames_since_keyframe = self._frames_since_keyframe + 1 if payload is not None else 0
+
+        success = False
+        try:
+            result = None
+            # 某个请求被取消时不影响等待同一基准帧的其他增量
+            if payload is not None and (previous is None or await asyncio.shield(previous)):
+                result = await self.upload_delta(payload)
+            if result is None:
+                success = await self._upload_full(request_id, image, frame_id)
+            else:
+                success = result
+        finally:
+            applied.set_result(success)
+        if not success:
+            self._reject_frame(frame_id)
+        return success
+
+    async def process_screenshot_request(self, request: Dict[str, Any]) -> bool:
+        """
+        处理单个截图请求
+
+        Args:
+            request: 截图请求信息
+
+        Returns:
+            是否处理成功
+        """
+        request_id = request.get("request_id")
+        user_id = request.get("user_id")
+        received_at = time.time()
+
+        logger.info(f"开始处理截图请求 - ID: {request_id}, 用户: {user_id}")
+
+        try:
+            # 截图在线程中按顺序执行，上传可与下一次截图重叠
+            async with self._capture_lock:
+                image = await asyncio.to_thread(self.prepare_image, request)
+
+            success = await self.upload_image(request_id, image)
+
+            if success:
+                logger.info(f"截图请求处理完成 - ID: {request_id}")
+            else:
+                logger.error(f"截图请求处理失败 - ID: {request_id}")
+                await asyncio.to_thread(self.spool_failed_upload, request_id, image, received_at)
+
+            return success
+
+        except Exception as e:
+            logger.error(f"处理截图请求时发生错误 - ID: {request_id}, 错误: {e}")
+            return False
+
+    async def test_connection(self) -> bool:
+        """
+        测试与服务器的连接
+
+        Returns:
+            连接是否正常
+        """
+        try:
+            response = await self.session.get(f"{self.server_url}/api/check-requests", params=self.room_params)
+            response.raise_for_status()
+            logger.info("服务器连接测试成功")
+            return True
+        except Exception as e:
+            logger.error(f"服务器连接测试失败: {e}")
+            return False
+
+    async def _sleep(self, seconds: float):
+        """可被 stop() 立即唤醒的等待"""
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, poll_interval: float = 0.8, max_poll_interval: float = DEFAULT_MAX_POLL_INTERVAL):
+        """
+        启动客户端主循环
+
+        Args:
+            poll_interval: 最小轮询间隔（秒），有请求时使用
+            max_poll_interval: 长时间空闲时的最大轮询间隔（秒）
+        """
+        logger.info("异步截图客户端启动中...")
+
+        if not await self.test_connection():
+            logger.error("无法连接到服务器，将持续重试，请检查服务器地址和网络连接")
+
+        self.running = True
+        self._stop_event.clear()
+        scheduler = AdaptivePollScheduler(poll_interval, max_poll_interval)
+        in_flight = set()
+        # 暂存重试使用独立线程和同步连接，与主循环互不阻塞
+        self.start_spool_worker()
+        if self.profile_on_start:
+            self.profiler.start()
+
+        logger.info(f"开始轮询服务器，间隔: {poll_interval} - {scheduler.max_interval} 秒（空闲时自动放慢）")
+
+        try:
+            while self.running:
+                if self._profile_toggle.is_set():
+                    # 关闭时需等待线程中正在统计的调用结束
+                    await asyncio.to_thread(self.apply_profile_toggle)
+                try:
+                    requests_list, hint = await self.fetch_requests()
+                except (httpx.HTTPError, ValueError) as e:
+                    delay = scheduler.record_error()
+                    logger.error(f"轮询服务器失败 (连续 {scheduler.consecutive_errors} 次)，{delay:.1f} 秒后重连: {e}")
+                    await self._sleep(delay)
+                    continue
+
+                if scheduler.consecutive_errors:
+                    logger.info("已重新连接到服务器")
+
+                if requests_list:
+                    scheduler.record_activity()
+                else:
+                    scheduler.record_idle()
+                scheduler.set_server_hint(hint)
+                scheduler.set_heartbeat_interval(self.heartbeat_interval)
+
+                # 并发处理本批请求，不等待上传完成即可继续轮询
+                for request in requests_list:
+                    task = asyncio.create_task(self.process_screenshot_request(request))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+
+                await self._sleep(scheduler.next_delay())
+
+        finally:
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            await asyncio.to_thread(self.profiler.stop)
+            self.running = False
+            logger.info("异步截图客户端已停止")
+
+    def stop(self):
+        """停止客户端"""
+        self.running = False
+        self._stop_event.set()
+        self._spool_stop.set()
+        self._live_stop.set()
+
+    async def aclose(self):
+        """关闭连接池"""
+        await self.session.aclose()
+
+
+async def async_main():
+    """主函数：读取 client_config.ini 后运行异步客户端"""
+    config = load_client_config()
+    capture_region = get_capture_region()
+    capture_backend = create_capture_backend_from_config(config)
+    spool = UploadSpool(config["spool_dir"], int(config["spool_max_mb"] * 1024 * 1024)) if config["spool_dir"] else None
+    client = AsyncScreenshotClient(config["server_url"], capture_region, capture_backend=capture_backend,
+                                   spool=spool, spool_lease=config["spool_lease_seconds"], room=config["room"],
+                                   profile=config["profile"], profile_path=config["profile_path"])
+    install_profile_signal(client)
+    try:
+        await client.run(config["poll_interval"], config["max_poll_interval"])
+    finally:
+        await client.aclose()
+        capture_backend.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(async_main())
+    except KeyboardInterrupt:
+        print("\n客户端已停止")